@@ -1,9 +1,34 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, Response, stream_with_context
 import pyodbc
 from datetime import datetime, date, timedelta
 from functools import wraps
 import bcrypt
 
+import db_pool
+from config import Config
+from db_pool import get_db_connection
+from models import Employee, month_range
+from search_index import employee_index
+from expiry_index import expiry_index, license_expiry_date
+from employee_import import import_employees
+from id_allocator import employee_id_allocator
+from org_hierarchy import org_hierarchy, employees_under
+from attendance_events import apply_events, AttendanceEventError
+from punch_import import import_punches, load_mapping
+from presence_index import presence_index
+from event_bus import attendance_bus, stream as event_stream
+from write_behind import write_behind_queue
+from work_calendar import work_calendar, set_calendar_day, remove_calendar_day, set_department_weekend
+from shift_rules import shift_rules, set_department_shift, remove_department_shift, mark_absent
+import bulk_operations
+import department_counts
+import attendance_rollup
+import attendance_analytics
+import attendance_stats
+import attendance_history as history
+from department_counts import HEADCOUNTS_SUBQUERY
+from bulk_operations import BulkOperationError
+
 app = Flask(__name__)
 
 # الإعدادات المباشرة
@@ -15,21 +40,33 @@ app.config['DATABASE_PASSWORD'] = 'admin'
 app.config['DATABASE_DRIVER'] = '{ODBC Driver 17 for SQL Server}'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
-# دالة الاتصال بقاعدة البيانات
-def get_db_connection():
-    try:
-        server = app.config['DATABASE_SERVER']
-        database = app.config['DATABASE_NAME']
-        username = app.config['DATABASE_USERNAME']
-        password = app.config['DATABASE_PASSWORD']
-        driver = app.config['DATABASE_DRIVER']
-        
-        connection_string = f'DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-        conn = pyodbc.connect(connection_string)
-        return conn
-    except Exception as e:
-        print(f"❌ خطأ في الاتصال بقاعدة البيانات: {e}")
-        return None
+# إعدادات مجمع الاتصالات
+app.config['DB_POOL_MIN_SIZE'] = 2
+app.config['DB_POOL_MAX_SIZE'] = 20
+app.config['DB_POOL_TIMEOUT'] = 10
+app.config['DB_POOL_RECYCLE'] = 1800
+app.config['DB_POOL_PING_AFTER'] = 5
+app.config['DB_CONNECT_TIMEOUT'] = 5
+
+# إعدادات قاطع الدائرة
+app.config['DB_BREAKER_FAILURE_THRESHOLD'] = 3
+app.config['DB_BREAKER_WINDOW'] = 30
+app.config['DB_BREAKER_COOLDOWN'] = 15
+
+# مجمع اتصالات قاعدة البيانات المشترك
+db_pool.init_app(app)
+
+# تحديث ملخص تواريخ الانتهاء بعد منتصف كل ليلة
+expiry_index.start_daily_refresh()
+
+# وضع الكتابة المؤجلة لأحداث الحضور (رد فوري وكتابة على دفعات في الخلفية)
+app.config['ATTENDANCE_WRITE_BEHIND'] = Config.ATTENDANCE_WRITE_BEHIND
+if app.config['ATTENDANCE_WRITE_BEHIND']:
+    write_behind_queue.start()
+
+# مطابقة دورية لأعداد موظفي الأقسام (بالثواني)
+app.config['DEPARTMENT_COUNTS_RECONCILE_INTERVAL'] = 3600
+department_counts.start_reconciler(app.config['DEPARTMENT_COUNTS_RECONCILE_INTERVAL'])
 
 # ==================== نظام المصادقة والصلاحيات ====================
 
@@ -303,26 +340,56 @@ def index():
 
 # ==================== إدارة الموظفين ====================
 
+def refresh_employee_indexes(employee_id):
+    """تحديث الموظف في فهارس الذاكرة بعد الحفظ (لا يوقف العملية عند الفشل)"""
+    for index in (employee_index, expiry_index, presence_index):
+        try:
+            index.refresh_employee(employee_id)
+        except Exception as e:
+            print(f"❌ تعذر تحديث الفهرس للموظف {employee_id}: {e}")
+    # نقل مدير إلى قسم آخر يغير موقع أقسامه في الهيكل التنظيمي
+    if org_hierarchy.is_manager(employee_id):
+        org_hierarchy.invalidate()
+
+def remove_from_employee_indexes(employee_id):
+    """حذف الموظف من فهارس الذاكرة"""
+    employee_index.remove(employee_id)
+    expiry_index.remove(employee_id)
+    presence_index.remove(employee_id)
+    if org_hierarchy.is_manager(employee_id):
+        org_hierarchy.invalidate()
+
+def invalidate_employee_indexes():
+    """إعادة تحميل فهارس الذاكرة بعد العمليات الجماعية"""
+    employee_index.invalidate()
+    expiry_index.invalidate()
+    presence_index.invalidate()
+    org_hierarchy.invalidate()
+
 @app.route('/employees')
 @login_required
 @permission_required('employees', 'view')
 def employees():
-    """عرض جميع الموظفين"""
+    """عرض الموظفين صفحة بصفحة مع الفلترة من قاعدة البيانات"""
+    filters = {
+        'department_id': request.args.get('department_id', type=int),
+        'status': request.args.get('status') or None,
+        'position': request.args.get('position', '').strip() or None
+    }
+    
     conn = get_db_connection()
     if not conn:
         flash('خطأ في الاتصال بقاعدة البيانات', 'error')
-        return render_template('employees.html', employees=[], departments=[])
+        return render_template('employees.html', employees=[], departments=[], filters=filters, next_cursor=None)
     
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT e.*, d.name as department_name 
-            FROM Employees e 
-            LEFT JOIN Departments d ON e.department_id = d.id
-            ORDER BY e.created_at DESC
-        ''')
-        employees = cursor.fetchall()
+        employees, next_cursor = Employee.get_page(
+            after=request.args.get('after'),
+            limit=request.args.get('per_page', type=int),
+            **filters
+        )
         
+        cursor = conn.cursor()
         cursor.execute('SELECT id, name FROM Departments')
         departments = cursor.fetchall()
         conn.close()
@@ -330,11 +397,14 @@ def employees():
         return render_template('employees.html', 
                              employees=employees, 
                              departments=departments,
+                             filters=filters,
+                             next_cursor=next_cursor,
+                             is_first_page=not request.args.get('after'),
                              user_role=session.get('role'))
                              
     except Exception as e:
         flash(f'حدث خطأ: {str(e)}', 'error')
-        return render_template('employees.html', employees=[], departments=[])
+        return render_template('employees.html', employees=[], departments=[], filters=filters, next_cursor=None)
     
 @app.route('/add_employee', methods=['GET', 'POST'])
 @login_required
@@ -349,10 +419,8 @@ def add_employee():
                 raise pyodbc.Error("فشل الاتصال بقاعدة البيانات")
 
             cursor = conn.cursor()
-            # إنشاء معرف موظف تلقائي
-            cursor.execute('SELECT COUNT(*) FROM Employees')
-            count = cursor.fetchone()[0]
-            employee_id = f"EMP{count + 1:03d}"
+            # إنشاء معرف موظف تلقائي من التسلسل (بدون تكرار بين العمليات المتزامنة)
+            employee_id = employee_id_allocator.next_id()
             
             # استقبال البيانات من النموذج
             first_name = request.form['first_name']
@@ -382,16 +450,8 @@ def add_employee():
             ContractStart=request.form.get('contract_start') if request.form.get('contract_start') else None
             ContractEnd=request.form.get('contract_end') if request.form.get('contract_end') else None
 
-            # --- إعادة ترتيب منطق حساب تاريخ انتهاء الرخصة ---
-            LicenseExpiryDate_str = None
-            if LicenseIssuanceDate_str and LicenseType:
-                LicenseIssuanceDate_obj = datetime.strptime(LicenseIssuanceDate_str, "%Y-%m-%d")
-                if LicenseType == 'خاصة':
-                    LicenseExpiryDate_obj = LicenseIssuanceDate_obj.replace(year=LicenseIssuanceDate_obj.year + 10)
-                    LicenseExpiryDate_str = LicenseExpiryDate_obj.strftime("%Y-%m-%d")
-                elif LicenseType == 'مهنية':
-                    LicenseExpiryDate_obj = LicenseIssuanceDate_obj.replace(year=LicenseIssuanceDate_obj.year + 5)
-                    LicenseExpiryDate_str = LicenseExpiryDate_obj.strftime("%Y-%m-%d")
+            # حساب تاريخ انتهاء الرخصة حسب نوعها
+            LicenseExpiryDate_str = license_expiry_date(LicenseIssuanceDate_str, LicenseType)
 
             # إدخال الموظف الجديد والحصول على ID
             cursor.execute('''
@@ -414,6 +474,9 @@ def add_employee():
             cursor.execute("SELECT SCOPE_IDENTITY();")
             employee_id_db = cursor.fetchone()[0]
             
+            # تحديث عدد موظفي القسم في نفس المعاملة
+            department_counts.employee_added(cursor, department_id, status)
+            
             # معالجة الصورة الشخصية إذا تم رفعها
             if 'profile_photo' in request.files:
                 file = request.files['profile_photo']
@@ -474,6 +537,7 @@ def add_employee():
                             ))
             
             conn.commit()
+            refresh_employee_indexes(int(employee_id_db))
             
             if files_uploaded:
                 flash('تم إضافة الموظف بنجاح مع الملفات المرفوعة', 'success')
@@ -505,6 +569,99 @@ def add_employee():
     
     return render_template('add_employee.html', departments=departments, today=today)
 
+@app.route('/api/employees/import', methods=['POST'])
+@login_required
+@permission_required('employees', 'create')
+def api_import_employees():
+    """استيراد الموظفين من ملف CSV أو XLSX"""
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'success': False, 'message': 'لم يتم اختيار ملف'})
+    
+    file = request.files['file']
+    dry_run = request.form.get('dry_run') in ('1', 'true', 'on')
+    
+    try:
+        report = import_employees(file.stream, file.filename, dry_run=dry_run)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ أثناء الاستيراد: {str(e)}'})
+    
+    if report['inserted'] and not dry_run:
+        invalidate_employee_indexes()
+    
+    if dry_run:
+        message = f"{report['validated']} من {report['total']} موظف صالح للاستيراد (بدون إدخال)"
+    else:
+        message = f"تم استيراد {report['inserted']} من {report['total']} موظف"
+    return jsonify({
+        'success': True,
+        'message': message,
+        'report': report
+    })
+
+def run_bulk_operation(operation, **kwargs):
+    """تنفيذ عملية جماعية وإرجاع النتيجة بصيغة JSON"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+    
+    try:
+        result = operation(conn, **kwargs)
+        conn.close()
+    except BulkOperationError as e:
+        conn.close()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        conn.close()
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    
+    if result['dry_run']:
+        message = f"سيتم تعديل {result['affected']} موظف"
+    else:
+        message = f"تم تعديل {result['affected']} موظف بنجاح"
+    return jsonify({'success': True, 'message': message, **result})
+
+@app.route('/api/employees/bulk/raise', methods=['POST'])
+@login_required
+@permission_required('employees', 'edit')
+def api_bulk_raise():
+    """زيادة رواتب قسم بنسبة مئوية"""
+    data = request.get_json() or {}
+    return run_bulk_operation(bulk_operations.raise_salaries,
+                              department_id=data.get('department_id'),
+                              percent=data.get('percent'),
+                              status=data.get('status', 'active'),
+                              dry_run=bool(data.get('dry_run')))
+
+@app.route('/api/employees/bulk/transfer', methods=['POST'])
+@login_required
+@permission_required('employees', 'edit')
+def api_bulk_transfer():
+    """نقل مجموعة موظفين إلى قسم آخر"""
+    data = request.get_json() or {}
+    response = run_bulk_operation(bulk_operations.transfer_employees,
+                                  employee_ids=data.get('employee_ids'),
+                                  department_id=data.get('department_id'),
+                                  dry_run=bool(data.get('dry_run')))
+    if not data.get('dry_run'):
+        invalidate_employee_indexes()
+    return response
+
+@app.route('/api/employees/bulk/status', methods=['POST'])
+@login_required
+@permission_required('employees', 'edit')
+def api_bulk_status():
+    """تغيير حالة مجموعة موظفين"""
+    data = request.get_json() or {}
+    response = run_bulk_operation(bulk_operations.change_status,
+                                  employee_ids=data.get('employee_ids'),
+                                  status=data.get('status'),
+                                  dry_run=bool(data.get('dry_run')))
+    if not data.get('dry_run'):
+        invalidate_employee_indexes()
+    return response
+
 @app.route('/edit_employee/<int:employee_id>', methods=['GET', 'POST'])
 @login_required
 @permission_required('employees', 'edit')
@@ -546,15 +703,7 @@ def edit_employee(employee_id):
             ContractEnd = request.form.get('contract_end') if request.form.get('contract_end') else None
 
             # إعادة حساب تاريخ انتهاء الرخصة عند التعديل
-            LicenseExpiryDate_str = None
-            if LicenseIssuanceDate_str and LicenseType:
-                LicenseIssuanceDate_obj = datetime.strptime(LicenseIssuanceDate_str, "%Y-%m-%d")
-                if LicenseType == 'خاصة':
-                    LicenseExpiryDate_obj = LicenseIssuanceDate_obj.replace(year=LicenseIssuanceDate_obj.year + 10)
-                    LicenseExpiryDate_str = LicenseExpiryDate_obj.strftime("%Y-%m-%d")
-                elif LicenseType == 'مهنية':
-                    LicenseExpiryDate_obj = LicenseIssuanceDate_obj.replace(year=LicenseIssuanceDate_obj.year + 5)
-                    LicenseExpiryDate_str = LicenseExpiryDate_obj.strftime("%Y-%m-%d")
+            LicenseExpiryDate_str = license_expiry_date(LicenseIssuanceDate_str, LicenseType)
             
             cursor = conn.cursor()
             cursor.execute('''
@@ -565,6 +714,7 @@ def edit_employee(employee_id):
                     LicenseExpiryDate=?, AcademicQualification=?, GraduationDate=?, Appreciation=?, 
                     InsuranceNumber=?, BankAccountNumber=?, SalaryDisbursementMethod=?, 
                     ContractType=?, ContractStart=?, ContractEnd=?, updated_at=GETDATE()
+                OUTPUT deleted.department_id, deleted.status
                 WHERE id=?
             ''', (first_name, last_name, email, phone, address, department_id,
                   position, salary, hire_date, birth_date, gender, status,
@@ -572,9 +722,15 @@ def edit_employee(employee_id):
                   LicenseExpiryDate_str, AcademicQualification, GraduationDate, Appreciation,
                   InsuranceNumber, BankAccountNumber, SalaryDisbursementMethod,
                   ContractType, ContractStart, ContractEnd, employee_id))
+            previous = cursor.fetchone()
+            if previous:
+                department_counts.employee_changed(cursor, previous.department_id, previous.status,
+                                                   department_id, status)
+                attendance_rollup.employees_moved(cursor, [(employee_id, previous.department_id, department_id)])
             
             conn.commit()
             conn.close()
+            refresh_employee_indexes(employee_id)
             
             flash('تم تحديث بيانات الموظف بنجاح', 'success')
             return redirect(url_for('employees'))
@@ -582,15 +738,8 @@ def edit_employee(employee_id):
         except Exception as e:
             flash(f'حدث خطأ أثناء التحديث: {str(e)}', 'error')
     
-    # جلب بيانات الموظف الحالية
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT e.*, d.name as department_name 
-        FROM Employees e 
-        LEFT JOIN Departments d ON e.department_id = d.id 
-        WHERE e.id = ?
-    ''', (employee_id,))
-    employee = cursor.fetchone()
+    # جلب بيانات الموظف الحالية (الحقول الأساسية فقط)
+    employee = Employee.get_by_id(employee_id)
     
     if not employee:
         conn.close()
@@ -598,13 +747,24 @@ def edit_employee(employee_id):
         return redirect(url_for('employees'))
     
     # جلب قائمة الأقسام
+    cursor = conn.cursor()
     cursor.execute('SELECT id, name FROM Departments')
     departments = cursor.fetchall()
+    
+    # المستندات المرفوعة (بيانات الملفات فقط؛ المحتوى يُحمّل عبر uploaded_file)
+    cursor.execute('''
+        SELECT id, file_url, file_name, file_type, file_size, file_category, created_at
+        FROM EmployeeFiles
+        WHERE employee_id = ?
+        ORDER BY created_at DESC
+    ''', (employee_id,))
+    documents = cursor.fetchall()
     conn.close()
     
     return render_template('edit_employee.html', 
                          employee=employee, 
-                         departments=departments)
+                         departments=departments,
+                         documents=documents)
 
 @app.route('/delete_employee/<int:employee_id>')
 @login_required
@@ -614,9 +774,18 @@ def delete_employee(employee_id):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM Employees WHERE id=?', (employee_id,))
+        attendance_rollup.employees_removed(cursor, [employee_id])
+        cursor.execute('''
+            DELETE FROM Employees
+            OUTPUT deleted.department_id, deleted.status
+            WHERE id=?
+        ''', (employee_id,))
+        deleted = cursor.fetchone()
+        if deleted:
+            department_counts.employee_removed(cursor, deleted.department_id, deleted.status)
         conn.commit()
         conn.close()
+        remove_from_employee_indexes(employee_id)
         
         flash('تم حذف الموظف بنجاح', 'success')
         return redirect(url_for('employees'))
@@ -639,14 +808,14 @@ def departments():
     
     try:
         cursor = conn.cursor()
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT d.*, 
-                   COUNT(e.id) as employee_count,
+                   ISNULL(hc.employee_count, 0) as employee_count,
+                   ISNULL(hc.active_count, 0) as active_count,
                    m.first_name + ' ' + m.last_name as manager_name
             FROM Departments d 
-            LEFT JOIN Employees e ON d.id = e.department_id
+            LEFT JOIN ({HEADCOUNTS_SUBQUERY}) hc ON d.id = hc.department_id
             LEFT JOIN Employees m ON d.manager_id = m.id
-            GROUP BY d.id, d.name, d.description, d.manager_id, d.created_at, m.first_name, m.last_name
             ORDER BY d.name
         ''')
         departments = cursor.fetchall()
@@ -681,6 +850,7 @@ def add_department():
             
             conn.commit()
             conn.close()
+            org_hierarchy.invalidate()
             
             flash('تم إضافة القسم بنجاح', 'success')
             return redirect(url_for('departments'))
@@ -727,6 +897,7 @@ def edit_department(department_id):
             
             conn.commit()
             conn.close()
+            org_hierarchy.invalidate()
             
             flash('تم تحديث بيانات القسم بنجاح', 'success')
             return redirect(url_for('departments'))
@@ -736,15 +907,15 @@ def edit_department(department_id):
     
     # جلب بيانات القسم الحالية
     cursor = conn.cursor()
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT d.*, 
-               COUNT(e.id) as employee_count,
+               ISNULL(hc.employee_count, 0) as employee_count,
+               ISNULL(hc.active_count, 0) as active_count,
                m.first_name + ' ' + m.last_name as manager_name
         FROM Departments d 
-        LEFT JOIN Employees e ON d.id = e.department_id
+        LEFT JOIN ({HEADCOUNTS_SUBQUERY}) hc ON d.id = hc.department_id
         LEFT JOIN Employees m ON d.manager_id = m.id
         WHERE d.id = ?
-        GROUP BY d.id, d.name, d.description, d.manager_id, d.created_at, m.first_name, m.last_name
     ''', (department_id,))
     department = cursor.fetchone()
     
@@ -790,7 +961,9 @@ def delete_department(department_id):
         cursor = conn.cursor()
         
         # التحقق إذا كان القسم يحتوي على موظفين
-        cursor.execute('SELECT COUNT(*) FROM Employees WHERE department_id = ?', (department_id,))
+        cursor.execute('''
+            SELECT ISNULL(SUM(employee_count), 0) FROM DepartmentHeadcounts WHERE department_id = ?
+        ''', (department_id,))
         employee_count = cursor.fetchone()[0]
         
         if employee_count > 0:
@@ -798,9 +971,11 @@ def delete_department(department_id):
             conn.close()
             return redirect(url_for('departments'))
         
+        cursor.execute('DELETE FROM DepartmentHeadcounts WHERE department_id = ?', (department_id,))
         cursor.execute('DELETE FROM Departments WHERE id = ?', (department_id,))
         conn.commit()
         conn.close()
+        org_hierarchy.invalidate()
         
         flash('تم حذف القسم بنجاح', 'success')
         return redirect(url_for('departments'))
@@ -890,30 +1065,22 @@ def attendance():
             conn.close()
             return render_template('attendance_setup.html')
         
-        # عدد الموظفين النشطين
-        cursor.execute("SELECT COUNT(*) FROM Employees WHERE status = 'active'")
-        active_employees = cursor.fetchone()[0] or 0
-        
-        # الحضور اليوم
-        cursor.execute('''
-            SELECT COUNT(DISTINCT employee_id) 
-            FROM Attendance 
-            WHERE attendance_date = ? 
-            AND status IN ('present', 'late')
-        ''', (today,))
-        today_attendance = cursor.fetchone()[0] or 0
+        # عدد النشطين والحاضرين اليوم من bitmaps الحضور داخل الذاكرة
+        counts = presence_index.counts(today)
+        active_employees = counts['active']
+        today_attendance = counts['present']
         
         # معدل الحضور اليومي
         daily_rate = round((today_attendance / active_employees) * 100, 1) if active_employees > 0 else 0
         
         # الحضور الشهري
+        month_start, month_end = month_range(current_year, current_month)
         cursor.execute('''
             SELECT COUNT(DISTINCT employee_id) 
             FROM Attendance 
-            WHERE MONTH(attendance_date) = ? 
-            AND YEAR(attendance_date) = ? 
+            WHERE attendance_date >= ? AND attendance_date < ?
             AND status IN ('present', 'late')
-        ''', (current_month, current_year))
+        ''', (month_start, month_end))
         monthly_attendance = cursor.fetchone()[0] or 0
         
         # معدل الحضور الشهري
@@ -930,20 +1097,8 @@ def attendance():
         ''', (today,))
         today_records = cursor.fetchall()
         
-        # الموظفين غير المسجل حضورهم اليوم
-        cursor.execute('''
-            SELECT e.id, e.employee_id, e.first_name, e.last_name, e.position, d.name as department_name
-            FROM Employees e
-            LEFT JOIN Departments d ON e.department_id = d.id
-            WHERE e.status = 'active'
-            AND e.id NOT IN (
-                SELECT employee_id 
-                FROM Attendance 
-                WHERE attendance_date = ?
-            )
-            ORDER BY e.first_name, e.last_name
-        ''', (today,))
-        absent_today = cursor.fetchall()
+        # الموظفين غير المسجل حضورهم اليوم (النشطون بدون بت في bitmap اليوم)
+        absent_today = presence_index.absent(today)
         
         conn.close()
         
@@ -968,77 +1123,121 @@ def attendance():
                              absent_today=[],
                              today=date.today())
 
+def record_attendance_events(events):
+    """تطبيق دفعة أحداث حضور/انصراف وإرجاع (بيانات الاستجابة، كود الحالة)"""
+    try:
+        if app.config['ATTENDANCE_WRITE_BEHIND']:
+            results = write_behind_queue.submit(events)
+            # الطابور ممتلئ: الرجوع إلى الكتابة المباشرة
+            if results is not None:
+                return {
+                    'success': True,
+                    'applied': sum(1 for result in results if result['success']),
+                    'results': results
+                }, 202
+        conn = get_db_connection()
+        if not conn:
+            return {'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}, 503
+        try:
+            results = apply_events(conn, events)
+        finally:
+            conn.close()
+        return {
+            'success': True,
+            'applied': sum(1 for result in results if result['success']),
+            'results': results
+        }, 200
+    except AttendanceEventError as e:
+        return {'success': False, 'message': str(e)}, 400
+    except Exception as e:
+        return {'success': False, 'message': f'حدث خطأ: {str(e)}'}, 500
+
+@app.route('/api/attendance/events', methods=['POST'])
+@login_required
+@permission_required('attendance', 'create')
+def api_attendance_events():
+    """تسجيل دفعة أحداث حضور/انصراف من أجهزة البصمة والأكشاك"""
+    data = request.get_json(silent=True) or {}
+    payload, status_code = record_attendance_events(data.get('events'))
+    return jsonify(payload), status_code
+
+@app.route('/api/attendance/write-behind/stats')
+@login_required
+@permission_required('attendance', 'view')
+def api_write_behind_stats():
+    """مقاييس طابور الكتابة المؤجلة (الضغط الخلفي)"""
+    return jsonify({
+        'success': True,
+        'enabled': app.config['ATTENDANCE_WRITE_BEHIND'],
+        'stats': write_behind_queue.stats()
+    })
+
+@app.route('/api/attendance/stream')
+@login_required
+@permission_required('attendance', 'view')
+def api_attendance_stream():
+    """بث مباشر (Server-Sent Events) لأحداث الحضور/الانصراف والعدادات من ناقل الأحداث"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    
+    def snapshot():
+        return {'counters': presence_index.counts(), 'date': date.today().isoformat()}
+    
+    return Response(stream_with_context(event_stream(attendance_bus, snapshot, last_event_id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/attendance/punches/import', methods=['POST'])
+@login_required
+@permission_required('attendance', 'create')
+def api_import_punches():
+    """استيراد سجل أجهزة البصمة (CSV أو ثابت العرض)"""
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'success': False, 'message': 'لم يتم اختيار ملف'})
+    
+    file = request.files['file']
+    dry_run = request.form.get('dry_run') in ('1', 'true', 'on')
+    log_format = request.form.get('format') or None
+    
+    try:
+        mapping = None
+        if request.files.get('map') and request.files['map'].filename:
+            mapping = load_mapping(request.files['map'].stream)
+        report = import_punches(file.stream, file.filename, dry_run=dry_run,
+                                mapping=mapping, log_format=log_format)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ أثناء الاستيراد: {str(e)}'})
+    
+    return jsonify({
+        'success': True,
+        'message': f"تمت معالجة {report['lines']} سطر: {report['inserted']} سجل جديد و{report['updated']} سجل محدث",
+        'report': report
+    })
+
 @app.route('/mark_attendance', methods=['GET', 'POST'])
 @login_required
 @permission_required('attendance', 'create')
 def mark_attendance():
     """تسجيل حضور/انصراف"""
     if request.method == 'POST':
-        try:
-            data = request.get_json()
-            employee_id = data.get('employee_id')
-            action = data.get('action')  # check_in أو check_out
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            current_time = datetime.now().strftime('%H:%M:%S')
-            today = date.today()
-            
-            if action == 'check_in':
-                # التحقق إذا كان قد سجل حضور مسبقاً
-                cursor.execute('''
-                    SELECT id FROM Attendance 
-                    WHERE employee_id = ? AND attendance_date = ?
-                ''', (employee_id, today))
-                
-                existing_record = cursor.fetchone()
-                
-                if existing_record:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'تم تسجيل الحضور مسبقاً'})
-                
-                # تسجيل حضور جديد
-                cursor.execute('''
-                    INSERT INTO Attendance (employee_id, attendance_date, check_in, status)
-                    VALUES (?, ?, ?, 'present')
-                ''', (employee_id, today, current_time))
-                
-                conn.commit()
-                conn.close()
-                return jsonify({'success': True, 'message': 'تم تسجيل الحضور بنجاح'})
-                
-            elif action == 'check_out':
-                # تحديث وقت الانصراف
-                cursor.execute('''
-                    UPDATE Attendance 
-                    SET check_out = ?, updated_at = GETDATE()
-                    WHERE employee_id = ? AND attendance_date = ? AND check_out IS NULL
-                ''', (current_time, employee_id, today))
-                
-                if cursor.rowcount == 0:
-                    conn.close()
-                    return jsonify({'success': False, 'message': 'لم يتم تسجيل حضور لهذا الموظف اليوم أو تم تسجيل الانصراف مسبقاً'})
-                
-                conn.commit()
-                conn.close()
-                return jsonify({'success': True, 'message': 'تم تسجيل الانصراف بنجاح'})
-            
-        except Exception as e:
-            return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'})
+        data = request.get_json(silent=True) or {}
+        payload, status_code = record_attendance_events([{
+            'employee_id': data.get('employee_id'),
+            'action': data.get('action'),  # check_in أو check_out
+            'timestamp': data.get('timestamp'),
+            'idempotency_key': data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+        }])
+        if status_code not in (200, 202):
+            return jsonify(payload), status_code
+        result = payload['results'][0]
+        return jsonify({'success': result['success'], 'message': result['message']})
     
     # إذا كان طلب GET، عرض صفحة تسجيل الحضور
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT e.id, e.employee_id, e.first_name, e.last_name, e.position, d.name as department_name
-        FROM Employees e
-        LEFT JOIN Departments d ON e.department_id = d.id
-        WHERE e.status = 'active'
-        ORDER BY e.first_name, e.last_name
-    ''')
-    employees = cursor.fetchall()
+    employees = presence_index.active()
     
     # جلب سجلات الحضور لليوم
     today = date.today()
@@ -1080,34 +1279,15 @@ def attendance_report():
         year = request.args.get('year', datetime.now().year, type=int)
         department_id = request.args.get('department_id', type=int)
         
-        # بناء الاستعلام الديناميكي
-        query = '''
-            SELECT 
-                e.employee_id,
-                e.first_name + ' ' + e.last_name as employee_name,
-                e.position,
-                d.name as department_name,
-                COUNT(a.id) as days_present,
-                SUM(CASE WHEN a.status = 'late' THEN 1 ELSE 0 END) as days_late,
-                SUM(CASE WHEN a.status = 'absent' THEN 1 ELSE 0 END) as days_absent
-            FROM Employees e
-            LEFT JOIN Departments d ON e.department_id = d.id
-            LEFT JOIN Attendance a ON e.id = a.employee_id 
-                AND MONTH(a.attendance_date) = ? 
-                AND YEAR(a.attendance_date) = ?
-                AND a.status IN ('present', 'late', 'absent')
-        '''
-        
-        params = [month, year]
-        
-        if department_id:
-            query += ' WHERE e.department_id = ?'
-            params.append(department_id)
-        
-        query += ' GROUP BY e.employee_id, e.first_name, e.last_name, e.position, d.name ORDER BY employee_name'
+        # من ملخص الحضور الشهري بدلاً من تجميع سجلات الحضور في كل مرة
+        report_data = attendance_rollup.monthly_report(cursor, year, month, department_id)
         
-        cursor.execute(query, params)
-        report_data = cursor.fetchall()
+        # ساعات العمل والتأخير والإضافي وسلاسل الغياب محسوبة دفعة واحدة بـ NumPy
+        try:
+            analytics = attendance_analytics.employee_metrics(*month_range(year, month), department_id)
+        except Exception as e:
+            print(f"❌ خطأ في تحليلات الحضور: {e}")
+            analytics = {}
         
         # جلب الأقسام للفلتر
         cursor.execute('SELECT id, name FROM Departments ORDER BY name')
@@ -1117,6 +1297,7 @@ def attendance_report():
         
         return render_template('attendance_report.html',
                              report_data=report_data,
+                             analytics=analytics,
                              departments=departments,
                              current_month=month,
                              current_year=year)
@@ -1133,46 +1314,89 @@ def attendance_report():
 @login_required
 @permission_required('attendance', 'view')
 def attendance_history(employee_id):
-    """سجل الحضور لموظف محدد"""
-    conn = get_db_connection()
-    if not conn:
-        flash('خطأ في الاتصال بقاعدة البيانات', 'error')
-        return redirect(url_for('attendance'))
-    
+    """سجل الحضور لموظف محدد (السجلات تُحمّل من /api/attendance/history)"""
     try:
-        # معلومات الموظف
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT e.*, d.name as department_name 
-            FROM Employees e 
-            LEFT JOIN Departments d ON e.department_id = d.id 
-            WHERE e.id = ?
-        ''', (employee_id,))
-        employee = cursor.fetchone()
-        
+        employee = Employee.get_by_id(employee_id)
         if not employee:
-            conn.close()
             flash('الموظف غير موجود', 'error')
             return redirect(url_for('attendance'))
         
-        # سجل الحضور (آخر 30 يوم)
-        cursor.execute('''
-            SELECT TOP 30 * FROM Attendance 
-            WHERE employee_id = ? 
-            ORDER BY attendance_date DESC
-        ''', (employee_id,))
-        attendance_history = cursor.fetchall()
-        
-        conn.close()
-        
         return render_template('attendance_history.html',
                              employee=employee,
-                             attendance_history=attendance_history)
+                             today=date.today())
                              
     except Exception as e:
         flash(f'حدث خطأ: {str(e)}', 'error')
         return redirect(url_for('attendance'))
 
+@app.route('/api/attendance/history/<int:employee_id>')
+@login_required
+@permission_required('attendance', 'view')
+def api_attendance_history(employee_id):
+    """API لسجل حضور موظف لفترة (from/to شاملة) بترقيم keyset عبر before"""
+    try:
+        start = request.args.get('from')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end = request.args.get('to')
+        end = datetime.strptime(end, '%Y-%m-%d').date() + timedelta(days=1) if end else None
+        before = request.args.get('before')
+        before = datetime.strptime(before, '%Y-%m-%d').date() if before else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'}), 400
+    if start and end and start >= end:
+        return jsonify({'success': False, 'message': 'تاريخ البداية بعد تاريخ النهاية'}), 400
+    limit = request.args.get('limit', history.DEFAULT_PAGE_SIZE, type=int)
+    
+    employee = Employee.get_by_id(employee_id)
+    if not employee:
+        return jsonify({'success': False, 'message': 'الموظف غير موجود'}), 404
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 500
+    try:
+        cursor = conn.cursor()
+        records, next_cursor = history.history_page(cursor, employee_id, start, end, before, limit)
+        payload = {'success': True, 'records': records, 'next_cursor': next_cursor}
+        # الإجماليات مع الصفحة الأولى فقط؛ الصفحات التالية لنفس الفترة لا تغيرها
+        if start and not before:
+            payload['totals'] = history.range_totals(cursor, employee_id, start, end or date.today() + timedelta(days=1),
+                                                     employee.department_id)
+        return jsonify(payload)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/attendance/history/<int:employee_id>/month/<int:year>/<int:month>')
+@login_required
+@permission_required('attendance', 'view')
+def api_attendance_history_month(employee_id, year, month):
+    """API لعرض شهر واحد من سجل الموظف كتقويم مع إجماليات الشهر"""
+    if not 1 <= month <= 12:
+        return jsonify({'success': False, 'message': 'الشهر غير صالح'}), 400
+    employee = Employee.get_by_id(employee_id)
+    if not employee:
+        return jsonify({'success': False, 'message': 'الموظف غير موجود'}), 404
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 500
+    try:
+        cursor = conn.cursor()
+        start, end = month_range(year, month)
+        return jsonify({
+            'success': True,
+            'year': year,
+            'month': month,
+            'days': history.month_view(cursor, employee_id, year, month, employee.department_id),
+            'totals': history.range_totals(cursor, employee_id, start, end, employee.department_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        conn.close()
+
 
 # ==================== التقارير ====================
 
@@ -1248,6 +1472,64 @@ def reports():
 
 # ==================== chart API ====================
 
+@app.route('/api/reports/attendance-trend')
+@login_required
+@permission_required('reports', 'view')
+def api_attendance_trend():
+    """اتجاه الحضور شهراً بشهر من ملخص الحضور الشهري"""
+    months = max(1, min(request.args.get('months', 12, type=int), 60))
+    department_id = request.args.get('department_id', type=int)
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+    try:
+        cursor = conn.cursor()
+        return jsonify({'success': True, 'months': attendance_rollup.trend(cursor, months, department_id)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/attendance/analytics')
+@login_required
+@permission_required('reports', 'view')
+def api_attendance_analytics():
+    """ساعات العمل والتأخير والإضافي وسلاسل الغياب لكل موظف في فترة"""
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else date.today().replace(day=1)
+        # to شامل في الرابط، والتحليل يعمل على فترة نصف مفتوحة
+        end = datetime.strptime(end, '%Y-%m-%d').date() + timedelta(days=1) if end else date.today() + timedelta(days=1)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'}), 400
+    
+    department_id = request.args.get('department_id', type=int)
+    sort = request.args.get('sort')
+    if sort and sort not in attendance_analytics.SORT_FIELDS:
+        return jsonify({'success': False, 'message': 'حقل الترتيب غير معروف'}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    
+    try:
+        frame = attendance_analytics.load(start, end, department_id)
+        metrics = attendance_analytics.analyze(frame, **attendance_analytics.department_shifts(frame))
+        return jsonify({
+            'success': True,
+            'from': start.isoformat(),
+            'to': (end - timedelta(days=1)).isoformat(),
+            'total': len(frame.employee_ids),
+            'totals': attendance_analytics.totals(metrics),
+            'employees': attendance_analytics.summarize(frame, metrics, sort=sort,
+                                                        descending=request.args.get('order', 'desc') != 'asc',
+                                                        offset=offset, limit=limit)
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
 
 
 
@@ -1262,14 +1544,7 @@ def api_employees():
     if not conn:
         return jsonify([])
     
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT e.*, d.name as department_name 
-        FROM Employees e 
-        LEFT JOIN Departments d ON e.department_id = d.id
-        ORDER BY e.created_at DESC
-    ''')
-    employees = cursor.fetchall()
+    employees = Employee.get_all()
     
     employee_list = []
     for emp in employees:
@@ -1287,15 +1562,287 @@ def api_employees():
     conn.close()
     return jsonify(employee_list)
 
+@app.route('/api/employees/search')
+@login_required
+@permission_required('employees', 'view')
+def api_employees_search():
+    """API للبحث في الموظفين من فهرس البحث"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    
+    if len(query) < 2:
+        return jsonify({'success': True, 'results': [], 'total': 0})
+    
+    try:
+        results, total = employee_index.search(query, limit=limit)
+        return jsonify({'success': True, 'results': results, 'total': total})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+# أقصى فترة لمعامل days (عشر سنوات)؛ القيم الأكبر تتجاوز نطاق التاريخ
+MAX_EXPIRING_DAYS = 3650
+
+@app.route('/api/expiring')
+@login_required
+@permission_required('employees', 'view')
+def api_expiring():
+    """API للرخص والعقود التي تنتهي خلال فترة محددة"""
+    kind = request.args.get('kind')
+    if kind and kind not in ('license', 'contract'):
+        return jsonify({'success': False, 'message': 'النوع يجب أن يكون license أو contract'}), 400
+    
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else date.today()
+        if end:
+            end = datetime.strptime(end, '%Y-%m-%d').date()
+        else:
+            days = max(0, min(request.args.get('days', 30, type=int), MAX_EXPIRING_DAYS))
+            end = start + timedelta(days=days)
+    except (ValueError, OverflowError):
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'}), 400
+    
+    try:
+        items = expiry_index.expiring(start, end, kinds=(kind,) if kind else None)
+        return jsonify({
+            'success': True,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'total': len(items),
+            'items': items
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/expiring/digest')
+@login_required
+@permission_required('employees', 'view')
+def api_expiring_digest():
+    """الملخص اليومي لتواريخ الانتهاء (محسوب مسبقاً)"""
+    try:
+        return jsonify({'success': True, 'digest': expiry_index.digest()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/org/departments/<int:department_id>/subtree')
+@login_required
+@permission_required('departments', 'view')
+def api_org_subtree(department_id):
+    """القسم وكل الأقسام التابعة له"""
+    try:
+        if not org_hierarchy.has_department(department_id):
+            return jsonify({'success': False, 'message': 'القسم غير موجود'}), 404
+        departments = org_hierarchy.subtree(department_id)
+        return jsonify({'success': True, 'total': len(departments), 'departments': departments})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/org/departments/<int:department_id>/ancestors')
+@login_required
+@permission_required('departments', 'view')
+def api_org_ancestors(department_id):
+    """الأقسام الأعلى من القسم حتى الجذر"""
+    try:
+        if not org_hierarchy.has_department(department_id):
+            return jsonify({'success': False, 'message': 'القسم غير موجود'}), 404
+        return jsonify({'success': True, 'ancestors': org_hierarchy.ancestors(department_id)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/org/managers/<int:manager_id>/reports')
+@login_required
+@permission_required('employees', 'view')
+def api_org_reports(manager_id):
+    """كل الموظفين تحت المدير (مباشرة أو عبر الأقسام التابعة) مع ترقيم بالمؤشر"""
+    try:
+        department_ids = org_hierarchy.scope(manager_id)
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+        rows, next_cursor = employees_under(conn, department_ids, exclude_id=manager_id,
+                                            after=request.args.get('after', type=int),
+                                            limit=request.args.get('limit', 100, type=int))
+        conn.close()
+        return jsonify({
+            'success': True,
+            'department_ids': department_ids,
+            'employees': [{
+                'id': row.id,
+                'employee_id': row.employee_id,
+                'name': row.name,
+                'position': row.position,
+                'status': row.status,
+                'department_id': row.department_id,
+                'department': row.department_name
+            } for row in rows],
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/org/employees/<int:employee_id>/chain')
+@login_required
+@permission_required('employees', 'view')
+def api_org_chain(employee_id):
+    """سلسلة المديرين فوق الموظف"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+        cursor = conn.cursor()
+        cursor.execute('SELECT department_id FROM Employees WHERE id = ?', (employee_id,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return jsonify({'success': False, 'message': 'الموظف غير موجود'}), 404
+        return jsonify({'success': True, 'chain': org_hierarchy.reporting_chain(employee_id, row.department_id)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
 @app.route('/api/attendance/stats')
 @login_required
 def api_attendance_stats():
-    """API لإحصائيات الحضور"""
-    return jsonify({
-        'dates': [],
-        'present': [],
-        'late': []
-    })
+    """API لإحصائيات الحضور اليومية (حاضر/متأخر/غائب) لفترة وقسم"""
+    try:
+        end = request.args.get('to')
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else date.today()
+        start = request.args.get('from')
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'}), 400
+    department_id = request.args.get('department_id', type=int)
+    
+    try:
+        payload = attendance_stats.daily_series(start, end + timedelta(days=1), department_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    
+    # لوحات المتابعة التي تستعلم كل دقيقة تحصل على 304 بدون جسم إذا لم تتغير الأرقام
+    response = jsonify(payload)
+    response.set_etag(attendance_stats.etag(payload))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+# ==================== تقويم العمل ====================
+
+@app.route('/api/calendar/<int:year>/<int:month>')
+@login_required
+def api_work_calendar(year, month):
+    """أيام الشهر مع أيام العمل لقسم محدد أو للشركة"""
+    if not 1 <= month <= 12:
+        return jsonify({'success': False, 'message': 'الشهر غير صالح'}), 400
+    department_id = request.args.get('department_id', type=int)
+    try:
+        return jsonify({
+            'success': True,
+            'year': year,
+            'month': month,
+            'department_id': department_id,
+            'working_days': work_calendar.working_days(year, month, department_id),
+            'days': work_calendar.month_days(year, month, department_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/calendar/days', methods=['POST', 'DELETE'])
+@admin_required
+def api_work_calendar_day():
+    """إضافة إجازة رسمية أو يوم عمل تعويضي (POST) أو حذفه (DELETE)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        calendar_date = datetime.strptime(data.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'}), 400
+    department_id = data.get('department_id') or None
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+    try:
+        if request.method == 'DELETE':
+            removed = remove_calendar_day(conn, calendar_date, department_id)
+            message = 'تم حذف اليوم من التقويم' if removed else 'اليوم غير موجود في التقويم'
+            return jsonify({'success': removed, 'message': message})
+        set_calendar_day(conn, calendar_date, bool(data.get('is_working_day')),
+                         name=data.get('name'), department_id=department_id)
+        return jsonify({'success': True, 'message': 'تم حفظ اليوم في التقويم'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/calendar/weekend', methods=['POST'])
+@admin_required
+def api_department_weekend():
+    """تحديد أيام العطلة الأسبوعية لقسم (أو للشركة بدون department_id)"""
+    data = request.get_json(silent=True) or {}
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+    try:
+        weekend = set_department_weekend(conn, data.get('department_id') or None, data.get('weekend_days'))
+        return jsonify({'success': True, 'message': 'تم تحديث العطلة الأسبوعية', 'weekend_days': weekend})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+# ==================== قواعد الدوام ====================
+
+@app.route('/api/shifts')
+@login_required
+def api_shifts():
+    """الدوام المعرف لكل قسم (القسم 0 = الافتراضي للشركة)"""
+    try:
+        return jsonify({'success': True, 'shifts': shift_rules.all()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+
+@app.route('/api/shifts', methods=['POST', 'DELETE'])
+@admin_required
+def api_department_shift():
+    """تحديد دوام قسم أو الدوام الافتراضي (POST) أو حذفه ليعود للافتراضي (DELETE)"""
+    data = request.get_json(silent=True) or {}
+    department_id = data.get('department_id') or None
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'success': False, 'message': 'خطأ في الاتصال بقاعدة البيانات'}), 503
+    try:
+        if request.method == 'DELETE':
+            removed = remove_department_shift(conn, department_id)
+            message = 'تم حذف دوام القسم' if removed else 'لا يوجد دوام معرف لهذا القسم'
+            return jsonify({'success': removed, 'message': message})
+        set_department_shift(conn, department_id, data.get('shift_start', ''), data.get('shift_end', ''),
+                             data.get('grace_minutes'), data.get('early_leave_minutes'))
+        return jsonify({'success': True, 'message': 'تم حفظ الدوام'})
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'أوقات الدوام يجب أن تكون HH:MM وفترات السماح أرقاماً موجبة'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+@app.route('/api/attendance/absences', methods=['POST'])
+@admin_required
+def api_mark_absences():
+    """تسجيل الغياب ليوم منتهٍ (افتراضياً أمس) لكل من لم يحضر في يوم عمل قسمه"""
+    data = request.get_json(silent=True) or {}
+    try:
+        day = datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'صيغة التاريخ يجب أن تكون YYYY-MM-DD'}), 400
+    try:
+        count = mark_absent(day)
+        return jsonify({'success': True, 'message': f'تم تسجيل {count} غياب', 'absent': count})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'حدث خطأ: {str(e)}'}), 500
 
 # ==================== مسارات المساعدة ====================
 
@@ -1315,6 +1862,22 @@ def test_db():
     except Exception as e:
         return f"❌ خطأ في الاتصال: {str(e)}"
 
+@app.route('/db-pool-stats')
+@admin_required
+def db_pool_stats():
+    """إحصائيات مجمع الاتصالات"""
+    return jsonify(db_pool.pool_stats())
+
+@app.route('/health')
+def health():
+    """فحص الصحة لموازن الأحمال: 503 أثناء انقطاع قاعدة البيانات"""
+    database = db_pool.database_health()
+    status_code = 200 if database['is_available'] else 503
+    return jsonify({
+        'status': 'ok' if database['is_available'] else 'unavailable',
+        'database': database
+    }), status_code
+
 @app.route('/debug-config')
 def debug_config():
     """فحص الإعدادات"""
@@ -1878,4 +2441,5 @@ if __name__ == '__main__':
     print(f"🔑 بيانات الاختبار:")
     print(f"   - مسؤول: admin / admin")
     print(f"   - مستخدم: user / user")
+    db_pool.get_pool().warm_up()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,263 @@
+from datetime import date, timedelta
+from itertools import chain
+
+import numpy as np
+
+from attendance_archive import attendance_table
+from db_pool import get_db_connection
+from shift_rules import DEFAULT_SHIFT, shift_offset, shift_rules
+from work_calendar import work_calendar
+
+# الدوام الافتراضي (بالثواني من منتصف الليل)
+DEFAULT_SHIFT_START = DEFAULT_SHIFT[0]
+DEFAULT_SHIFT_SECONDS = DEFAULT_SHIFT[1]
+DEFAULT_GRACE_SECONDS = DEFAULT_SHIFT[2] - DEFAULT_SHIFT[0]
+DEFAULT_EARLY_LEAVE_SECONDS = DEFAULT_SHIFT[0] + DEFAULT_SHIFT[1] - DEFAULT_SHIFT[3]
+
+MAX_RANGE_DAYS = 1024
+FETCH_SIZE = 50000
+
+STATUS_CODES = {'present': 1, 'late': 2, 'absent': 3}
+OTHER_STATUS = 4
+
+# كل سجل يُنقل كعددين صحيحين بدلاً من خمسة أعمدة لتقليل تكلفة التحويل في pyodbc:
+#   key   = الموظف << 13 | رقم اليوم في الفترة << 3 | كود الحالة
+#   times = ثواني الحضور << 17 | ثواني الانصراف   (131071 = لا يوجد)
+NO_TIME = (1 << 17) - 1
+LOAD_SQL = f'''
+    SELECT CAST(a.employee_id AS BIGINT) * 8192
+               + DATEDIFF(day, ?, a.attendance_date) * 8
+               + CASE a.status {' '.join(f"WHEN '{status}' THEN {code}" for status, code in STATUS_CODES.items())}
+                 ELSE {OTHER_STATUS} END,
+           CAST(ISNULL(DATEDIFF(second, CAST('00:00' AS TIME), a.check_in), {NO_TIME}) AS BIGINT) * 131072
+               + ISNULL(DATEDIFF(second, CAST('00:00' AS TIME), a.check_out), {NO_TIME})
+    FROM {{table}} a
+    WHERE a.attendance_date >= ? AND a.attendance_date < ?
+'''
+
+EMPLOYEES_SQL = '''
+    SELECT id, employee_id, first_name + ' ' + last_name as name, department_id, hire_date, status
+    FROM Employees
+'''
+
+SORT_FIELDS = ('hours_worked', 'late_minutes', 'late_days', 'early_leave_minutes', 'overtime_hours',
+               'days_present', 'absent_days', 'longest_absence_streak', 'current_absence_streak')
+
+
+class AttendanceFrame:
+    """سجلات فترة من الحضور كمصفوفات NumPy مفهرسة بموضع الموظف"""
+
+    def __init__(self, start, end, employees, keys, times):
+        self.start = start
+        self.end = end
+        self.days = (end - start).days
+
+        self.employee_ids = np.array([row.id for row in employees], dtype=np.int64)
+        order = np.argsort(self.employee_ids)
+        self.employee_ids = self.employee_ids[order]
+        self.employees = [employees[position] for position in order]
+        self.department_ids = np.array([row.department_id or 0 for row in self.employees], dtype=np.int64)
+        self.active = np.array([row.status == 'active' for row in self.employees], dtype=bool)
+        self.hire_day = np.array([(row.hire_date - start).days if row.hire_date else 0
+                                  for row in self.employees], dtype=np.int64)
+
+        record_employee = keys >> 13
+        position = np.searchsorted(self.employee_ids, record_employee)
+        position = np.minimum(position, max(len(self.employee_ids) - 1, 0))
+        known = (self.employee_ids[position] == record_employee) if len(self.employee_ids) else \
+            np.zeros(len(keys), dtype=bool)
+
+        keys, times = keys[known], times[known]
+        self.index = position[known]                                  # موضع الموظف لكل سجل
+        self.day = ((keys >> 3) & 1023).astype(np.int16)              # رقم اليوم من بداية الفترة
+        self.status = (keys & 7).astype(np.int8)
+        self.check_in = (times >> 17).astype(np.int32)                # ثوانٍ من منتصف الليل
+        self.check_out = (times & NO_TIME).astype(np.int32)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def _fetch_int_pairs(cursor):
+    """قراءة عمودين صحيحين على دفعات مباشرة إلى مصفوفتين"""
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)))
+    data = np.concatenate(chunks).reshape(-1, 2) if chunks else np.empty((0, 2), dtype=np.int64)
+    return data[:, 0], data[:, 1]
+
+
+def load(start, end, department_id=None):
+    """تحميل الحضور في الفترة [start, end) دفعة واحدة"""
+    if end <= start:
+        raise ValueError('نهاية الفترة يجب أن تكون بعد بدايتها')
+    if (end - start).days > MAX_RANGE_DAYS:
+        raise ValueError(f'أقصى فترة {MAX_RANGE_DAYS} يوماً')
+
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        query, params = EMPLOYEES_SQL, []
+        if department_id:
+            query += ' WHERE department_id = ?'
+            params.append(department_id)
+        cursor.execute(query, params)
+        employees = cursor.fetchall()
+
+        query, params = LOAD_SQL.format(table=attendance_table(start)), [start, start, end]
+        if department_id:
+            query += ' AND a.employee_id IN (SELECT id FROM Employees WHERE department_id = ?)'
+            params.append(department_id)
+        cursor.execute(query, params)
+        keys, times = _fetch_int_pairs(cursor)
+    finally:
+        conn.close()
+    return AttendanceFrame(start, end, employees, keys, times)
+
+
+def working_day_matrix(frame):
+    """أيام العمل لكل قسم من تقويم العمل: (الأقسام، مصفوفة bool بحجم الأقسام × الأيام)"""
+    departments = np.unique(frame.department_ids)
+    matrix = np.zeros((len(departments), frame.days), dtype=bool)
+    for row, department_id in enumerate(departments):
+        for offset in range(frame.days):
+            matrix[row, offset] = work_calendar.is_working_day(frame.start + timedelta(days=offset),
+                                                               int(department_id) or None)
+    return departments, matrix
+
+
+def _runs(matrix):
+    """أطول سلسلة True متتالية وطول السلسلة المنتهية في آخر عمود، لكل صف"""
+    rows = matrix.shape[0]
+    longest = np.zeros(rows, dtype=np.int64)
+    current = np.zeros(rows, dtype=np.int64)
+    if rows == 0 or matrix.shape[1] == 0:
+        return longest, current
+    padded = np.zeros((rows, matrix.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    start_rows, start_cols = np.nonzero(edges == 1)
+    _, end_cols = np.nonzero(edges == -1)   # نفس ترتيب البدايات (صفاً بصف)
+    lengths = end_cols - start_cols
+    np.maximum.at(longest, start_rows, lengths)
+    ends_at_last = end_cols == matrix.shape[1]
+    current[start_rows[ends_at_last]] = lengths[ends_at_last]
+    return longest, current
+
+
+def department_shifts(frame):
+    """دوام كل موظف حسب قسمه من قواعد الدوام (معاملات analyze)"""
+    departments, positions = np.unique(frame.department_ids, return_inverse=True)
+    columns = shift_rules.columns(departments.tolist())
+    return {name: np.asarray(values, dtype=np.int32)[positions] for name, values in columns.items()}
+
+
+def analyze(frame, shift_start=DEFAULT_SHIFT_START, shift_seconds=DEFAULT_SHIFT_SECONDS,
+            grace_seconds=DEFAULT_GRACE_SECONDS, early_leave_seconds=DEFAULT_EARLY_LEAVE_SECONDS,
+            today=None, working_days=None):
+    """
+    حسابات متجهة لكل موظف: ساعات العمل، دقائق التأخير والانصراف المبكر، الإضافي، الغياب وأطول سلسلة غياب.
+    معاملات الدوام تقبل قيمة واحدة أو مصفوفة بحجم الموظفين (department_shifts).
+    يعيد قاموس مصفوفات بنفس ترتيب frame.employees.
+    """
+    count = len(frame.employee_ids)
+    index = frame.index
+    shift_start = np.broadcast_to(np.asarray(shift_start, dtype=np.int32), (count,))
+    shift_seconds = np.broadcast_to(np.asarray(shift_seconds, dtype=np.int32), (count,))
+    grace_seconds = np.broadcast_to(np.asarray(grace_seconds, dtype=np.int32), (count,))
+    early_leave_seconds = np.broadcast_to(np.asarray(early_leave_seconds, dtype=np.int32), (count,))
+
+    attended = (frame.status == STATUS_CODES['present']) | (frame.status == STATUS_CODES['late'])
+    has_in = attended & (frame.check_in != NO_TIME)
+    complete = has_in & (frame.check_out != NO_TIME) & (frame.check_out != frame.check_in)
+
+    # الأوقات نسبةً إلى بداية الدوام، والانصراف قبل الحضور يعني بعد منتصف الليل (دوام ليلي)
+    worked = np.where(complete, (frame.check_out - frame.check_in) % 86400, 0)
+    arrived = shift_offset(frame.check_in, shift_start[index], shift_seconds[index])
+    late = np.where(has_in, arrived - grace_seconds[index], 0).clip(min=0)
+    overtime = (worked - shift_seconds[index]).clip(min=0) * complete
+    early = np.where(complete, shift_seconds[index] - early_leave_seconds[index] - (arrived + worked), 0).clip(min=0)
+
+    def per_employee(values):
+        return np.bincount(index, weights=values, minlength=count)
+
+    # الغياب: يوم عمل بعد التعيين وحتى اليوم بلا حضور (أو بحالة absent)
+    today = today or date.today()
+    last_day = min(frame.days, (today - frame.start).days + 1)
+    present = np.zeros((count, frame.days), dtype=bool)
+    present[index[attended], frame.day[attended]] = True
+    days = np.arange(frame.days)
+    expected = (days[None, :] >= frame.hire_day[:, None]) & (days[None, :] < last_day) & frame.active[:, None]
+
+    departments, matrix = working_days if working_days is not None else working_day_matrix(frame)
+    department_row = np.searchsorted(departments, frame.department_ids)
+    absent = expected & matrix[department_row] & ~present
+
+    longest = np.zeros(count, dtype=np.int64)
+    current = np.zeros(count, dtype=np.int64)
+    # أيام العطلة لا تقطع السلسلة: تُحذف أعمدتها لكل قسم ثم تُحسب السلاسل المتتالية
+    for row in range(len(departments)):
+        members = np.nonzero(department_row == row)[0]
+        if len(members):
+            columns = matrix[row, :last_day] if last_day > 0 else matrix[row, :0]
+            sub = absent[np.ix_(members, np.nonzero(columns)[0])]
+            longest[members], current[members] = _runs(sub)
+
+    return {
+        'hours_worked': per_employee(worked) / 3600,
+        'late_minutes': per_employee(late) / 60,
+        'late_days': np.bincount(index, weights=late > 0, minlength=count).astype(np.int64),
+        'early_leave_minutes': per_employee(early) / 60,
+        'overtime_hours': per_employee(overtime) / 3600,
+        'days_present': np.bincount(index, weights=attended, minlength=count).astype(np.int64),
+        'absent_days': absent.sum(axis=1),
+        'longest_absence_streak': longest,
+        'current_absence_streak': current,
+    }
+
+
+def summarize(frame, metrics, sort=None, descending=True, offset=0, limit=None):
+    """تحويل النتائج إلى قائمة قواميس (مع الترتيب والتقسيم) لواجهة JSON"""
+    order = np.arange(len(frame.employee_ids))
+    if sort in SORT_FIELDS:
+        order = np.argsort(metrics[sort], kind='stable')
+        if descending:
+            order = order[::-1]
+    order = order[offset:offset + limit if limit else None]
+    return [{
+        'id': int(frame.employee_ids[position]),
+        'employee_id': frame.employees[position].employee_id,
+        'name': frame.employees[position].name,
+        'department_id': frame.employees[position].department_id,
+        'hours_worked': round(float(metrics['hours_worked'][position]), 2),
+        'late_minutes': round(float(metrics['late_minutes'][position]), 1),
+        'late_days': int(metrics['late_days'][position]),
+        'early_leave_minutes': round(float(metrics['early_leave_minutes'][position]), 1),
+        'overtime_hours': round(float(metrics['overtime_hours'][position]), 2),
+        'days_present': int(metrics['days_present'][position]),
+        'absent_days': int(metrics['absent_days'][position]),
+        'longest_absence_streak': int(metrics['longest_absence_streak'][position]),
+        'current_absence_streak': int(metrics['current_absence_streak'][position]),
+    } for position in order]
+
+
+def totals(metrics):
+    return {
+        'hours_worked': round(float(metrics['hours_worked'].sum()), 2),
+        'late_minutes': round(float(metrics['late_minutes'].sum()), 1),
+        'early_leave_minutes': round(float(metrics['early_leave_minutes'].sum()), 1),
+        'overtime_hours': round(float(metrics['overtime_hours'].sum()), 2),
+        'absent_days': int(metrics['absent_days'].sum()),
+    }
+
+
+def employee_metrics(start, end, department_id=None):
+    """{Employees.id: مقاييس الموظف} لفترة واحدة (لتقرير الحضور الشهري)"""
+    frame = load(start, end, department_id)
+    metrics = analyze(frame, **department_shifts(frame))
+    return {row['id']: row for row in summarize(frame, metrics)}
@@ -0,0 +1,170 @@
+"""
+أرشفة سجلات الحضور للسنوات المغلقة.
+
+السنة المغلقة تُنقل من Attendance إلى AttendanceArchive (clustered columnstore،
+ضغط عمودي) على دفعات صغيرة، فيبقى الجدول الساخن وفهارسه بحجم سنة تقريباً.
+القراءة التاريخية تمر عبر العرض AttendanceAll (Attendance UNION ALL AttendanceArchive)،
+و attendance_table(start) تختار الجدول الساخن مباشرة عندما تبدأ الفترة بعد آخر سنة مؤرشفة.
+
+    python attendance_archive.py --through 2024
+    python attendance_archive.py --year 2023 --dry-run
+"""
+import argparse
+import threading
+import time
+from datetime import date, timedelta
+
+from db_pool import get_db_connection
+
+HOT_TABLE = 'Attendance'
+ALL_VIEW = 'AttendanceAll'
+# أقل من حد تصعيد الأقفال (5000) حتى لا يُقفل الجدول كله أثناء الدوام
+BATCH_SIZE = 4000
+# أحداث الحضور تُقبل حتى 31 يوماً بأثر رجعي، فلا تُغلق السنة قبل ذلك
+CLOSE_AFTER = timedelta(days=45)
+BOUNDARY_TTL = 300
+
+COLUMNS = 'id, employee_id, attendance_date, check_in, check_out, status, notes, created_at, updated_at'
+
+MOVE_BATCH_SQL = f'''
+    DELETE TOP (?) FROM Attendance
+    OUTPUT {', '.join(f'deleted.{column.strip()}' for column in COLUMNS.split(','))}
+    INTO AttendanceArchive ({COLUMNS})
+    WHERE attendance_date >= ? AND attendance_date < ?;
+'''
+
+_boundary_lock = threading.Lock()
+_boundary = None  # (أول يوم غير مؤرشف، وقت القراءة)
+
+
+def is_closed(year, today=None):
+    today = today or date.today()
+    return today >= date(year + 1, 1, 1) + CLOSE_AFTER
+
+
+def hot_start(refresh=False):
+    """أول يوم في الجدول الساخن (اليوم التالي لآخر سنة مؤرشفة)؛ date.min إذا لم يُؤرشف شيء"""
+    global _boundary
+    cached = _boundary
+    if cached is not None and not refresh and time.monotonic() - cached[1] < BOUNDARY_TTL:
+        return cached[0]
+    start = date.min
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(archive_year) FROM AttendanceArchiveLog')
+            year = cursor.fetchone()[0]
+            if year:
+                start = date(year + 1, 1, 1)
+        except Exception as e:
+            # قواعد البيانات القديمة بدون جداول الأرشيف: كل السجلات في الجدول الساخن
+            print(f"❌ تعذر قراءة حالة أرشيف الحضور: {e}")
+        finally:
+            conn.close()
+    with _boundary_lock:
+        _boundary = (start, time.monotonic())
+    return start
+
+
+def attendance_table(start=None):
+    """الجدول/العرض المناسب لقراءة فترة تبدأ من start"""
+    if start is not None and start >= hot_start():
+        return HOT_TABLE
+    return ALL_VIEW
+
+
+def archive_year(year, conn=None, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    نقل سنة مغلقة كاملة إلى الأرشيف؛ كل دفعة في معاملة مستقلة
+    (DELETE ... OUTPUT INTO) فلا تطول الأقفال ولا يتضخم سجل المعاملات.
+    الملخصات الشهرية واليومية لا تتغير لأنها تحسب السجلات في الجدولين.
+    يعيد عدد الصفوف المنقولة (أو التي ستُنقل مع dry_run).
+    """
+    if not is_closed(year):
+        raise ValueError(f'السنة {year} لم تُغلق بعد')
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    try:
+        cursor = conn.cursor()
+        if dry_run:
+            cursor.execute('SELECT COUNT(*) FROM Attendance WHERE attendance_date >= ? AND attendance_date < ?',
+                           (start, end))
+            return cursor.fetchone()[0]
+
+        moved = 0
+        while True:
+            try:
+                cursor.execute(MOVE_BATCH_SQL, (batch_size, start, end))
+                count = cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            moved += count
+            if count < batch_size:
+                break
+
+        # إعادة تشغيل سنة مؤرشفة تنقل فقط ما أُضيف إليها بعد ذلك
+        cursor.execute('''
+            MERGE AttendanceArchiveLog WITH (HOLDLOCK) AS t
+            USING (SELECT ? AS archive_year, ? AS rows_moved) AS s
+            ON t.archive_year = s.archive_year
+            WHEN MATCHED THEN UPDATE SET rows_moved = t.rows_moved + s.rows_moved, archived_at = GETDATE()
+            WHEN NOT MATCHED THEN INSERT (archive_year, rows_moved) VALUES (s.archive_year, s.rows_moved);
+        ''', (year, moved))
+        conn.commit()
+        hot_start(refresh=True)
+        return moved
+    finally:
+        if own_connection:
+            conn.close()
+
+
+def archive_through(last_year, conn=None, batch_size=BATCH_SIZE, dry_run=False):
+    """أرشفة كل السنوات المغلقة حتى last_year؛ يعيد {السنة: عدد الصفوف}"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT MIN(attendance_date) FROM Attendance')
+        first = cursor.fetchone()[0]
+        if first is None:
+            return {}
+        year = first.year
+        results = {}
+        while year <= last_year and is_closed(year):
+            results[year] = archive_year(year, conn, batch_size, dry_run)
+            year += 1
+        return results
+    finally:
+        if own_connection:
+            conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='أرشفة سجلات الحضور للسنوات المغلقة')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--year', type=int, help='أرشفة سنة واحدة')
+    group.add_argument('--through', type=int, help='أرشفة كل السنوات المغلقة حتى هذه السنة')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='عدد الصفوف في كل معاملة')
+    parser.add_argument('--dry-run', action='store_true', help='عرض عدد الصفوف فقط بدون نقل')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.year:
+        results = {args.year: archive_year(args.year, batch_size=args.batch_size, dry_run=args.dry_run)}
+    else:
+        results = archive_through(args.through, batch_size=args.batch_size, dry_run=args.dry_run)
+    for year, count in results.items():
+        print(f"{'🔎' if args.dry_run else '✅'} {year}: {count:,} سجل")
+    if not results:
+        print("لا توجد سنوات مغلقة لأرشفتها")
+    print(f"⏱️ {time.perf_counter() - started:.1f} ثانية")
@@ -0,0 +1,456 @@
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import attendance_rollup
+from db_pool import get_db_connection
+from event_bus import attendance_bus
+from presence_index import presence_index
+from shift_rules import shift_rules
+
+ACTIONS = ('check_in', 'check_out')
+MAX_BATCH_EVENTS = 1000
+# أقصى فرق مسموح لساعة الجهاز في المستقبل
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+# الأجهزة غير المتصلة قد ترسل أحداثاً متأخرة، لكن ليس أقدم من ذلك
+MAX_EVENT_AGE = timedelta(days=31)
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+# الأحداث الأقدم من MAX_EVENT_AGE تُرفض قبل فحص مفتاحها، فمفاتيحها لا حاجة لها بعد ذلك
+EVENT_RETENTION = MAX_EVENT_AGE + timedelta(days=1)
+# أقل من حد تصعيد الأقفال (5000) حتى لا يُقفل الجدول أثناء تسجيل الحضور
+PURGE_BATCH_SIZE = 4000
+
+PURGE_EVENTS_SQL = '''
+    DELETE TOP (?) FROM AttendanceEvents WHERE event_time < ?;
+'''
+
+# كل الأحداث في رحلة واحدة: مجموعة النتائج الأولى للموظفين غير الموجودين،
+# والثانية نتيجة MERGE واحد على (employee_id, attendance_date) وهو قيد UK_Attendance_Employee_Date.
+# الصف الموجود يُحدّث دائماً (بنفس القيمة عند عدم التغيير) حتى تعيد OUTPUT حالته لكل حدث.
+# الحالة (present/late) تُصنف مسبقاً من قواعد الدوام؛ حضور متأخر في يوم سُجل غياباً يحل محل الغياب،
+# والانصراف لا يُسجل على يوم بلا حضور.
+APPLY_EVENTS_SQL = '''
+    SET NOCOUNT ON;
+    DECLARE @events TABLE (
+        employee_id INT NOT NULL,
+        attendance_date DATE NOT NULL,
+        check_in TIME(0) NULL,
+        check_out TIME(0) NULL,
+        status NVARCHAR(20) NULL,
+        PRIMARY KEY (employee_id, attendance_date)
+    );
+    INSERT INTO @events (employee_id, attendance_date, check_in, check_out, status)
+    SELECT employee_id, attendance_date, check_in, check_out, status
+    FROM OPENJSON(?) WITH (
+        employee_id INT '$[0]',
+        attendance_date DATE '$[1]',
+        check_in TIME(0) '$[2]',
+        check_out TIME(0) '$[3]',
+        status NVARCHAR(20) '$[4]'
+    );
+
+    SELECT s.employee_id FROM @events s
+    WHERE NOT EXISTS (SELECT 1 FROM Employees e WHERE e.id = s.employee_id);
+
+    MERGE Attendance WITH (HOLDLOCK) AS t
+    USING (
+        SELECT s.* FROM @events s
+        WHERE EXISTS (SELECT 1 FROM Employees e WHERE e.id = s.employee_id)
+    ) AS s
+    ON t.employee_id = s.employee_id AND t.attendance_date = s.attendance_date
+    WHEN MATCHED THEN
+        UPDATE SET
+            check_in = CASE WHEN t.status = 'absent' AND t.check_in IS NULL AND s.check_in IS NOT NULL
+                            THEN s.check_in ELSE t.check_in END,
+            status = CASE WHEN t.status = 'absent' AND t.check_in IS NULL AND s.check_in IS NOT NULL
+                          THEN s.status ELSE t.status END,
+            check_out = CASE WHEN t.check_out IS NULL AND s.check_out IS NOT NULL
+                                  AND (t.check_in IS NOT NULL OR (t.status = 'absent' AND s.check_in IS NOT NULL))
+                             THEN s.check_out ELSE t.check_out END,
+            updated_at = CASE WHEN (t.check_out IS NULL AND s.check_out IS NOT NULL AND t.check_in IS NOT NULL)
+                                   OR (t.status = 'absent' AND t.check_in IS NULL AND s.check_in IS NOT NULL)
+                              THEN GETDATE() ELSE t.updated_at END
+    WHEN NOT MATCHED BY TARGET AND s.check_in IS NOT NULL THEN
+        INSERT (employee_id, attendance_date, check_in, check_out, status)
+        VALUES (s.employee_id, s.attendance_date, s.check_in, s.check_out, s.status)
+    OUTPUT $action, inserted.id, inserted.employee_id, inserted.attendance_date,
+           deleted.check_in AS previous_check_in, inserted.check_in,
+           deleted.check_out AS previous_check_out, inserted.check_out,
+           deleted.status AS previous_status, inserted.status;
+'''
+
+# حجز مفاتيح التكرار في سجل الأحداث؛ المفتاح الذي يعالجه طلب آخر ينتظر حتى ينتهي (UPDLOCK, HOLDLOCK)
+# والمفاتيح المعالجة مسبقاً تعود بنتيجتها المحفوظة
+CLAIM_KEYS_SQL = '''
+    SET NOCOUNT ON;
+    DECLARE @keys TABLE (
+        idempotency_key NVARCHAR(64) PRIMARY KEY,
+        employee_id INT NOT NULL,
+        action NVARCHAR(10) NOT NULL,
+        event_time DATETIME2(0) NOT NULL
+    );
+    INSERT INTO @keys (idempotency_key, employee_id, action, event_time)
+    SELECT idempotency_key, employee_id, action, event_time
+    FROM OPENJSON(?) WITH (
+        idempotency_key NVARCHAR(64) '$[0]',
+        employee_id INT '$[1]',
+        action NVARCHAR(10) '$[2]',
+        event_time DATETIME2(0) '$[3]'
+    );
+
+    SELECT a.idempotency_key, a.result_code, a.attendance_id
+    FROM AttendanceEvents a WITH (UPDLOCK, HOLDLOCK)
+    JOIN @keys k ON a.idempotency_key = k.idempotency_key;
+
+    INSERT INTO AttendanceEvents (idempotency_key, employee_id, action, event_time)
+    SELECT k.idempotency_key, k.employee_id, k.action, k.event_time
+    FROM @keys k
+    WHERE NOT EXISTS (SELECT 1 FROM AttendanceEvents a WHERE a.idempotency_key = k.idempotency_key);
+'''
+
+# حفظ نتيجة كل حدث مع مفتاحه ليعود بها أي تكرار لاحق
+RECORD_RESULTS_SQL = '''
+    UPDATE a
+    SET result_code = r.result_code, attendance_id = r.attendance_id
+    FROM AttendanceEvents a
+    JOIN OPENJSON(?) WITH (
+        idempotency_key NVARCHAR(64) '$[0]',
+        result_code NVARCHAR(30) '$[1]',
+        attendance_id INT '$[2]'
+    ) r ON a.idempotency_key = r.idempotency_key;
+'''
+
+MESSAGES = {
+    'check_in': 'تم تسجيل الحضور بنجاح',
+    'check_out': 'تم تسجيل الانصراف بنجاح',
+    'already_checked_in': 'تم تسجيل الحضور مسبقاً',
+    'already_checked_out': 'تم تسجيل الانصراف مسبقاً',
+    'not_checked_in': 'لم يتم تسجيل حضور لهذا الموظف اليوم أو تم تسجيل الانصراف مسبقاً',
+    'unknown_employee': 'الموظف غير موجود',
+}
+
+
+class AttendanceEventError(ValueError):
+    """دفعة أحداث الحضور غير صالحة"""
+
+
+class IdempotencyCache:
+    """
+    ذاكرة محدودة الحجم والمدة لنتائج مفاتيح التكرار المعالجة حديثاً،
+    حتى تُرد إعادة المحاولة فوراً دون الرجوع لقاعدة البيانات.
+    الجدول AttendanceEvents (بفهرس فريد) هو المرجع بعد انتهاء المدة أو بين العمليات.
+    """
+
+    def __init__(self, max_size=50000, ttl=6 * 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # المفتاح -> (وقت الانتهاء، النتيجة)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, result):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, result)
+            self._items.move_to_end(key)
+            # العناصر مرتبة حسب وقت الإضافة، فالأقدم في البداية دائماً
+            now = time.monotonic()
+            while self._items and (len(self._items) > self.max_size
+                                   or next(iter(self._items.values()))[0] < now):
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._items), 'max_size': self.max_size, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+idempotency_cache = IdempotencyCache()
+
+
+def _parse_timestamp(value, now):
+    """وقت الحدث من الجهاز (ISO 8601)؛ بدون قيمة يُستخدم وقت الخادم"""
+    if not value:
+        return now
+    try:
+        timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('صيغة وقت الحدث غير صالحة')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    if timestamp - now > MAX_CLOCK_SKEW:
+        raise ValueError('وقت الحدث في المستقبل')
+    if now - timestamp > MAX_EVENT_AGE:
+        raise ValueError('وقت الحدث قديم جداً')
+    return timestamp.replace(microsecond=0)
+
+
+def _parse_key(value):
+    if value in (None, ''):
+        return None
+    key = str(value).strip()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f'مفتاح التكرار يجب ألا يتجاوز {MAX_IDEMPOTENCY_KEY_LENGTH} حرفاً')
+    return key
+
+
+def _parse_event(event, now):
+    """يعيد (الموظف، يوم الدوام، الإجراء، وقت الحدث) أو يرفع ValueError برسالة الخطأ"""
+    if not isinstance(event, dict):
+        raise ValueError('صيغة الحدث غير صالحة')
+    try:
+        employee_id = int(event.get('employee_id'))
+    except (TypeError, ValueError):
+        raise ValueError('رقم الموظف غير صالح')
+    action = event.get('action')
+    if action not in ACTIONS:
+        raise ValueError('الإجراء يجب أن يكون check_in أو check_out')
+    timestamp = _parse_timestamp(event.get('timestamp'), now)
+    # الحدث يتبع يوم بداية دوامه: انصراف 06:00 أو حضور 00:30 في دوام 22:00 يخص اليوم السابق
+    return employee_id, shift_rules.shift_day(employee_id, timestamp), action, timestamp
+
+
+def _result(event, code_or_message, attendance_id=None, duplicate=False):
+    event = event if isinstance(event, dict) else {}
+    return {
+        'employee_id': event.get('employee_id'),
+        'action': event.get('action'),
+        'idempotency_key': event.get('idempotency_key'),
+        'success': code_or_message in ACTIONS,
+        'code': code_or_message if code_or_message in MESSAGES else 'invalid',
+        'message': MESSAGES.get(code_or_message, code_or_message),
+        'attendance_id': attendance_id,
+        'duplicate': duplicate,
+    }
+
+
+def _claim_keys(cursor, keyed_events):
+    """حجز المفاتيح الجديدة؛ يعيد {المفتاح: (الكود، رقم السجل)} للمفاتيح المعالجة مسبقاً"""
+    payload = [[key, employee_id, action, moment.isoformat()]
+               for key, employee_id, day, action, moment in keyed_events]
+    cursor.execute(CLAIM_KEYS_SQL, (json.dumps(payload),))
+    return {row.idempotency_key: (row.result_code, row.attendance_id) for row in cursor.fetchall()}
+
+
+def _merge_attendance(cursor, events):
+    """MERGE واحد لكل الأحداث؛ يعيد (صفوف OUTPUT حسب (الموظف، التاريخ)، الموظفين غير الموجودين)"""
+    keys = {}  # (الموظف، التاريخ) -> [أول حضور، آخر انصراف]
+    for employee_id, day, action, moment in events:
+        times = keys.setdefault((employee_id, day), [None, None])
+        if action == 'check_in':
+            times[0] = moment if times[0] is None else min(times[0], moment)
+        else:
+            times[1] = moment if times[1] is None else max(times[1], moment)
+
+    payload = [[employee_id, day.isoformat(),
+                check_in.time().isoformat() if check_in else None,
+                check_out.time().isoformat() if check_out else None,
+                shift_rules.check_in_status(employee_id, check_in) if check_in else None]
+               for (employee_id, day), (check_in, check_out) in keys.items()]
+    cursor.execute(APPLY_EVENTS_SQL, (json.dumps(payload),))
+    unknown = {row.employee_id for row in cursor.fetchall()}
+    cursor.nextset()
+    outcomes = {(row.employee_id, row.attendance_date): row for row in cursor.fetchall()}
+    attendance_rollup.record_changes(cursor, [
+        (row.employee_id, row.attendance_date, row.previous_status, row.status) for row in outcomes.values()])
+    return outcomes, unknown
+
+
+# مستمعون لصفوف الحضور بعد commit (مثل مجموعات الحضور اليومية في write_behind)
+_commit_listeners = []
+
+
+def add_commit_listener(listener):
+    """listener(rows) مع صفوف فيها employee_id وattendance_date وcheck_in وcheck_out"""
+    _commit_listeners.append(listener)
+
+
+def notify_committed(rows):
+    """يُستدعى بعد commit من كل مسار يكتب الحضور/الانصراف"""
+    rows = list(rows)
+    for listener in _commit_listeners:
+        try:
+            listener(rows)
+        except Exception as e:
+            print(f"❌ تعذر إبلاغ مستمع الحضور: {e}")
+
+
+def _publish(applied):
+    """بث الحضور/الانصراف المعتمد مع العدادات المحدثة من فهرس الحضور (بدون استعلامات)"""
+    counters = {}
+    for action, row in applied:
+        day = row.attendance_date
+        if day not in counters:
+            counters[day] = presence_index.counts(day)
+        employee = presence_index.employee(row.employee_id) or {'id': row.employee_id}
+        attendance_bus.publish(action, {
+            'employee': employee,
+            'attendance_id': row.id,
+            'attendance_date': day.isoformat() if hasattr(day, 'isoformat') else day,
+            'check_in': row.check_in.strftime('%H:%M') if row.check_in else None,
+            'check_out': row.check_out.strftime('%H:%M') if row.check_out else None,
+            'status': row.status,
+            'counters': counters[day],
+        })
+
+
+def apply_events(conn, events):
+    """
+    تطبيق دفعة أحداث حضور/انصراف بعبارة MERGE واحدة وcommit واحد.
+    أول حضور وآخر انصراف لكل موظف في اليوم هما المعتمدان داخل الدفعة.
+    الأحداث التي تحمل idempotency_key تُطبق مرة واحدة فقط، وإعادة إرسالها
+    (من نفس الدفعة أو لاحقاً بعد انقطاع الاتصال) تعيد النتيجة الأصلية مع duplicate=True.
+    يعيد نتيجة لكل حدث بنفس ترتيب الإدخال.
+    """
+    if not isinstance(events, list) or not events:
+        raise AttendanceEventError('لا توجد أحداث')
+    if len(events) > MAX_BATCH_EVENTS:
+        raise AttendanceEventError(f'الحد الأقصى {MAX_BATCH_EVENTS} حدث في الطلب الواحد')
+
+    presence_index.ensure_fresh()  # قسم الموظف لتحديد يوم الدوام وتصنيف الحضور حسب دوامه
+    now = datetime.now().replace(microsecond=0)
+    results = [None] * len(events)
+    parsed = []           # (الموضع، المفتاح، الموظف، يوم الدوام، الإجراء، الوقت)
+    first_by_key = {}     # المفتاح -> موضع أول حدث يحمله في الدفعة
+    repeated = []         # (الموضع، موضع الحدث الأصلي)
+    for index, event in enumerate(events):
+        try:
+            employee_id, day, action, moment = _parse_event(event, now)
+            key = _parse_key(event.get('idempotency_key'))
+        except ValueError as e:
+            results[index] = _result(event, str(e))
+            continue
+        if key is not None:
+            cached = idempotency_cache.get(key)
+            if cached is not None:
+                results[index] = _result(event, cached[0], cached[1], duplicate=True)
+                continue
+            if key in first_by_key:
+                repeated.append((index, first_by_key[key]))
+                continue
+            first_by_key[key] = index
+        parsed.append((index, key, employee_id, day, action, moment))
+
+    if parsed:
+        cursor = conn.cursor()
+        try:
+            keyed = [item[1:] for item in parsed if item[1] is not None]
+            stored = _claim_keys(cursor, keyed) if keyed else {}
+            fresh = []
+            for item in parsed:
+                index, key = item[0], item[1]
+                if key in stored:
+                    code, attendance_id = stored[key]
+                    results[index] = _result(events[index], code, attendance_id, duplicate=True)
+                else:
+                    fresh.append(item)
+
+            outcomes, unknown = _merge_attendance(cursor, [item[2:] for item in fresh]) if fresh else ({}, set())
+
+            claimed = set()  # الحدث المعتمد يُحسب مرة واحدة حتى لو تكرر بنفس الوقت
+            recorded = []
+            applied = []     # (الإجراء، صف OUTPUT) للبث المباشر بعد commit
+            for index, key, employee_id, day, action, moment in fresh:
+                row = outcomes.get((employee_id, day))
+                if employee_id in unknown:
+                    code = 'unknown_employee'
+                elif action == 'check_in':
+                    # سجل جديد أو يوم مسجل غياباً بلا حضور
+                    inserted = row is not None and row.previous_check_in is None and row.check_in == moment.time()
+                    code = 'check_in' if inserted else 'already_checked_in'
+                elif row is None or row.check_in is None:
+                    code = 'not_checked_in'
+                else:
+                    checked_out = row.previous_check_out is None and row.check_out == moment.time()
+                    code = 'check_out' if checked_out else 'already_checked_out'
+                if code in ACTIONS:
+                    if (employee_id, day, action) in claimed:
+                        code = 'already_checked_in' if action == 'check_in' else 'already_checked_out'
+                    claimed.add((employee_id, day, action))
+                    if code in ACTIONS:
+                        applied.append((action, row))
+                attendance_id = row.id if row is not None else None
+                results[index] = _result(events[index], code, attendance_id)
+                if key is not None:
+                    recorded.append([key, code, attendance_id])
+
+            if recorded:
+                cursor.execute(RECORD_RESULTS_SQL, (json.dumps(recorded),))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        try:
+            presence_index.record([(row.employee_id, row.attendance_date, row.status)
+                                   for row in outcomes.values()])
+        except Exception as e:
+            print(f"❌ تعذر تحديث فهرس الحضور اليومي: {e}")
+        notify_committed(outcomes.values())
+        if applied:
+            try:
+                _publish(applied)
+            except Exception as e:
+                print(f"❌ تعذر بث أحداث الحضور: {e}")
+        for key, code, attendance_id in recorded:
+            idempotency_cache.put(key, (code, attendance_id))
+        for key, (code, attendance_id) in stored.items():
+            if code:
+                idempotency_cache.put(key, (code, attendance_id))
+
+    for index, original in repeated:
+        results[index] = dict(results[original], duplicate=True)
+    return results
+
+
+def purge_events(conn=None, before=None, batch_size=PURGE_BATCH_SIZE):
+    """
+    حذف مفاتيح التكرار الأقدم من مدة القبول على دفعات، كل دفعة في معاملة مستقلة.
+    يعيد عدد الصفوف المحذوفة.
+    """
+    before = before or datetime.now().replace(microsecond=0) - EVENT_RETENTION
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        deleted = 0
+        while True:
+            try:
+                cursor.execute(PURGE_EVENTS_SQL, (batch_size, before))
+                count = cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            deleted += count
+            if count < batch_size:
+                return deleted
+    finally:
+        if own_connection:
+            conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='حذف مفاتيح تكرار أحداث الحضور القديمة (يُشغل يومياً)')
+    parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE, help='عدد الصفوف في كل معاملة')
+    args = parser.parse_args()
+
+    count = purge_events(batch_size=args.batch_size)
+    print(f"✅ تم حذف {count:,} مفتاح تكرار أقدم من {EVENT_RETENTION.days} يوماً")
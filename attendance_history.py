@@ -0,0 +1,111 @@
+from datetime import date, timedelta
+
+from attendance_archive import attendance_table
+from attendance_rollup import ROLLUP_COLUMNS, STATUS_COLUMNS, OTHER_COLUMN, month_start
+from models import month_range
+from work_calendar import work_calendar
+
+DEFAULT_PAGE_SIZE = 31
+MAX_PAGE_SIZE = 366
+
+HISTORY_COLUMNS = 'id, attendance_date, check_in, check_out, status, notes'
+
+
+def _record(row):
+    return {
+        'id': row.id,
+        'date': row.attendance_date.isoformat(),
+        'check_in': row.check_in.strftime('%H:%M') if row.check_in else None,
+        'check_out': row.check_out.strftime('%H:%M') if row.check_out else None,
+        'status': row.status,
+        'notes': row.notes,
+    }
+
+
+def history_page(cursor, employee_id, start=None, end=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    سجلات الموظف في [start, end) من الأحدث للأقدم بترقيم keyset على attendance_date
+    (سجل واحد لكل موظف في اليوم): before هو آخر تاريخ في الصفحة السابقة.
+    يعيد (السجلات، المؤشر التالي).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    upper = min(filter(None, (end, before)), default=None)
+    query = f'SELECT TOP (?) {HISTORY_COLUMNS} FROM {attendance_table(start)} WHERE employee_id = ?'
+    params = [limit + 1, employee_id]
+    if start:
+        query += ' AND attendance_date >= ?'
+        params.append(start)
+    if upper:
+        query += ' AND attendance_date < ?'
+        params.append(upper)
+    cursor.execute(query + ' ORDER BY attendance_date DESC', params)
+    rows = cursor.fetchall()
+    next_cursor = rows[limit - 1].attendance_date.isoformat() if len(rows) > limit else None
+    return [_record(row) for row in rows[:limit]], next_cursor
+
+
+def month_view(cursor, employee_id, year, month, department_id=None):
+    """أيام الشهر كلها (تقويم) مع يوم العمل وسجل الحضور إن وجد"""
+    start, end = month_range(year, month)
+    cursor.execute(f'''
+        SELECT {HISTORY_COLUMNS} FROM {attendance_table(start)}
+        WHERE employee_id = ? AND attendance_date >= ? AND attendance_date < ?
+    ''', (employee_id, start, end))
+    records = {row.attendance_date: _record(row) for row in cursor.fetchall()}
+    days = work_calendar.month_days(year, month, department_id)
+    for offset, day in enumerate(days):
+        day['record'] = records.get(start + timedelta(days=offset))
+    return days
+
+
+def _count_records(cursor, employee_id, start, end):
+    """أعداد الحالات مباشرة من سجلات الحضور (لأطراف الفترة غير المكتملة شهراً)"""
+    statuses = ', '.join(f"'{status}'" for status in STATUS_COLUMNS)
+    cursor.execute(f'''
+        SELECT {', '.join(f"SUM(CASE WHEN status = '{status}' THEN 1 ELSE 0 END) AS {column}"
+                          for status, column in STATUS_COLUMNS.items())},
+               SUM(CASE WHEN status IN ({statuses}) THEN 0 ELSE 1 END) AS {OTHER_COLUMN}
+        FROM {attendance_table(start)}
+        WHERE employee_id = ? AND attendance_date >= ? AND attendance_date < ?
+    ''', (employee_id, start, end))
+    row = cursor.fetchone()
+    return {column: (getattr(row, column) or 0) if row else 0 for column in ROLLUP_COLUMNS}
+
+
+def range_totals(cursor, employee_id, start, end, department_id=None):
+    """
+    إجماليات [start, end): الأشهر الكاملة من AttendanceMonthly والطرفان
+    (جزء من شهر في البداية أو النهاية) من سجلات الحضور مباشرة.
+    """
+    totals = dict.fromkeys(ROLLUP_COLUMNS, 0)
+    first_full = start if start.day == 1 else month_range(start.year, start.month)[1]
+    last_full = month_start(end)  # نهاية الأشهر الكاملة (حصرية)
+
+    if first_full < last_full:
+        cursor.execute(f'''
+            SELECT {', '.join(f'SUM({column}) AS {column}' for column in ROLLUP_COLUMNS)}
+            FROM AttendanceMonthly
+            WHERE employee_id = ? AND month_start >= ? AND month_start < ?
+        ''', (employee_id, first_full, last_full))
+        row = cursor.fetchone()
+        for column in ROLLUP_COLUMNS:
+            totals[column] += (getattr(row, column) or 0) if row else 0
+        edges = [(start, first_full), (last_full, end)]
+    else:
+        edges = [(start, end)]
+
+    for edge_start, edge_end in edges:
+        if edge_start < edge_end:
+            for column, count in _count_records(cursor, employee_id, edge_start, edge_end).items():
+                totals[column] += count
+
+    recorded = totals['present_days'] + totals['late_days'] + totals['absent_days']
+    working_days = work_calendar.working_days_between(start, min(end, date.today() + timedelta(days=1)),
+                                                      department_id)
+    return dict(
+        totals,
+        working_days=working_days,
+        attendance_rate=round((totals['present_days'] + totals['late_days']) / recorded * 100, 1)
+        if recorded else 0,
+    )
+
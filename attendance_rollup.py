@@ -0,0 +1,364 @@
+import argparse
+import json
+from collections import Counter
+from datetime import date, datetime
+
+from db_pool import get_db_connection
+
+# حالة سجل الحضور -> عمود الملخص الشهري
+STATUS_COLUMNS = {
+    'present': 'present_days',
+    'late': 'late_days',
+    'absent': 'absent_days',
+}
+OTHER_COLUMN = 'other_days'
+ROLLUP_COLUMNS = tuple(STATUS_COLUMNS.values()) + (OTHER_COLUMN,)
+
+# تطبيق كل الفروق في عبارة واحدة: [[الموظف، أول الشهر، العمود، الفرق], ...]
+APPLY_DELTAS_SQL = f'''
+    MERGE AttendanceMonthly WITH (HOLDLOCK) AS t
+    USING (
+        SELECT employee_id, month_start,
+               {', '.join(f"SUM(CASE WHEN counter = '{column}' THEN delta ELSE 0 END) AS {column}"
+                          for column in ROLLUP_COLUMNS)}
+        FROM OPENJSON(?) WITH (
+            employee_id INT '$[0]',
+            month_start DATE '$[1]',
+            counter NVARCHAR(20) '$[2]',
+            delta INT '$[3]'
+        )
+        GROUP BY employee_id, month_start
+    ) AS s
+    ON t.employee_id = s.employee_id AND t.month_start = s.month_start
+    WHEN MATCHED THEN
+        UPDATE SET {', '.join(f't.{column} = t.{column} + s.{column}' for column in ROLLUP_COLUMNS)},
+                   updated_at = GETDATE()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (employee_id, month_start, {', '.join(ROLLUP_COLUMNS)})
+        VALUES (s.employee_id, s.month_start, {', '.join(f's.{column}' for column in ROLLUP_COLUMNS)});
+'''
+
+# الملخص اليومي يُحسب بالقسم الحالي للموظف (مثل DAILY_REBUILD_SQL)، وسجلات الموظفين المحذوفين لا تُحسب
+_MERGE_DAILY_COUNTS = f'''
+    ON t.attendance_date = s.attendance_date AND t.department_id = s.department_id
+    WHEN MATCHED THEN
+        UPDATE SET {', '.join(f't.{column} = t.{column} + s.{column}' for column in ROLLUP_COLUMNS)}
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (attendance_date, department_id, {', '.join(ROLLUP_COLUMNS)})
+        VALUES (s.attendance_date, s.department_id, {', '.join(f's.{column}' for column in ROLLUP_COLUMNS)});
+'''
+
+# نفس الفروق مجمعة حسب اليوم وقسم الموظف (لسلاسل الحضور اليومية)
+APPLY_DAILY_DELTAS_SQL = f'''
+    MERGE AttendanceDaily WITH (HOLDLOCK) AS t
+    USING (
+        SELECT j.attendance_date, ISNULL(e.department_id, 0) AS department_id,
+               {', '.join(f"SUM(CASE WHEN j.counter = '{column}' THEN j.delta ELSE 0 END) AS {column}"
+                          for column in ROLLUP_COLUMNS)}
+        FROM OPENJSON(?) WITH (
+            employee_id INT '$[0]',
+            attendance_date DATE '$[1]',
+            counter NVARCHAR(20) '$[2]',
+            delta INT '$[3]'
+        ) j
+        JOIN Employees e ON e.id = j.employee_id
+        GROUP BY j.attendance_date, ISNULL(e.department_id, 0)
+    ) AS s
+''' + _MERGE_DAILY_COUNTS
+
+# نقل كل أيام موظفين بين أقسام الملخص اليومي: [[الموظف، القسم، الإشارة], ...]
+# القسم null = القسم الحالي (قبل حذف الموظف)
+MOVE_DAILY_SQL = f'''
+    MERGE AttendanceDaily WITH (HOLDLOCK) AS t
+    USING (
+        SELECT a.attendance_date, COALESCE(j.department_id, e.department_id, 0) AS department_id,
+               {', '.join(f"SUM(CASE WHEN a.status = '{status}' THEN j.sign ELSE 0 END) AS {column}"
+                          for status, column in STATUS_COLUMNS.items())},
+               SUM(CASE WHEN a.status IN ({', '.join(f"'{status}'" for status in STATUS_COLUMNS)})
+                        THEN 0 ELSE j.sign END) AS {OTHER_COLUMN}
+        FROM OPENJSON(?) WITH (
+            employee_id INT '$[0]',
+            department_id INT '$[1]',
+            sign INT '$[2]'
+        ) j
+        JOIN Employees e ON e.id = j.employee_id
+        JOIN AttendanceAll a ON a.employee_id = j.employee_id
+        GROUP BY a.attendance_date, COALESCE(j.department_id, e.department_id, 0)
+    ) AS s
+''' + _MERGE_DAILY_COUNTS
+
+# إعادة حساب فترة من الأشهر [start, end) من الحضور الساخن والمؤرشف (العرض AttendanceAll)
+REBUILD_SQL = f'''
+    SET NOCOUNT ON;
+    DELETE FROM AttendanceMonthly WHERE month_start >= ? AND month_start < ?;
+    INSERT INTO AttendanceMonthly (employee_id, month_start, {', '.join(ROLLUP_COLUMNS)})
+    SELECT employee_id, DATEFROMPARTS(YEAR(attendance_date), MONTH(attendance_date), 1),
+           {', '.join(f"SUM(CASE WHEN status = '{status}' THEN 1 ELSE 0 END)"
+                      for status in STATUS_COLUMNS)},
+           SUM(CASE WHEN status IN ({', '.join(f"'{status}'" for status in STATUS_COLUMNS)})
+                    THEN 0 ELSE 1 END)
+    FROM AttendanceAll
+    WHERE attendance_date >= ? AND attendance_date < ?
+      AND employee_id IN (SELECT id FROM Employees)
+    GROUP BY employee_id, DATEFROMPARTS(YEAR(attendance_date), MONTH(attendance_date), 1);
+    SELECT @@ROWCOUNT;
+'''
+
+DAILY_REBUILD_SQL = f'''
+    SET NOCOUNT ON;
+    DELETE FROM AttendanceDaily WHERE attendance_date >= ? AND attendance_date < ?;
+    INSERT INTO AttendanceDaily (attendance_date, department_id, {', '.join(ROLLUP_COLUMNS)})
+    SELECT a.attendance_date, ISNULL(e.department_id, 0),
+           {', '.join(f"SUM(CASE WHEN a.status = '{status}' THEN 1 ELSE 0 END)"
+                      for status in STATUS_COLUMNS)},
+           SUM(CASE WHEN a.status IN ({', '.join(f"'{status}'" for status in STATUS_COLUMNS)})
+                    THEN 0 ELSE 1 END)
+    FROM AttendanceAll a
+    JOIN Employees e ON e.id = a.employee_id
+    WHERE a.attendance_date >= ? AND a.attendance_date < ?
+    GROUP BY a.attendance_date, ISNULL(e.department_id, 0);
+    SELECT @@ROWCOUNT;
+'''
+
+# يزيد عند تغيير سجلات أيام سابقة حتى تُهمل السلاسل اليومية المخزنة مؤقتاً في هذه العملية
+past_days_version = 0
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+# ==================== التحديث التدريجي ====================
+
+def apply_deltas(cursor, deltas):
+    """
+    تطبيق فروق {(الموظف، أول الشهر، العمود): الفرق} داخل معاملة المستدعي.
+    يجب استدعاؤها قبل commit حتى يتغير الملخص مع سجلات الحضور معاً.
+    """
+    payload = [[employee_id, start.isoformat(), column, delta]
+               for (employee_id, start, column), delta in deltas.items() if delta]
+    if payload:
+        cursor.execute(APPLY_DELTAS_SQL, (json.dumps(payload),))
+
+
+def apply_daily_deltas(cursor, deltas):
+    """تطبيق فروق {(الموظف، التاريخ، العمود): الفرق} على الملخص اليومي للأقسام"""
+    global past_days_version
+    payload = [[employee_id, day.isoformat(), column, delta]
+               for (employee_id, day, column), delta in deltas.items() if delta]
+    if payload:
+        cursor.execute(APPLY_DAILY_DELTAS_SQL, (json.dumps(payload),))
+        today = date.today()
+        if any(day < today for _, day, _ in deltas):
+            past_days_version += 1
+
+
+def record_changes(cursor, changes):
+    """
+    changes = [(الموظف، تاريخ الحضور، الحالة القديمة، الحالة الجديدة)]
+    الحالة القديمة None لسجل جديد، والجديدة None لسجل محذوف.
+    """
+    deltas = Counter()
+    daily = Counter()
+    for employee_id, attendance_date, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        if isinstance(attendance_date, str):
+            attendance_date = datetime.strptime(attendance_date[:10], '%Y-%m-%d').date()
+        start = month_start(attendance_date)
+        if old_status is not None:
+            column = STATUS_COLUMNS.get(old_status, OTHER_COLUMN)
+            deltas[(employee_id, start, column)] -= 1
+            daily[(employee_id, attendance_date, column)] -= 1
+        if new_status is not None:
+            column = STATUS_COLUMNS.get(new_status, OTHER_COLUMN)
+            deltas[(employee_id, start, column)] += 1
+            daily[(employee_id, attendance_date, column)] += 1
+    apply_deltas(cursor, deltas)
+    apply_daily_deltas(cursor, daily)
+
+
+def _department(department_id):
+    return int(department_id) if department_id else 0
+
+
+def _move_days(cursor, payload):
+    global past_days_version
+    if payload:
+        cursor.execute(MOVE_DAILY_SQL, (json.dumps(payload),))
+        past_days_version += 1
+
+
+def employees_moved(cursor, moves):
+    """
+    moves = [(الموظف، القسم القديم، القسم الجديد)] بعد تعديل Employees وقبل commit:
+    تنقل أيام الموظف في الملخص اليومي إلى قسمه الجديد حتى تطابق إعادة البناء.
+    """
+    payload = []
+    for employee_id, old_department_id, new_department_id in moves:
+        old_department_id = _department(old_department_id)
+        new_department_id = _department(new_department_id)
+        if old_department_id != new_department_id:
+            payload += [[employee_id, old_department_id, -1], [employee_id, new_department_id, 1]]
+    _move_days(cursor, payload)
+
+
+def employees_removed(cursor, employee_ids):
+    """طرح أيام الموظفين من الملخص اليومي؛ تُستدعى قبل DELETE (الحضور الساخن يُحذف معهم)"""
+    _move_days(cursor, [[employee_id, None, -1] for employee_id in employee_ids])
+
+
+# ==================== إعادة البناء ====================
+
+def rebuild(start=None, end=None, conn=None):
+    """
+    إعادة حساب الأشهر من start حتى end (شاملة) في الملخصين الشهري واليومي في معاملة واحدة.
+    بدون فترة يُعاد بناء كل التاريخ (للتعبئة الأولى). يعيد عدد الصفوف المكتوبة.
+    """
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        if start is None or end is None:
+            cursor.execute('SELECT MIN(attendance_date), MAX(attendance_date) FROM AttendanceAll')
+            first, last = cursor.fetchone()
+            if first is None:
+                return 0
+            start = start or first
+            end = end or last
+        range_start = month_start(start)
+        range_end = _add_months(month_start(end), 1)
+        cursor.execute(REBUILD_SQL, (range_start, range_end, range_start, range_end))
+        written = cursor.fetchone()[0]
+        cursor.execute(DAILY_REBUILD_SQL, (range_start, range_end, range_start, range_end))
+        written += cursor.fetchone()[0]
+        conn.commit()
+        return written
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_connection:
+            conn.close()
+
+
+# ==================== القراءة ====================
+
+def monthly_report(cursor, year, month, department_id=None):
+    """تقرير الحضور الشهري لكل موظف من الملخص (نفس أعمدة attendance_report)"""
+    query = '''
+        SELECT
+            e.id,
+            e.employee_id,
+            e.first_name + ' ' + e.last_name as employee_name,
+            e.position,
+            d.name as department_name,
+            ISNULL(m.present_days + m.late_days + m.absent_days, 0) as days_present,
+            ISNULL(m.late_days, 0) as days_late,
+            ISNULL(m.absent_days, 0) as days_absent
+        FROM Employees e
+        LEFT JOIN Departments d ON e.department_id = d.id
+        LEFT JOIN AttendanceMonthly m ON m.employee_id = e.id AND m.month_start = ?
+    '''
+    params = [date(year, month, 1)]
+    if department_id:
+        query += ' WHERE e.department_id = ?'
+        params.append(department_id)
+    query += ' ORDER BY employee_name'
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def daily_totals(cursor, start, end, department_id=None):
+    """{التاريخ: {العمود: العدد}} للفترة [start, end) من الملخص اليومي"""
+    query = f'''
+        SELECT attendance_date, {', '.join(f'SUM({column}) AS {column}' for column in ROLLUP_COLUMNS)}
+        FROM AttendanceDaily
+        WHERE attendance_date >= ? AND attendance_date < ?
+    '''
+    params = [start, end]
+    if department_id:
+        query += ' AND department_id = ?'
+        params.append(department_id)
+    cursor.execute(query + ' GROUP BY attendance_date', params)
+    return {_as_date(row.attendance_date): {column: getattr(row, column) or 0 for column in ROLLUP_COLUMNS}
+            for row in cursor.fetchall()}
+
+
+def live_totals(cursor, day, department_id=None):
+    """أعداد يوم واحد مباشرة من جدول الحضور (لليوم الحالي)"""
+    query = f'''
+        SELECT {', '.join(f"SUM(CASE WHEN a.status = '{status}' THEN 1 ELSE 0 END) AS {column}"
+                          for status, column in STATUS_COLUMNS.items())},
+               SUM(CASE WHEN a.status IN ({', '.join(f"'{status}'" for status in STATUS_COLUMNS)})
+                        THEN 0 ELSE 1 END) AS {OTHER_COLUMN}
+        FROM Attendance a
+    '''
+    params = [day]
+    if department_id:
+        query += ' JOIN Employees e ON e.id = a.employee_id AND e.department_id = ?'
+        params.insert(0, department_id)
+    cursor.execute(query + ' WHERE a.attendance_date = ?', params)
+    row = cursor.fetchone()
+    return {column: (getattr(row, column) or 0) if row else 0 for column in ROLLUP_COLUMNS}
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+
+def trend(cursor, months=12, department_id=None, until=None):
+    """إجماليات آخر months شهراً (الأقدم أولاً) لتقرير الاتجاه الشهري"""
+    last = month_start(until or date.today())
+    first = _add_months(last, -(months - 1))
+    query = f'''
+        SELECT m.month_start,
+               {', '.join(f'SUM(m.{column}) AS {column}' for column in ROLLUP_COLUMNS)},
+               COUNT(DISTINCT m.employee_id) AS employees
+        FROM AttendanceMonthly m
+    '''
+    params = [first, _add_months(last, 1)]
+    if department_id:
+        query += ' JOIN Employees e ON e.id = m.employee_id AND e.department_id = ?'
+        params.insert(0, department_id)
+    query += ' WHERE m.month_start >= ? AND m.month_start < ? GROUP BY m.month_start'
+    cursor.execute(query, params)
+    rows = {row.month_start: row for row in cursor.fetchall()}
+
+    result = []
+    for index in range(months):
+        start = _add_months(first, index)
+        row = rows.get(start)
+        counts = {column: (getattr(row, column) or 0) if row else 0 for column in ROLLUP_COLUMNS}
+        recorded = counts['present_days'] + counts['late_days'] + counts['absent_days']
+        result.append(dict(
+            counts,
+            month=start.strftime('%Y-%m'),
+            employees=row.employees if row else 0,
+            attendance_rate=round((counts['present_days'] + counts['late_days']) / recorded * 100, 1)
+            if recorded else 0,
+        ))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='تعبئة أو إعادة بناء ملخص الحضور الشهري')
+    parser.add_argument('--from', dest='start', help='أول شهر YYYY-MM (افتراضياً أقدم سجل)')
+    parser.add_argument('--to', dest='end', help='آخر شهر YYYY-MM (افتراضياً أحدث سجل)')
+    args = parser.parse_args()
+
+    def parse_month(value):
+        return datetime.strptime(value, '%Y-%m').date() if value else None
+
+    written = rebuild(parse_month(args.start), parse_month(args.end))
+    print(f"✅ تمت إعادة بناء ملخص الحضور الشهري ({written} صف)")
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import date, timedelta
+
+import attendance_rollup
+from db_pool import get_db_connection
+
+MAX_RANGE_DAYS = 731
+PAST_CACHE_TTL = 600
+PAST_CACHE_SIZE = 256
+
+
+class PastSeriesCache:
+    """
+    الأيام السابقة لا تتغير إلا نادراً، فتُحفظ نتيجتها لكل (الفترة، القسم).
+    المدخل يُهمل بعد TTL (لكتابات العمال الآخرين) أو عند تغير
+    attendance_rollup.past_days_version (لكتابات هذه العملية).
+    """
+
+    def __init__(self, ttl=PAST_CACHE_TTL, max_size=PAST_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = {}  # المفتاح -> (وقت الانتهاء، الإصدار، الأعداد)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, version, totals = entry
+        if expires_at < time.monotonic() or version != attendance_rollup.past_days_version:
+            return None
+        return totals
+
+    def put(self, key, totals):
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, attendance_rollup.past_days_version, totals)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+past_series_cache = PastSeriesCache()
+
+
+def daily_series(start, end, department_id=None, today=None):
+    """
+    سلاسل الحضور اليومية للفترة [start, end): الأيام السابقة من الملخص اليومي
+    (AttendanceDaily عبر الذاكرة المؤقتة) واليوم الحالي فقط يُحسب مباشرة.
+    """
+    if end <= start:
+        raise ValueError('نهاية الفترة يجب أن تكون بعد بدايتها')
+    if (end - start).days > MAX_RANGE_DAYS:
+        raise ValueError(f'أقصى فترة {MAX_RANGE_DAYS} يوماً')
+    today = today or date.today()
+    past_end = min(end, today)
+
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        totals = {}
+        if start < past_end:
+            key = (start, past_end, department_id)
+            past = past_series_cache.get(key)
+            if past is None:
+                past = attendance_rollup.daily_totals(cursor, start, past_end, department_id)
+                past_series_cache.put(key, past)
+            totals.update(past)
+        if start <= today < end:
+            totals[today] = attendance_rollup.live_totals(cursor, today, department_id)
+    finally:
+        conn.close()
+
+    series = {'dates': [], 'present': [], 'late': [], 'absent': []}
+    day = start
+    while day < end and day <= today:
+        counts = totals.get(day, {})
+        series['dates'].append(day.isoformat())
+        series['present'].append(counts.get('present_days', 0))
+        series['late'].append(counts.get('late_days', 0))
+        series['absent'].append(counts.get('absent_days', 0))
+        day += timedelta(days=1)
+    return series
+
+
+def etag(payload):
+    """بصمة ثابتة للاستجابة (لـ ETag / If-None-Match)"""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
@@ -3,6 +3,8 @@ import pyodbc
 import bcrypt
 from functools import wraps
 
+from db_pool import get_db_connection
+
 # إنشاء Blueprint
 auth_bp = Blueprint('auth', __name__)
 
@@ -34,17 +36,6 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# دالة الاتصال بقاعدة البيانات (مؤقتة)
-def get_db_connection():
-    try:
-        connection_string = 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=.\\SQLEXPRESS;DATABASE=HR_System;UID=sa;PWD=admin'
-        # ملاحظة: من الأفضل نقل سلسلة الاتصال إلى ملف إعدادات خارجي
-        conn = pyodbc.connect(connection_string)
-        return conn
-    except Exception as e:
-        print(f"❌ خطأ في الاتصال بقاعدة البيانات: {e}")
-        return None
-
 # مسارات المصادقة
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -55,9 +46,10 @@ def login():
         
         user = None
         try:
-            with get_db_connection() as conn:
-                if conn is None:
-                    raise pyodbc.Error("فشل الاتصال بقاعدة البيانات")
+            conn = get_db_connection()
+            if conn is None:
+                raise pyodbc.Error("فشل الاتصال بقاعدة البيانات")
+            with conn:
                 with conn.cursor() as cursor:
                     cursor.execute('''
                         SELECT id, username, password_hash, role, employee_id, is_active 
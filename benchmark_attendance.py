@@ -0,0 +1,149 @@
+"""
+مقارنة استعلامات الحضور الشهرية: MONTH()/YEAR() مقابل فترة تاريخ نصف مفتوحة،
+بدون فهارس ثم مع فهارس init_db، على جدول اصطناعي منفصل (AttendanceBench).
+
+    python benchmark_attendance.py --rows 10000000
+"""
+import argparse
+import re
+import time
+
+import pyodbc
+
+from config import Config
+from models import month_range
+
+TABLE = 'AttendanceBench'
+
+CREATE_TABLE_SQL = f'''
+    IF OBJECT_ID('dbo.{TABLE}', 'U') IS NOT NULL DROP TABLE dbo.{TABLE};
+    CREATE TABLE dbo.{TABLE} (
+        id BIGINT IDENTITY(1,1) PRIMARY KEY,
+        employee_id INT NOT NULL,
+        attendance_date DATE NOT NULL,
+        check_in TIME(0),
+        check_out TIME(0),
+        status NVARCHAR(20)
+    );
+'''
+
+# توليد الصفوف داخل SQL Server (بدون نقلها عبر الشبكة): كل صف = موظف في يوم
+POPULATE_SQL = f'''
+    WITH numbers AS (
+        SELECT TOP (?) ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) - 1 + ? AS n
+        FROM sys.all_objects a CROSS JOIN sys.all_objects b CROSS JOIN sys.all_objects c
+    )
+    INSERT INTO dbo.{TABLE} WITH (TABLOCK) (employee_id, attendance_date, check_in, check_out, status)
+    SELECT n % ? + 1,
+           DATEADD(day, n / ?, ?),
+           DATEADD(minute, ABS(CHECKSUM(NEWID())) % 90, CAST('07:30' AS TIME(0))),
+           DATEADD(minute, ABS(CHECKSUM(NEWID())) % 120, CAST('15:30' AS TIME(0))),
+           CASE ABS(CHECKSUM(NEWID())) % 20 WHEN 0 THEN 'absent' WHEN 1 THEN 'late' WHEN 2 THEN 'late'
+                ELSE 'present' END
+    FROM numbers;
+'''
+
+INDEXES_SQL = (
+    f'CREATE INDEX IX_{TABLE}_Date_Status ON dbo.{TABLE} (attendance_date, status) INCLUDE (employee_id);',
+    f'CREATE INDEX IX_{TABLE}_Employee_Date ON dbo.{TABLE} (employee_id, attendance_date) '
+    f'INCLUDE (status, check_in, check_out);',
+)
+
+QUERIES = {
+    'monthly_attendance (MONTH/YEAR)': (f'''
+        SELECT COUNT(DISTINCT employee_id) FROM dbo.{TABLE}
+        WHERE MONTH(attendance_date) = ? AND YEAR(attendance_date) = ? AND status IN ('present', 'late')
+    ''', 'month_year'),
+    'monthly_attendance (range)': (f'''
+        SELECT COUNT(DISTINCT employee_id) FROM dbo.{TABLE}
+        WHERE attendance_date >= ? AND attendance_date < ? AND status IN ('present', 'late')
+    ''', 'range'),
+    'employee_month (MONTH/YEAR)': (f'''
+        SELECT COUNT(*), SUM(CASE WHEN status = 'late' THEN 1 ELSE 0 END) FROM dbo.{TABLE}
+        WHERE employee_id = ? AND MONTH(attendance_date) = ? AND YEAR(attendance_date) = ?
+    ''', 'employee_month_year'),
+    'employee_month (range)': (f'''
+        SELECT COUNT(*), SUM(CASE WHEN status = 'late' THEN 1 ELSE 0 END) FROM dbo.{TABLE}
+        WHERE employee_id = ? AND attendance_date >= ? AND attendance_date < ?
+    ''', 'employee_range'),
+}
+
+
+def connect():
+    return pyodbc.connect(Config().DATABASE_CONNECTION_STRING, autocommit=True)
+
+
+def populate(cursor, rows, employees, start_date, batch_size=1_000_000):
+    cursor.execute(CREATE_TABLE_SQL)
+    started = time.perf_counter()
+    for offset in range(0, rows, batch_size):
+        count = min(batch_size, rows - offset)
+        cursor.execute(POPULATE_SQL, (count, offset, employees, employees, start_date))
+        print(f"   - {offset + count:,} / {rows:,} صف")
+    print(f"✅ تم إنشاء {rows:,} صف في {time.perf_counter() - started:.1f} ثانية")
+
+
+def _params(kind, year, month, employee_id):
+    start, end = month_range(year, month)
+    return {
+        'month_year': (month, year),
+        'range': (start, end),
+        'employee_month_year': (employee_id, month, year),
+        'employee_range': (employee_id, start, end),
+    }[kind]
+
+
+def run_query(cursor, sql, params, repeat):
+    """أفضل زمن من عدة محاولات، مع القراءات المنطقية وعمليات الوصول من الخطة الفعلية"""
+    best = None
+    plan = ''
+    for _ in range(repeat):
+        cursor.execute('SET STATISTICS XML ON;')
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        elapsed = time.perf_counter() - started
+        if cursor.nextset():
+            plan = cursor.fetchone()[0]
+        cursor.execute('SET STATISTICS XML OFF;')
+        best = elapsed if best is None else min(best, elapsed)
+
+    reads = sum(int(value) for value in re.findall(r'ActualLogicalReads="(\d+)"', plan))
+    operators = sorted({operator for operator in re.findall(r'PhysicalOp="([^"]+)"', plan)
+                        if 'Scan' in operator or 'Seek' in operator})
+    return best * 1000, reads, ', '.join(operators)
+
+
+def report(cursor, label, year, month, employee_id, repeat):
+    print(f"\n{label}")
+    print(f"{'الاستعلام':<32}{'ms':>10}{'logical reads':>16}   الوصول")
+    for name, (sql, kind) in QUERIES.items():
+        milliseconds, reads, operators = run_query(cursor, sql, _params(kind, year, month, employee_id), repeat)
+        print(f"{name:<32}{milliseconds:>10.1f}{reads:>16,}   {operators}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='قياس استعلامات الحضور بالفهارس وبدونها')
+    parser.add_argument('--rows', type=int, default=10_000_000, help='عدد صفوف الجدول الاصطناعي')
+    parser.add_argument('--employees', type=int, default=5000, help='عدد الموظفين')
+    parser.add_argument('--start-date', default='2020-01-01', help='تاريخ أول يوم')
+    parser.add_argument('--repeat', type=int, default=3, help='عدد مرات تنفيذ كل استعلام')
+    parser.add_argument('--keep', action='store_true', help='عدم حذف الجدول بعد القياس')
+    args = parser.parse_args()
+
+    conn = connect()
+    cursor = conn.cursor()
+    try:
+        populate(cursor, args.rows, args.employees, args.start_date)
+        cursor.execute(f'SELECT MAX(attendance_date) FROM dbo.{TABLE}')
+        last_date = cursor.fetchone()[0]
+        year, month = last_date.year, last_date.month
+
+        report(cursor, '🔎 بدون فهارس', year, month, 1, args.repeat)
+        for statement in INDEXES_SQL:
+            cursor.execute(statement)
+        report(cursor, '🔎 مع فهارس init_db', year, month, 1, args.repeat)
+    finally:
+        if not args.keep:
+            cursor.execute(f"IF OBJECT_ID('dbo.{TABLE}', 'U') IS NOT NULL DROP TABLE dbo.{TABLE};")
+        conn.close()
@@ -0,0 +1,144 @@
+import json
+
+import attendance_rollup
+import department_counts
+
+# حالات الموظف المسموح بها (نفس خيارات نموذج التعديل)
+EMPLOYEE_STATUSES = ('active', 'inactive', 'on_leave', 'terminated')
+MAX_PREVIEW_ROWS = 500
+
+# قائمة المعرفات تُمرر كنص JSON واحد بدلاً من معامل لكل موظف (حد SQL Server 2100 معامل)
+_SELECTED_IDS = "SELECT id FROM OPENJSON(?) WITH (id INT '$')"
+
+
+class BulkOperationError(ValueError):
+    """بيانات العملية الجماعية غير صالحة"""
+
+
+def _result(rows, dry_run):
+    return {
+        'dry_run': dry_run,
+        'affected': len(rows),
+        'rows': [dict(zip([column[0] for column in row.cursor_description], row))
+                 for row in rows[:MAX_PREVIEW_ROWS]],
+        'rows_truncated': len(rows) > MAX_PREVIEW_ROWS,
+    }
+
+
+def _execute(conn, preview_sql, update_sql, params, dry_run, moves=None):
+    """
+    المعاينة: SELECT بنفس الشرط بدون أي تعديل.
+    التنفيذ: عبارة UPDATE واحدة تعيد الصفوف المتأثرة عبر OUTPUT ثم commit واحد.
+    moves: دالة تعيد (القسم القديم، الحالة القديمة، القسم الجديد، الحالة الجديدة) لكل صف
+    لتحديث أعداد موظفي الأقسام والملخص اليومي للحضور في نفس المعاملة.
+    """
+    cursor = conn.cursor()
+    if dry_run:
+        cursor.execute(preview_sql, params)
+        return _result(cursor.fetchall(), dry_run)
+    try:
+        cursor.execute(update_sql, params)
+        rows = cursor.fetchall()
+        if moves and rows:
+            moved = [moves(row) for row in rows]
+            department_counts.employees_moved(cursor, moved)
+            attendance_rollup.employees_moved(cursor, [(row.id, old_department_id, new_department_id)
+                                                       for row, (old_department_id, _, new_department_id, _)
+                                                       in zip(rows, moved)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return _result(rows, dry_run)
+
+
+def _validate_department(department_id):
+    try:
+        return int(department_id)
+    except (TypeError, ValueError):
+        raise BulkOperationError('القسم مطلوب')
+
+
+def _validate_ids(employee_ids):
+    if not employee_ids:
+        raise BulkOperationError('لم يتم اختيار أي موظف')
+    try:
+        return json.dumps(sorted({int(employee_id) for employee_id in employee_ids}))
+    except (TypeError, ValueError):
+        raise BulkOperationError('معرفات الموظفين غير صالحة')
+
+
+def raise_salaries(conn, department_id, percent, status='active', dry_run=False):
+    """زيادة رواتب قسم بنسبة مئوية في عبارة واحدة"""
+    department_id = _validate_department(department_id)
+    try:
+        percent = float(percent)
+    except (TypeError, ValueError):
+        raise BulkOperationError('نسبة الزيادة غير صالحة')
+    if percent <= -100 or percent > 100:
+        raise BulkOperationError('نسبة الزيادة يجب أن تكون بين -100 و 100')
+
+    where = 'WHERE department_id = ?'
+    params = [percent, department_id]
+    if status:
+        where += ' AND status = ?'
+        params.append(status)
+
+    preview_sql = f'''
+        SELECT id, employee_id, salary AS old_salary,
+               CAST(ROUND(salary * (1 + ? / 100.0), 2) AS DECIMAL(10, 2)) AS new_salary
+        FROM Employees {where}
+    '''
+    update_sql = f'''
+        UPDATE Employees
+        SET salary = ROUND(salary * (1 + ? / 100.0), 2), updated_at = GETDATE()
+        OUTPUT inserted.id, inserted.employee_id, deleted.salary AS old_salary, inserted.salary AS new_salary
+        {where}
+    '''
+    return _execute(conn, preview_sql, update_sql, params, dry_run)
+
+
+def transfer_employees(conn, employee_ids, department_id, dry_run=False):
+    """نقل مجموعة موظفين إلى قسم آخر في عبارة واحدة"""
+    department_id = _validate_department(department_id)
+    ids_json = _validate_ids(employee_ids)
+    params = [department_id, ids_json, department_id]
+
+    preview_sql = f'''
+        SELECT id, employee_id, department_id AS old_department_id, ? AS new_department_id
+        FROM Employees
+        WHERE id IN ({_SELECTED_IDS}) AND ISNULL(department_id, 0) <> ?
+    '''
+    update_sql = f'''
+        UPDATE Employees
+        SET department_id = ?, updated_at = GETDATE()
+        OUTPUT inserted.id, inserted.employee_id,
+               deleted.department_id AS old_department_id, inserted.department_id AS new_department_id,
+               inserted.status
+        WHERE id IN ({_SELECTED_IDS}) AND ISNULL(department_id, 0) <> ?
+    '''
+    return _execute(conn, preview_sql, update_sql, params, dry_run,
+                    moves=lambda row: (row.old_department_id, row.status, row.new_department_id, row.status))
+
+
+def change_status(conn, employee_ids, status, dry_run=False):
+    """تغيير حالة مجموعة موظفين في عبارة واحدة"""
+    if status not in EMPLOYEE_STATUSES:
+        raise BulkOperationError(f'حالة غير معروفة: {status}')
+    ids_json = _validate_ids(employee_ids)
+    params = [status, ids_json, status]
+
+    preview_sql = f'''
+        SELECT id, employee_id, status AS old_status, ? AS new_status
+        FROM Employees
+        WHERE id IN ({_SELECTED_IDS}) AND ISNULL(status, '') <> ?
+    '''
+    update_sql = f'''
+        UPDATE Employees
+        SET status = ?, updated_at = GETDATE()
+        OUTPUT inserted.id, inserted.employee_id, deleted.status AS old_status, inserted.status AS new_status,
+               inserted.department_id
+        WHERE id IN ({_SELECTED_IDS}) AND ISNULL(status, '') <> ?
+    '''
+    return _execute(conn, preview_sql, update_sql, params, dry_run,
+                    moves=lambda row: (row.department_id, row.old_status, row.department_id, row.new_status))
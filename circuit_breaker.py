@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pyodbc
+
+
+class CircuitOpenError(pyodbc.OperationalError):
+    """قاعدة البيانات معلّمة كغير متاحة؛ يتم رفض الطلب فوراً بدون محاولة اتصال"""
+
+
+class CircuitBreaker:
+    """
+    قاطع دائرة لاتصالات قاعدة البيانات.
+    بعد عدد من الإخفاقات خلال نافذة زمنية ينتقل إلى الحالة المفتوحة ويرفض الطلبات فوراً،
+    بينما يحاول خيط في الخلفية الاتصال كل فترة تهدئة حتى يعود الخادم.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, probe, failure_threshold=3, window=30, cooldown=15):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+
+        self._state = self.CLOSED
+        self._failures = deque()
+        self._lock = threading.Lock()
+        self._opened_at = None
+        self._last_error = None
+        self._trips = 0
+        self._rejected = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """هل يُسمح بمحاولة الاتصال؟ (فقط في الحالة المغلقة)"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            self._rejected += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError('قاعدة البيانات غير متاحة حالياً')
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                self._failures.clear()
+
+    def record_failure(self, error=None):
+        now = time.monotonic()
+        with self._lock:
+            self._last_error = str(error) if error else None
+            if self._state != self.CLOSED:
+                return
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window:
+                self._failures.popleft()
+            if len(self._failures) < self.failure_threshold:
+                return
+            self._state = self.OPEN
+            self._opened_at = datetime.now()
+            self._trips += 1
+
+        print(f"⚠️ قاطع الدائرة مفتوح: قاعدة البيانات غير متاحة ({self._last_error})")
+        threading.Thread(target=self._probe_loop, name='db-circuit-probe', daemon=True).start()
+
+    def _probe_loop(self):
+        """محاولة الاتصال في الخلفية حتى يعود الخادم ثم إغلاق الدائرة"""
+        while True:
+            time.sleep(self.cooldown)
+            with self._lock:
+                self._state = self.HALF_OPEN
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self._state = self.OPEN
+                    self._last_error = str(e)
+                continue
+
+            with self._lock:
+                self._state = self.CLOSED
+                self._failures.clear()
+                self._opened_at = None
+            print("✅ قاطع الدائرة مغلق: تمت استعادة الاتصال بقاعدة البيانات")
+            return
+
+    def info(self):
+        """حالة القاطع لاستخدامها في فحص الصحة"""
+        with self._lock:
+            return {
+                'state': self._state,
+                'recent_failures': len(self._failures),
+                'failure_threshold': self.failure_threshold,
+                'cooldown': self.cooldown,
+                'opened_at': self._opened_at.isoformat() if self._opened_at else None,
+                'last_error': self._last_error,
+                'trips': self._trips,
+                'rejected': self._rejected,
+            }
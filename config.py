@@ -11,6 +11,22 @@ class Config:
     DATABASE_PASSWORD = os.environ.get('DATABASE_PASSWORD') or 'admin'
     DATABASE_DRIVER = '{ODBC Driver 17 for SQL Server}'
     
+    # إعدادات مجمع الاتصالات
+    DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 20))
+    DB_POOL_TIMEOUT = 10  # ثوانٍ انتظار اتصال متاح
+    DB_POOL_RECYCLE = 1800  # إغلاق الاتصالات الخاملة أكثر من 30 دقيقة
+    DB_POOL_PING_AFTER = 5  # فحص الاتصال قبل استخدامه إذا كان خاملاً أكثر من 5 ثوانٍ
+    DB_CONNECT_TIMEOUT = 5  # مهلة تسجيل الدخول إلى SQL Server
+    
+    # إعدادات قاطع الدائرة
+    DB_BREAKER_FAILURE_THRESHOLD = 3  # عدد الإخفاقات لفتح الدائرة
+    DB_BREAKER_WINDOW = 30  # خلال 30 ثانية
+    DB_BREAKER_COOLDOWN = 15  # فترة التهدئة بين محاولات الاستعادة
+    
+    # وضع الكتابة المؤجلة لأحداث الحضور (رد فوري وكتابة على دفعات في الخلفية)
+    ATTENDANCE_WRITE_BEHIND = os.environ.get('ATTENDANCE_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+    
     # إعدادات الجلسة
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
     SESSION_COOKIE_HTTPONLY = True
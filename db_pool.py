@@ -0,0 +1,329 @@
+import threading
+import time
+from collections import deque
+
+import pyodbc
+from flask import g, has_app_context
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from config import Config
+
+
+class PoolTimeoutError(pyodbc.OperationalError):
+    """لا يوجد اتصال متاح في المجمع خلال مهلة الانتظار"""
+
+
+class PooledConnection:
+    """غلاف حول اتصال pyodbc يعيده إلى المجمع عند الإغلاق بدلاً من قطعه"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+        # عدد المستخدمين لنفس الاتصال داخل الطلب (مثلاً المسار ودوال models)
+        self._refs = 1
+
+    def __getattr__(self, name):
+        if self._released:
+            raise pyodbc.ProgrammingError('Attempt to use a closed connection.')
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # نفس سلوك اتصال pyodbc: تأكيد المعاملة عند النجاح دون إغلاق الاتصال
+        if exc_type is None:
+            self._raw.commit()
+        else:
+            self._raw.rollback()
+        return False
+
+    @property
+    def closed(self):
+        return self._released
+
+    def close(self):
+        """إعادة الاتصال إلى المجمع عندما يغلقه آخر مستخدم (آمن عند الاستدعاء أكثر من مرة)"""
+        self._refs -= 1
+        if self._refs <= 0:
+            self.release()
+
+    def release(self):
+        """إعادة الاتصال إلى المجمع فوراً بغض النظر عن عدد المستخدمين"""
+        if not self._released:
+            self._released = True
+            self._pool._release(self._raw)
+
+
+class ConnectionPool:
+    """مجمع اتصالات pyodbc آمن للخيوط مع فحص الصلاحية وإعادة تدوير الاتصالات الخاملة"""
+
+    def __init__(self, connection_string, min_size=2, max_size=20, timeout=10,
+                 recycle=1800, ping_after=5, connect_timeout=5, breaker=None):
+        self.connection_string = connection_string
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+
+        # الاتصالات الخاملة: (الاتصال، وقت آخر استخدام) - الأحدث في النهاية
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._counters = {
+            'created': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'recycled': 0,
+            'failed_health_checks': 0,
+            'connect_errors': 0,
+        }
+
+    # ---------- إدارة الاتصالات الخام ----------
+
+    def _connect(self):
+        # timeout هنا هو مهلة تسجيل الدخول في ODBC
+        return pyodbc.connect(self.connection_string, timeout=self.connect_timeout)
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except pyodbc.Error:
+            pass
+
+    def _is_healthy(self, raw):
+        try:
+            cursor = raw.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _prune_idle(self, now):
+        """إغلاق الاتصالات الخاملة لفترة أطول من recycle مع الإبقاء على min_size"""
+        stale = []
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.recycle:
+            stale.append(self._idle.popleft()[0])
+            self._size -= 1
+            self._counters['recycled'] += 1
+        return stale
+
+    # ---------- الواجهة العامة ----------
+
+    def acquire(self):
+        """حجز اتصال من المجمع أو إنشاء اتصال جديد إذا سمح الحد الأقصى"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.breaker is not None:
+                # الرفض الفوري أثناء انقطاع قاعدة البيانات بدلاً من انتظار مهلة الاتصال
+                self.breaker.check()
+            raw = None
+            last_used = None
+            with self._cond:
+                if self._idle:
+                    raw, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    # حجز مكان للاتصال الجديد قبل فتحه خارج القفل
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f'لا يوجد اتصال متاح في المجمع بعد {self.timeout} ثانية')
+                    self._counters['waits'] += 1
+                    self._cond.wait(remaining)
+                    continue
+
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception as e:
+                    with self._cond:
+                        self._size -= 1
+                        self._counters['connect_errors'] += 1
+                        self._cond.notify()
+                    if self.breaker is not None:
+                        self.breaker.record_failure(e)
+                    raise
+                with self._cond:
+                    self._counters['created'] += 1
+                if self.breaker is not None:
+                    self.breaker.record_success()
+            else:
+                idle_for = time.monotonic() - last_used
+                if idle_for > self.recycle or (idle_for > self.ping_after and not self._is_healthy(raw)):
+                    # اتصال قديم أو معطوب: يُغلق ونحاول مرة أخرى
+                    self._discard(raw)
+                    with self._cond:
+                        self._size -= 1
+                        if idle_for > self.recycle:
+                            self._counters['recycled'] += 1
+                        else:
+                            self._counters['failed_health_checks'] += 1
+                        self._cond.notify()
+                    if self.breaker is not None and idle_for <= self.recycle:
+                        self.breaker.record_failure('فشل فحص صلاحية الاتصال')
+                    continue
+
+            with self._cond:
+                self._counters['checkouts'] += 1
+            return PooledConnection(self, raw)
+
+    def _release(self, raw):
+        try:
+            # تجاهل أي معاملة لم يتم تأكيدها حتى لا تنتقل للمستخدم التالي
+            raw.rollback()
+        except pyodbc.Error:
+            self._discard(raw)
+            with self._cond:
+                self._size -= 1
+                self._counters['failed_health_checks'] += 1
+                self._cond.notify()
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            self._idle.append((raw, now))
+            stale = self._prune_idle(now)
+            self._cond.notify()
+        for old in stale:
+            self._discard(old)
+
+    def warm_up(self):
+        """فتح الحد الأدنى من الاتصالات مسبقاً (يُستدعى عند بدء التشغيل)"""
+        connections = []
+        try:
+            while len(connections) < self.min_size:
+                connections.append(self.acquire())
+        except Exception as e:
+            print(f"❌ تعذر تجهيز مجمع الاتصالات: {e}")
+        for conn in connections:
+            conn.close()
+
+    def close_all(self):
+        """إغلاق جميع الاتصالات الخاملة"""
+        with self._cond:
+            idle = [raw for raw, _ in self._idle]
+            self._size -= len(idle)
+            self._idle.clear()
+        for raw in idle:
+            self._discard(raw)
+
+    def stats(self):
+        """إحصائيات المجمع الحالية"""
+        with self._cond:
+            data = dict(self._counters)
+            data.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        return data
+
+
+# ==================== المجمع المشترك للتطبيق ====================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pool_from_settings(settings):
+    connection_string = (
+        f"DRIVER={settings['DATABASE_DRIVER']};SERVER={settings['DATABASE_SERVER']};"
+        f"DATABASE={settings['DATABASE_NAME']};UID={settings['DATABASE_USERNAME']};"
+        f"PWD={settings['DATABASE_PASSWORD']}"
+    )
+    connect_timeout = settings.get('DB_CONNECT_TIMEOUT', 5)
+
+    def probe():
+        pyodbc.connect(connection_string, timeout=connect_timeout).close()
+
+    breaker = CircuitBreaker(
+        probe,
+        failure_threshold=settings.get('DB_BREAKER_FAILURE_THRESHOLD', 3),
+        window=settings.get('DB_BREAKER_WINDOW', 30),
+        cooldown=settings.get('DB_BREAKER_COOLDOWN', 15),
+    )
+    return ConnectionPool(
+        connection_string,
+        min_size=settings.get('DB_POOL_MIN_SIZE', 2),
+        max_size=settings.get('DB_POOL_MAX_SIZE', 20),
+        timeout=settings.get('DB_POOL_TIMEOUT', 10),
+        recycle=settings.get('DB_POOL_RECYCLE', 1800),
+        ping_after=settings.get('DB_POOL_PING_AFTER', 5),
+        connect_timeout=connect_timeout,
+        breaker=breaker,
+    )
+
+
+def _release_request_connection(exception=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.release()
+
+
+def init_app(app):
+    """إنشاء المجمع من إعدادات التطبيق وربط تحرير الاتصال بنهاية سياق الطلب"""
+    global _pool
+    with _pool_lock:
+        _pool = _pool_from_settings(app.config)
+    app.teardown_appcontext(_release_request_connection)
+    app.extensions['db_pool'] = _pool
+    return _pool
+
+
+def get_pool():
+    """المجمع المشترك؛ يُنشأ من Config إذا لم يتم استدعاء init_app"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = Config()
+                _pool = _pool_from_settings({key: getattr(config, key) for key in dir(config)
+                                             if key.isupper() and key != 'DATABASE_CONNECTION_STRING'})
+    return _pool
+
+
+def get_db_connection():
+    """
+    إرجاع اتصال من المجمع، أو None عند الفشل.
+    داخل سياق الطلب يُعاد نفس الاتصال لكل من يطلبه، ويعود إلى المجمع
+    عندما يغلقه آخر مستخدم أو تلقائياً عند نهاية الطلب.
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is not None and not conn.closed:
+            conn._refs += 1
+            return conn
+    try:
+        conn = get_pool().acquire()
+    except CircuitOpenError:
+        return None
+    except Exception as e:
+        print(f"❌ خطأ في الاتصال بقاعدة البيانات: {e}")
+        return None
+    if has_app_context():
+        g._db_conn = conn
+    return conn
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def database_health():
+    """حالة قاطع الدائرة؛ is_available تكون False أثناء الانقطاع"""
+    breaker = get_pool().breaker
+    info = breaker.info()
+    info['is_available'] = info['state'] == CircuitBreaker.CLOSED
+    return info
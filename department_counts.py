@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from collections import Counter
+
+from db_pool import get_db_connection
+
+# الموظفون بدون قسم يُحسبون تحت القسم 0
+NO_DEPARTMENT = 0
+
+# تطبيق كل الفروق في عبارة واحدة: [[القسم، الحالة، الفرق], ...]
+APPLY_DELTAS_SQL = '''
+    MERGE DepartmentHeadcounts WITH (HOLDLOCK) AS t
+    USING (
+        SELECT department_id, status, SUM(delta) AS delta
+        FROM OPENJSON(?) WITH (
+            department_id INT '$[0]',
+            status NVARCHAR(20) '$[1]',
+            delta INT '$[2]'
+        )
+        GROUP BY department_id, status
+    ) AS s
+    ON t.department_id = s.department_id AND t.status = s.status
+    WHEN MATCHED THEN
+        UPDATE SET employee_count = t.employee_count + s.delta, updated_at = GETDATE()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (department_id, status, employee_count) VALUES (s.department_id, s.status, s.delta);
+'''
+
+RECONCILE_SQL = '''
+    SET NOCOUNT ON;
+    MERGE DepartmentHeadcounts WITH (HOLDLOCK) AS t
+    USING (
+        SELECT ISNULL(department_id, 0) AS department_id, ISNULL(status, '') AS status,
+               COUNT(*) AS employee_count
+        FROM Employees
+        GROUP BY ISNULL(department_id, 0), ISNULL(status, '')
+    ) AS s
+    ON t.department_id = s.department_id AND t.status = s.status
+    WHEN MATCHED AND t.employee_count <> s.employee_count THEN
+        UPDATE SET employee_count = s.employee_count, updated_at = GETDATE()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (department_id, status, employee_count) VALUES (s.department_id, s.status, s.employee_count)
+    WHEN NOT MATCHED BY SOURCE THEN
+        DELETE;
+    SELECT @@ROWCOUNT;
+'''
+
+# أعداد الموظفين لكل قسم من جدول الملخص (للاستخدام في LEFT JOIN)
+HEADCOUNTS_SUBQUERY = '''
+    SELECT department_id,
+           SUM(employee_count) AS employee_count,
+           SUM(CASE WHEN status = 'active' THEN employee_count ELSE 0 END) AS active_count
+    FROM DepartmentHeadcounts
+    GROUP BY department_id
+'''
+
+
+def _key(department_id, status):
+    return int(department_id) if department_id else NO_DEPARTMENT, status or ''
+
+
+def apply_deltas(cursor, deltas):
+    """
+    تطبيق فروق الأعداد {(القسم، الحالة): الفرق} داخل معاملة المستدعي.
+    يجب استدعاؤها قبل commit حتى يتغير الملخص مع بيانات الموظفين معاً.
+    """
+    payload = [[department_id, status, delta]
+               for (department_id, status), delta in deltas.items() if delta]
+    if payload:
+        cursor.execute(APPLY_DELTAS_SQL, (json.dumps(payload),))
+
+
+def employee_added(cursor, department_id, status):
+    apply_deltas(cursor, {_key(department_id, status): 1})
+
+
+def employee_removed(cursor, department_id, status):
+    apply_deltas(cursor, {_key(department_id, status): -1})
+
+
+def employee_changed(cursor, old_department_id, old_status, new_department_id, new_status):
+    old_key = _key(old_department_id, old_status)
+    new_key = _key(new_department_id, new_status)
+    if old_key != new_key:
+        apply_deltas(cursor, {old_key: -1, new_key: 1})
+
+
+def employees_moved(cursor, moves):
+    """فروق مجمعة لعدة موظفين: moves = [(القسم القديم، الحالة القديمة، القسم الجديد، الحالة الجديدة)]"""
+    deltas = Counter()
+    for old_department_id, old_status, new_department_id, new_status in moves:
+        deltas[_key(old_department_id, old_status)] -= 1
+        deltas[_key(new_department_id, new_status)] += 1
+    apply_deltas(cursor, deltas)
+
+
+def employees_added(cursor, rows):
+    """rows = [(القسم، الحالة)] لموظفين تمت إضافتهم"""
+    apply_deltas(cursor, Counter(_key(department_id, status) for department_id, status in rows))
+
+
+def reconcile(conn=None):
+    """إعادة حساب الملخص من جدول الموظفين وتصحيح أي انحراف؛ يعيد عدد الصفوف المصححة"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        cursor.execute(RECONCILE_SQL)
+        corrected = cursor.fetchone()[0]
+        conn.commit()
+        return corrected
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_connection:
+            conn.close()
+
+
+_reconciler = None
+
+
+def _reconcile_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            corrected = reconcile()
+            if corrected:
+                print(f"⚠️ تم تصحيح {corrected} من أعداد موظفي الأقسام")
+        except Exception as e:
+            print(f"❌ تعذر مطابقة أعداد موظفي الأقسام: {e}")
+
+
+def start_reconciler(interval=3600):
+    """مطابقة دورية في الخلفية لتصحيح أي انحراف في الملخص"""
+    global _reconciler
+    if _reconciler is None:
+        _reconciler = threading.Thread(target=_reconcile_loop, args=(interval,),
+                                       name='department-counts', daemon=True)
+        _reconciler.start()
+
+
+if __name__ == '__main__':
+    print(f"✅ تمت المطابقة، عدد الصفوف المصححة: {reconcile()}")
@@ -0,0 +1,317 @@
+import argparse
+import os
+import re
+import time
+from datetime import datetime
+
+import pyodbc
+
+import department_counts
+from db_pool import get_db_connection
+from expiry_index import license_expiry_date
+from id_allocator import employee_id_allocator
+
+# الأعمدة المقبولة في الملف (نفس أسماء حقول نموذج إضافة موظف) -> أعمدة الجدول
+FILE_COLUMNS = {
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'email': 'email',
+    'phone': 'phone',
+    'address': 'address',
+    'position': 'position',
+    'salary': 'salary',
+    'hire_date': 'hire_date',
+    'birth_date': 'birth_date',
+    'gender': 'gender',
+    'status': 'status',
+    'national_number': 'national_number',
+    'release_date': 'ReleaseDate',
+    'license_date': 'LicenseIssuanceDate',
+    'license_type': 'LicenseType',
+    'academic_qualification': 'AcademicQualification',
+    'graduation_date': 'GraduationDate',
+    'appreciation': 'Appreciation',
+    'insurance_number': 'InsuranceNumber',
+    'bank_account_number': 'BankAccountNumber',
+    'salary_disbursement_method': 'SalaryDisbursementMethod',
+    'contract_type': 'ContractType',
+    'contract_start': 'ContractStart',
+    'contract_end': 'ContractEnd',
+}
+REQUIRED_FIELDS = ('first_name', 'last_name', 'email', 'position', 'salary', 'hire_date')
+DATE_FIELDS = ('hire_date', 'birth_date', 'release_date', 'license_date',
+               'graduation_date', 'contract_start', 'contract_end')
+
+INSERT_COLUMNS = (
+    'employee_id', 'first_name', 'last_name', 'email', 'phone', 'address',
+    'department_id', 'position', 'salary', 'hire_date', 'birth_date', 'gender', 'status',
+    'national_number', 'ReleaseDate', 'LicenseIssuanceDate', 'LicenseType',
+    'LicenseExpiryDate', 'AcademicQualification', 'GraduationDate', 'Appreciation',
+    'InsuranceNumber', 'BankAccountNumber', 'SalaryDisbursementMethod',
+    'ContractType', 'ContractStart', 'ContractEnd'
+)
+INSERT_SQL = f'''
+    INSERT INTO Employees ({', '.join(INSERT_COLUMNS)})
+    VALUES ({', '.join('?' for _ in INSERT_COLUMNS)})
+'''
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+MAX_REPORTED_ERRORS = 1000
+_DEPARTMENT_POSITION = INSERT_COLUMNS.index('department_id')
+_STATUS_POSITION = INSERT_COLUMNS.index('status')
+
+
+# ==================== قراءة الملفات على دفعات ====================
+
+def _clean(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return str(value).strip()
+
+
+def iter_csv_chunks(stream, chunk_size):
+    """قراءة CSV على دفعات عبر pandas دون تحميل الملف كاملاً في الذاكرة"""
+    import pandas as pd
+
+    reader = pd.read_csv(stream, chunksize=chunk_size, dtype=str,
+                         keep_default_na=False, encoding='utf-8-sig')
+    for frame in reader:
+        frame.columns = [str(column).strip().lower() for column in frame.columns]
+        yield [{key: _clean(value) for key, value in row.items()}
+               for row in frame.to_dict('records')]
+
+
+def iter_xlsx_chunks(stream, chunk_size):
+    """قراءة XLSX في وضع القراءة فقط (بدون تحميل الملف كاملاً في الذاكرة)"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_clean(cell).lower() for cell in next(rows, ())]
+        chunk = []
+        for values in rows:
+            if not any(value is not None for value in values):
+                continue
+            chunk.append({key: _clean(value) for key, value in zip(header, values) if key})
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def iter_chunks(stream, filename, chunk_size):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        return iter_csv_chunks(stream, chunk_size)
+    if extension in ('xlsx', 'xlsm'):
+        return iter_xlsx_chunks(stream, chunk_size)
+    raise ValueError('نوع الملف غير مدعوم، يرجى استخدام CSV أو XLSX')
+
+
+# ==================== الاستيراد ====================
+
+class EmployeeImporter:
+    """استيراد الموظفين على دفعات مع التحقق من كل صف وتسجيل أخطائه دون إيقاف الاستيراد"""
+
+    def __init__(self, conn, batch_size=1000, dry_run=False):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+        self.total = 0
+        self.inserted = 0
+        self.validated = 0  # صفوف صالحة كانت ستُدخل (مع dry_run)
+        self.failed = 0
+        self.errors = []
+
+        self._load_lookups()
+
+    def _load_lookups(self):
+        """تحميل الأقسام والقيم الفريدة الموجودة مسبقاً للتحقق من التكرار في الذاكرة"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id, name FROM Departments')
+        self.department_ids = set()
+        self.department_names = {}
+        for row in cursor.fetchall():
+            self.department_ids.add(row.id)
+            self.department_names[row.name.strip().lower()] = row.id
+
+        cursor.execute('SELECT email, national_number FROM Employees')
+        self.seen_emails = set()
+        self.seen_national_numbers = set()
+        for row in cursor.fetchall():
+            if row.email:
+                self.seen_emails.add(row.email.strip().lower())
+            if row.national_number:
+                self.seen_national_numbers.add(row.national_number.strip())
+
+    def _add_error(self, line_number, messages):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line_number, 'errors': messages})
+
+    def _resolve_department(self, row, errors):
+        value = row.get('department_id') or row.get('department')
+        if not value:
+            errors.append('القسم مطلوب')
+            return None
+        if value.isdigit() and int(value) in self.department_ids:
+            return int(value)
+        department_id = self.department_names.get(value.lower())
+        if department_id is None:
+            errors.append(f'القسم غير موجود: {value}')
+        return department_id
+
+    def validate(self, row):
+        """التحقق من صف واحد؛ يعيد (قيم الإدخال، قائمة الأخطاء)"""
+        errors = []
+        for field in REQUIRED_FIELDS:
+            if not row.get(field):
+                errors.append(f'الحقل {field} مطلوب')
+
+        department_id = self._resolve_department(row, errors)
+
+        values = {field: row.get(field) or None for field in FILE_COLUMNS}
+
+        email = (values['email'] or '').lower()
+        if email and not EMAIL_PATTERN.match(email):
+            errors.append(f'بريد إلكتروني غير صالح: {email}')
+        elif email in self.seen_emails:
+            errors.append(f'البريد الإلكتروني مكرر: {email}')
+
+        national_number = values['national_number']
+        if national_number and national_number in self.seen_national_numbers:
+            errors.append(f'الرقم القومي مكرر: {national_number}')
+
+        if values['salary']:
+            try:
+                values['salary'] = float(values['salary'].replace(',', ''))
+            except ValueError:
+                errors.append(f"راتب غير صالح: {values['salary']}")
+
+        for field in DATE_FIELDS:
+            if values[field]:
+                try:
+                    values[field] = datetime.strptime(values[field][:10], '%Y-%m-%d').date()
+                except ValueError:
+                    errors.append(f'تاريخ غير صالح في {field}: {values[field]}')
+
+        if errors:
+            return None, errors
+
+        # حجز القيم الفريدة حتى تُكتشف الصفوف المكررة داخل نفس الملف
+        self.seen_emails.add(email)
+        if national_number:
+            self.seen_national_numbers.add(national_number)
+
+        record = {FILE_COLUMNS[field]: value for field, value in values.items()}
+        record['email'] = email
+        record['department_id'] = department_id
+        record['status'] = record['status'] or 'active'
+        record['LicenseExpiryDate'] = license_expiry_date(record['LicenseIssuanceDate'], record['LicenseType'])
+        # رقم الموظف يُحجز لكل دفعة عند الإدخال
+        record['employee_id'] = None
+        return tuple(record.get(column) for column in INSERT_COLUMNS), []
+
+    def _insert_batch(self, batch):
+        """إدخال دفعة واحدة؛ عند فشلها يُعاد إدخال صفوفها واحداً واحداً لتحديد الصف المسبب"""
+        if self.dry_run:
+            self.validated += len(batch)
+            return
+        if not batch:
+            return
+
+        # حجز أرقام الموظفين للدفعة كاملة في رحلة واحدة
+        employee_ids = employee_id_allocator.reserve(len(batch))
+        batch = [(line_number, (employee_id,) + params[1:])
+                 for (line_number, params), employee_id in zip(batch, employee_ids)]
+
+        cursor = self.conn.cursor()
+        cursor.fast_executemany = True
+        try:
+            cursor.executemany(INSERT_SQL, [params for _, params in batch])
+            department_counts.employees_added(
+                cursor, [(params[_DEPARTMENT_POSITION], params[_STATUS_POSITION]) for _, params in batch])
+            self.conn.commit()
+            self.inserted += len(batch)
+            return
+        except pyodbc.Error:
+            self.conn.rollback()
+
+        cursor = self.conn.cursor()
+        for line_number, params in batch:
+            try:
+                cursor.execute(INSERT_SQL, params)
+                department_counts.employee_added(cursor, params[_DEPARTMENT_POSITION], params[_STATUS_POSITION])
+                self.conn.commit()
+                self.inserted += 1
+            except pyodbc.Error as e:
+                self.conn.rollback()
+                self._add_error(line_number, [str(e)])
+
+    def run(self, chunks):
+        started = time.perf_counter()
+        batch = []
+        line_number = 1  # سطر العناوين
+        for chunk in chunks:
+            for row in chunk:
+                line_number += 1
+                self.total += 1
+                params, errors = self.validate(row)
+                if errors:
+                    self._add_error(line_number, errors)
+                    continue
+                batch.append((line_number, params))
+                if len(batch) >= self.batch_size:
+                    self._insert_batch(batch)
+                    batch = []
+        self._insert_batch(batch)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'total': self.total,
+            'inserted': self.inserted,
+            'validated': self.validated,
+            'failed': self.failed,
+            'dry_run': self.dry_run,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(self.total / elapsed, 1) if elapsed > 0 else self.total,
+        }
+
+
+def import_employees(stream, filename, batch_size=1000, chunk_size=5000, dry_run=False):
+    """استيراد ملف موظفين (CSV/XLSX) وإرجاع تقرير بالنتائج وأخطاء كل صف"""
+    chunks = iter_chunks(stream, filename, chunk_size)
+    conn = get_db_connection()
+    if not conn:
+        raise pyodbc.Error("فشل الاتصال بقاعدة البيانات")
+    try:
+        return EmployeeImporter(conn, batch_size=batch_size, dry_run=dry_run).run(chunks)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='استيراد الموظفين من ملف CSV أو XLSX')
+    parser.add_argument('path', help='مسار الملف')
+    parser.add_argument('--batch-size', type=int, default=1000, help='عدد الصفوف في كل عملية إدخال')
+    parser.add_argument('--dry-run', action='store_true', help='التحقق فقط بدون إدخال')
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as stream:
+        report = import_employees(stream, os.path.basename(args.path),
+                                  batch_size=args.batch_size, dry_run=args.dry_run)
+
+    succeeded = f"{report['validated']} صالح للإدخال" if report['dry_run'] else f"{report['inserted']} ناجح"
+    print(f"✅ تمت معالجة {report['total']} صف: {succeeded}، {report['failed']} فاشل "
+          f"({report['rows_per_second']} صف/ثانية)")
+    for error in report['errors']:
+        print(f"   - السطر {error['row']}: {'، '.join(error['errors'])}")
@@ -0,0 +1,122 @@
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+
+MAX_SUBSCRIBERS = 500
+SUBSCRIBER_QUEUE_SIZE = 100
+REPLAY_SIZE = 256
+KEEPALIVE_SECONDS = 15
+
+
+class EventBus:
+    """
+    ناقل أحداث داخل العملية للبث إلى المتصفحات (Server-Sent Events).
+    كل مشترك له طابور محدود؛ المشترك البطيء الذي يمتلئ طابوره يُفصل بدلاً من
+    إبطاء الناشر، والمتصفح يعيد الاتصال تلقائياً ويستكمل من آخر رقم حدث
+    (Last-Event-ID) ما دام ضمن آخر REPLAY_SIZE حدث.
+    """
+
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=REPLAY_SIZE)  # (الرقم، النوع، البيانات)
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = (next(self._ids), event_type, data)
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        # إشارة للمولد حتى يغلق الاتصال (يُفرغ مكاناً إن لزم)
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            subscriber.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def subscribe(self, last_event_id=None):
+        """
+        يعيد (الطابور، الأحداث الفائتة). الأحداث الفائتة None إذا كان last_event_id
+        أقدم من المحفوظ (يجب على المستدعي إرسال لقطة كاملة بدلاً منها).
+        """
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None, None
+            self._subscribers.add(subscriber)
+            missed = None
+            if last_event_id is not None and self._recent:
+                # رقم خارج المحفوظ (قديم جداً أو من قبل إعادة تشغيل الخادم) يحتاج لقطة كاملة
+                if self._recent[0][0] - 1 <= last_event_id <= self._recent[-1][0]:
+                    missed = [event for event in self._recent if event[0] > last_event_id]
+        return subscriber, missed
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def last_id(self):
+        with self._lock:
+            return self._recent[-1][0] if self._recent else None
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'recent': len(self._recent)}
+
+
+def format_sse(event_type, data, event_id=None):
+    """حدث واحد بصيغة text/event-stream"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, default=str)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(bus, snapshot, last_event_id=None, keepalive=KEEPALIVE_SECONDS):
+    """
+    مولد text/event-stream لمشترك واحد: لقطة أولية (أو الأحداث الفائتة) ثم الأحداث الجديدة.
+    snapshot دالة بدون معاملات تعيد بيانات اللقطة (من الذاكرة وليس من قاعدة البيانات).
+    """
+    subscriber, missed = bus.subscribe(last_event_id)
+    if subscriber is None:
+        yield format_sse('error', {'message': 'عدد المتابعين تجاوز الحد المسموح'})
+        return
+    try:
+        yield 'retry: 3000\n\n'
+        if missed is None:
+            yield format_sse('snapshot', snapshot(), bus.last_id())
+        else:
+            for event_id, event_type, data in missed:
+                yield format_sse(event_type, data, event_id)
+        while True:
+            try:
+                event = subscriber.get(timeout=keepalive)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                return
+            event_id, event_type, data = event
+            yield format_sse(event_type, data, event_id)
+    finally:
+        bus.unsubscribe(subscriber)
+
+
+attendance_bus = EventBus()
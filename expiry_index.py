@@ -0,0 +1,256 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+
+from db_pool import get_db_connection
+
+# أنواع التواريخ المفهرسة -> عمود الجدول
+EXPIRY_COLUMNS = {
+    'license': 'LicenseExpiryDate',
+    'contract': 'ContractEnd',
+}
+DIGEST_WINDOWS = (7, 30, 90)
+
+# علامة في سجل التعديلات: طُلب إعادة تحميل كامل أثناء إعادة البناء
+INVALIDATED = object()
+
+# سنوات صلاحية الرخصة حسب النوع
+LICENSE_VALIDITY_YEARS = {'خاصة': 10, 'مهنية': 5}
+
+
+def license_expiry_date(issue_date, license_type):
+    """تاريخ انتهاء الرخصة من تاريخ الإصدار ونوعها"""
+    years = LICENSE_VALIDITY_YEARS.get(license_type)
+    if not issue_date or not years:
+        return None
+    if isinstance(issue_date, str):
+        issue_date = datetime.strptime(issue_date, "%Y-%m-%d").date()
+    try:
+        return issue_date.replace(year=issue_date.year + years)
+    except ValueError:
+        # 29 فبراير في سنة غير كبيسة
+        return issue_date.replace(year=issue_date.year + years, day=28)
+
+
+def _as_date(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    return value
+
+
+class ExpiryIndex:
+    """
+    فهرس مرتب داخل الذاكرة لتواريخ انتهاء الرخص والعقود.
+    استعلام الفترة يتم عبر bisect في O(log n)، والملخص اليومي يُحسب مسبقاً
+    عند التحميل وعند كل تحديث وعند بداية كل يوم.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {kind: [] for kind in EXPIRY_COLUMNS}   # نوع -> [(التاريخ، id)] مرتبة
+        self._dates = {kind: {} for kind in EXPIRY_COLUMNS}     # نوع -> {id: التاريخ}
+        self._employees = {}                                    # id -> بيانات العرض
+        self._digest = None
+        self._loaded = False
+        self._scheduler = None
+        self._recorders = []        # تعديلات تراكمت أثناء كل إعادة بناء جارية
+
+    # ---------- التحميل ----------
+
+    @staticmethod
+    def _fetch(employee_id=None):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        cursor = conn.cursor()
+        query = '''
+            SELECT e.id, e.employee_id, e.first_name, e.last_name, e.status, e.department_id,
+                   d.name as department_name, e.LicenseType, e.LicenseExpiryDate, e.ContractType, e.ContractEnd
+            FROM Employees e
+            LEFT JOIN Departments d ON e.department_id = d.id
+        '''
+        if employee_id is None:
+            cursor.execute(query + ' WHERE e.LicenseExpiryDate IS NOT NULL OR e.ContractEnd IS NOT NULL')
+        else:
+            cursor.execute(query + ' WHERE e.id = ?', (employee_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    @staticmethod
+    def _employee(row):
+        return {
+            'id': row.id,
+            'employee_id': row.employee_id,
+            'name': f'{row.first_name} {row.last_name}',
+            'department_id': row.department_id,
+            'department': row.department_name,
+            'status': row.status,
+            'license_type': row.LicenseType,
+            'contract_type': row.ContractType,
+        }
+
+    def rebuild(self):
+        """
+        إعادة تحميل الفهرس بالكامل من قاعدة البيانات.
+        تحديثات الموظفين التي تصل أثناء القراءة تُسجل وتُعاد على النسخة الجديدة، وinvalidate
+        أثناءها يُبقي الفهرس بحاجة لإعادة تحميل لأن القراءة قد تسبق العملية الجماعية.
+        """
+        changes = []
+        with self._lock:
+            self._recorders.append(changes)
+        try:
+            entries = {kind: [] for kind in EXPIRY_COLUMNS}
+            dates = {kind: {} for kind in EXPIRY_COLUMNS}
+            employees = {}
+            for row in self._fetch():
+                employees[row.id] = self._employee(row)
+                for kind, column in EXPIRY_COLUMNS.items():
+                    value = _as_date(getattr(row, column))
+                    if value:
+                        entries[kind].append((value, row.id))
+                        dates[kind][row.id] = value
+            for kind in entries:
+                entries[kind].sort()
+
+            with self._lock:
+                self._entries = entries
+                self._dates = dates
+                self._employees = employees
+                for change in changes:
+                    if change is not INVALIDATED:
+                        self._apply_locked(*change)
+                self._loaded = INVALIDATED not in changes
+                self._digest = self._build_digest()
+        finally:
+            with self._lock:
+                self._recorders.remove(changes)
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+
+    # ---------- التحديث التدريجي ----------
+
+    def _remove_locked(self, employee_id):
+        for kind in EXPIRY_COLUMNS:
+            old = self._dates[kind].pop(employee_id, None)
+            if old is not None:
+                entries = self._entries[kind]
+                position = bisect_left(entries, (old, employee_id))
+                if position < len(entries) and entries[position] == (old, employee_id):
+                    del entries[position]
+        self._employees.pop(employee_id, None)
+
+    def _apply_locked(self, employee_id, row):
+        """استبدال تواريخ الموظف بما في row (None عند الحذف)"""
+        self._remove_locked(employee_id)
+        if row is None:
+            return
+        for kind, column in EXPIRY_COLUMNS.items():
+            value = _as_date(getattr(row, column))
+            if value:
+                insort(self._entries[kind], (value, employee_id))
+                self._dates[kind][employee_id] = value
+        if any(employee_id in self._dates[kind] for kind in EXPIRY_COLUMNS):
+            self._employees[employee_id] = self._employee(row)
+
+    def refresh_employee(self, employee_id):
+        """تحديث موظف واحد بعد الإضافة أو التعديل أو الحذف"""
+        if not self._loaded and not self._recorders:
+            return  # سيُحمّل الفهرس كاملاً عند أول استخدام
+        rows = self._fetch(employee_id)
+        row = rows[0] if rows else None
+        with self._lock:
+            self._apply_locked(employee_id, row)
+            for changes in self._recorders:
+                changes.append((employee_id, row))
+            self._digest = self._build_digest()
+
+    def remove(self, employee_id):
+        with self._lock:
+            self._remove_locked(employee_id)
+            for changes in self._recorders:
+                changes.append((employee_id, None))
+            if self._loaded:
+                self._digest = self._build_digest()
+
+    def invalidate(self):
+        """إعادة التحميل عند الاستخدام التالي (بعد عمليات جماعية)"""
+        with self._lock:
+            self._loaded = False
+            for changes in self._recorders:
+                changes.append(INVALIDATED)
+
+    # ---------- الاستعلام ----------
+
+    def _range_locked(self, kind, start, end):
+        entries = self._entries[kind]
+        low = bisect_left(entries, (start, 0))
+        high = bisect_right(entries, (end, float('inf')))
+        return [dict(self._employees[employee_id], kind=kind, expiry_date=expiry.isoformat())
+                for expiry, employee_id in entries[low:high]]
+
+    def expiring(self, start, end, kinds=None):
+        """كل ما ينتهي بين start و end (شاملة) مرتباً حسب التاريخ"""
+        self.ensure_loaded()
+        kinds = kinds or tuple(EXPIRY_COLUMNS)
+        with self._lock:
+            items = []
+            for kind in kinds:
+                items.extend(self._range_locked(kind, start, end))
+        items.sort(key=lambda item: item['expiry_date'])
+        return items
+
+    def _count_locked(self, kind, start, end):
+        entries = self._entries[kind]
+        return bisect_right(entries, (end, float('inf'))) - bisect_left(entries, (start, 0))
+
+    def _build_digest(self):
+        today = date.today()
+        digest = {'date': today.isoformat(), 'generated_at': datetime.now().isoformat(timespec='seconds')}
+        for kind in EXPIRY_COLUMNS:
+            digest[kind] = {
+                # المنتهية خلال آخر 30 يوماً
+                'expired': self._count_locked(kind, today - timedelta(days=30), today - timedelta(days=1)),
+                'windows': {str(days): self._count_locked(kind, today, today + timedelta(days=days))
+                            for days in DIGEST_WINDOWS},
+                'next_7_days': self._range_locked(kind, today, today + timedelta(days=7)),
+            }
+        return digest
+
+    def digest(self):
+        """الملخص اليومي المحسوب مسبقاً"""
+        self.ensure_loaded()
+        with self._lock:
+            if self._digest is None or self._digest['date'] != date.today().isoformat():
+                self._digest = self._build_digest()
+            return self._digest
+
+    # ---------- التحديث اليومي ----------
+
+    def _daily_loop(self):
+        while True:
+            now = datetime.now()
+            next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            time.sleep((next_midnight - now).total_seconds() + 1)
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"❌ تعذر تحديث فهرس تواريخ الانتهاء: {e}")
+
+    def start_daily_refresh(self):
+        """إعادة بناء الفهرس والملخص بعد منتصف كل ليلة في خيط بالخلفية"""
+        if self._scheduler is None:
+            self._scheduler = threading.Thread(target=self._daily_loop, name='expiry-digest', daemon=True)
+            self._scheduler.start()
+
+
+expiry_index = ExpiryIndex()
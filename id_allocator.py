@@ -0,0 +1,69 @@
+import threading
+
+import pyodbc
+
+from db_pool import get_db_connection
+
+SEQUENCE_NAME = 'dbo.EmployeeNumberSeq'
+
+# حجز مجموعة أرقام متتالية من التسلسل في رحلة واحدة؛ آمن بين العمليات المختلفة
+RESERVE_RANGE_SQL = '''
+    SET NOCOUNT ON;
+    DECLARE @first SQL_VARIANT;
+    EXEC sys.sp_sequence_get_range
+        @sequence_name = ?,
+        @range_size = ?,
+        @range_first_value = @first OUTPUT;
+    SELECT CAST(@first AS BIGINT);
+'''
+
+
+def format_employee_id(number):
+    return f"EMP{number:03d}"
+
+
+class EmployeeIdAllocator:
+    """
+    توليد أرقام الموظفين بطريقة hi/lo من تسلسل في قاعدة البيانات.
+    كل عملية تحجز مجموعة من الأرقام وتوزعها محلياً بدون الرجوع لقاعدة البيانات،
+    والأرقام لا تتكرر ولا يُعاد استخدامها بعد الحذف.
+    """
+
+    def __init__(self, block_size=20, sequence_name=SEQUENCE_NAME):
+        self.block_size = block_size
+        self.sequence_name = sequence_name
+        self._lock = threading.Lock()
+        self._next = 0
+        self._high = 0  # أول رقم خارج المجموعة المحجوزة
+
+    def _reserve(self, count):
+        """حجز count رقماً متتالياً وإرجاع أولها"""
+        conn = get_db_connection()
+        if not conn:
+            raise pyodbc.Error("فشل الاتصال بقاعدة البيانات")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(RESERVE_RANGE_SQL, (self.sequence_name, count))
+            return int(cursor.fetchone()[0])
+        finally:
+            conn.close()
+
+    def next_id(self):
+        """رقم الموظف التالي من المجموعة المحلية"""
+        with self._lock:
+            if self._next >= self._high:
+                self._next = self._reserve(self.block_size)
+                self._high = self._next + self.block_size
+            number = self._next
+            self._next += 1
+        return format_employee_id(number)
+
+    def reserve(self, count):
+        """حجز count رقماً متتالياً للاستيراد الجماعي"""
+        if count <= 0:
+            return []
+        first = self._reserve(count)
+        return [format_employee_id(number) for number in range(first, first + count)]
+
+
+employee_id_allocator = EmployeeIdAllocator()
@@ -1,6 +1,8 @@
 import pyodbc
 import bcrypt
 from config import Config
+from department_counts import RECONCILE_SQL
+import attendance_rollup
 
 def hash_password(password):
     """تجزئة كلمة المرور باستخدام bcrypt"""
@@ -96,6 +98,21 @@ def init_database():
                     );
                 ''')
 
+                # تسلسل أرقام الموظفين (يبدأ بعد أكبر رقم EMP موجود)
+                print("   - إنشاء تسلسل EmployeeNumberSeq...")
+                cursor.execute("SELECT 1 FROM sys.sequences WHERE name = 'EmployeeNumberSeq'")
+                if cursor.fetchone() is None:
+                    cursor.execute('''
+                        SELECT ISNULL(MAX(TRY_CAST(SUBSTRING(employee_id, 4, 20) AS BIGINT)), 0) + 1
+                        FROM Employees
+                        WHERE employee_id LIKE 'EMP%'
+                    ''')
+                    start_value = int(cursor.fetchone()[0])
+                    cursor.execute(f'''
+                        CREATE SEQUENCE dbo.EmployeeNumberSeq AS BIGINT
+                        START WITH {start_value} INCREMENT BY 1 NO CYCLE CACHE 50;
+                    ''')
+
                 # إضافة قيد على جدول الأقسام بعد إنشاء جدول الموظفين
                 cursor.execute('''
                     IF NOT EXISTS (SELECT * FROM sys.foreign_keys WHERE name = 'FK_Departments_Manager')
@@ -160,8 +177,218 @@ def init_database():
                     );
                 ''')
 
+                # سجل أحداث الحضور بمفتاح التكرار (لتجاهل إعادة إرسال نفس الحدث من الأجهزة)
+                print("   - إنشاء جدول AttendanceEvents...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AttendanceEvents' and xtype='U')
+                    CREATE TABLE AttendanceEvents (
+                        id BIGINT PRIMARY KEY IDENTITY(1,1),
+                        idempotency_key NVARCHAR(64) NOT NULL,
+                        employee_id INT NOT NULL,
+                        action NVARCHAR(10) NOT NULL,
+                        event_time DATETIME2(0) NOT NULL,
+                        result_code NVARCHAR(30),
+                        attendance_id INT,
+                        received_at DATETIME DEFAULT GETDATE(),
+                        CONSTRAINT UK_AttendanceEvents_Key UNIQUE (idempotency_key)
+                    );
+                ''')
+
+                # تقويم العمل: الإجازات الرسمية وأيام العمل التعويضية (القسم 0 = كل الشركة)
+                print("   - إنشاء جدولي WorkCalendar و DepartmentWeekends...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='WorkCalendar' and xtype='U')
+                    CREATE TABLE WorkCalendar (
+                        department_id INT NOT NULL DEFAULT 0,
+                        calendar_date DATE NOT NULL,
+                        is_working_day BIT NOT NULL DEFAULT 0,
+                        name NVARCHAR(100),
+                        created_at DATETIME DEFAULT GETDATE(),
+                        PRIMARY KEY (department_id, calendar_date)
+                    );
+                ''')
+                # أيام العطلة الأسبوعية لكل قسم بترقيم Python (الاثنين = 0)، مثال: '4,5' للجمعة والسبت
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='DepartmentWeekends' and xtype='U')
+                    CREATE TABLE DepartmentWeekends (
+                        department_id INT PRIMARY KEY,
+                        weekend_days NVARCHAR(20) NOT NULL
+                    );
+                ''')
+
+                # الدوام لكل قسم (القسم 0 = الافتراضي للشركة) لتصنيف الحضور والتأخير
+                print("   - إنشاء جدول DepartmentShifts...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='DepartmentShifts' and xtype='U')
+                    CREATE TABLE DepartmentShifts (
+                        department_id INT PRIMARY KEY,
+                        shift_start TIME(0) NOT NULL,
+                        shift_end TIME(0) NOT NULL,
+                        grace_minutes INT NOT NULL DEFAULT 0,
+                        early_leave_minutes INT NOT NULL DEFAULT 0
+                    );
+                ''')
+
+                # ملخص الحضور الشهري لكل موظف (يُحدّث مع كل تسجيل حضور)
+                print("   - إنشاء جدول AttendanceMonthly...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AttendanceMonthly' and xtype='U')
+                    CREATE TABLE AttendanceMonthly (
+                        employee_id INT NOT NULL,
+                        month_start DATE NOT NULL,
+                        present_days INT NOT NULL DEFAULT 0,
+                        late_days INT NOT NULL DEFAULT 0,
+                        absent_days INT NOT NULL DEFAULT 0,
+                        other_days INT NOT NULL DEFAULT 0,
+                        updated_at DATETIME DEFAULT GETDATE(),
+                        PRIMARY KEY (employee_id, month_start),
+                        FOREIGN KEY (employee_id) REFERENCES Employees(id) ON DELETE CASCADE
+                    );
+                ''')
+
+                # ملخص الحضور اليومي لكل قسم (لسلاسل /api/attendance/stats)
+                print("   - إنشاء جدول AttendanceDaily...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AttendanceDaily' and xtype='U')
+                    CREATE TABLE AttendanceDaily (
+                        attendance_date DATE NOT NULL,
+                        department_id INT NOT NULL,
+                        present_days INT NOT NULL DEFAULT 0,
+                        late_days INT NOT NULL DEFAULT 0,
+                        absent_days INT NOT NULL DEFAULT 0,
+                        other_days INT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (attendance_date, department_id)
+                    );
+                ''')
+
+                # أرشيف الحضور للسنوات المغلقة (بدون IDENTITY ولا مفاتيح خارجية حتى يقبل DELETE ... OUTPUT INTO)
+                print("   - إنشاء جدولي AttendanceArchive و AttendanceArchiveLog...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AttendanceArchive' and xtype='U')
+                    CREATE TABLE AttendanceArchive (
+                        id INT NOT NULL,
+                        employee_id INT NOT NULL,
+                        attendance_date DATE NOT NULL,
+                        check_in TIME,
+                        check_out TIME,
+                        status NVARCHAR(20),
+                        notes NVARCHAR(MAX),
+                        created_at DATETIME,
+                        updated_at DATETIME,
+                        archived_at DATETIME DEFAULT GETDATE()
+                    );
+                ''')
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AttendanceArchiveLog' and xtype='U')
+                    CREATE TABLE AttendanceArchiveLog (
+                        archive_year INT PRIMARY KEY,
+                        rows_moved INT NOT NULL,
+                        archived_at DATETIME DEFAULT GETDATE()
+                    );
+                ''')
+
+                # مسار القراءة التاريخية: الجدول الساخن والأرشيف معاً
+                print("   - إنشاء العرض AttendanceAll...")
+                cursor.execute('''
+                    IF OBJECT_ID('dbo.AttendanceAll', 'V') IS NULL
+                    EXEC('CREATE VIEW dbo.AttendanceAll AS
+                          SELECT id, employee_id, attendance_date, check_in, check_out, status, notes,
+                                 created_at, updated_at
+                          FROM dbo.Attendance
+                          UNION ALL
+                          SELECT id, employee_id, attendance_date, check_in, check_out, status, notes,
+                                 created_at, updated_at
+                          FROM dbo.AttendanceArchive');
+                ''')
+
+                # ملخص أعداد الموظفين لكل قسم وحالة (يُحدّث مع كل إضافة/تعديل/حذف)
+                print("   - إنشاء جدول DepartmentHeadcounts...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='DepartmentHeadcounts' and xtype='U')
+                    CREATE TABLE DepartmentHeadcounts (
+                        department_id INT NOT NULL,
+                        status NVARCHAR(20) NOT NULL,
+                        employee_count INT NOT NULL DEFAULT 0,
+                        updated_at DATETIME DEFAULT GETDATE(),
+                        PRIMARY KEY (department_id, status)
+                    );
+                ''')
+
                 print("\n✅ تم إنشاء جميع الجداول بنجاح.")
 
+                # --- الفهارس ---
+                print("\n🔄 جاري إنشاء الفهارس...")
+
+                # ترقيم قائمة الموظفين (keyset) مع الفلترة بالقسم والحالة
+                print("   - إنشاء فهارس Employees...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Employees_CreatedAt_Id')
+                    CREATE INDEX IX_Employees_CreatedAt_Id ON Employees (created_at DESC, id DESC);
+                ''')
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Employees_Department_Status')
+                    CREATE INDEX IX_Employees_Department_Status
+                    ON Employees (department_id, status, created_at DESC, id DESC);
+                ''')
+
+                # سجل حضور واحد لكل موظف في اليوم (يعتمد عليه MERGE في تسجيل الدفعات)
+                print("   - إنشاء قيد UK_Attendance_Employee_Date...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.key_constraints WHERE name = 'UK_Attendance_Employee_Date')
+                    ALTER TABLE Attendance
+                    ADD CONSTRAINT UK_Attendance_Employee_Date UNIQUE (employee_id, attendance_date);
+                ''')
+
+                # استعلامات الحضور بفترات التاريخ (إحصائيات اليوم/الشهر وتقرير الموظف)
+                print("   - إنشاء فهارس Attendance...")
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Attendance_Date_Status')
+                    CREATE INDEX IX_Attendance_Date_Status ON Attendance (attendance_date, status)
+                    INCLUDE (employee_id);
+                ''')
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Attendance_Employee_Date')
+                    CREATE INDEX IX_Attendance_Employee_Date ON Attendance (employee_id, attendance_date)
+                    INCLUDE (status, check_in, check_out);
+                ''')
+                # الأرشيف مخزن عمودياً ومضغوطاً، مع فهرس لسجل موظف واحد
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'CCI_AttendanceArchive')
+                    CREATE CLUSTERED COLUMNSTORE INDEX CCI_AttendanceArchive ON AttendanceArchive;
+                ''')
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AttendanceArchive_Employee_Date')
+                    CREATE INDEX IX_AttendanceArchive_Employee_Date ON AttendanceArchive (employee_id, attendance_date)
+                    INCLUDE (status, check_in, check_out);
+                ''')
+
+                # حذف مفاتيح التكرار الأقدم من مدة قبول الأحداث (attendance_events.purge_events)
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AttendanceEvents_EventTime')
+                    CREATE INDEX IX_AttendanceEvents_EventTime ON AttendanceEvents (event_time);
+                ''')
+
+                # اتجاه الحضور الشهري لكل الموظفين
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AttendanceMonthly_Month')
+                    CREATE INDEX IX_AttendanceMonthly_Month ON AttendanceMonthly (month_start)
+                    INCLUDE (present_days, late_days, absent_days, other_days);
+                ''')
+
+                # تواريخ انتهاء الرخص والعقود (فهارس مفلترة على الصفوف التي بها تاريخ فقط)
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Employees_LicenseExpiry')
+                    CREATE INDEX IX_Employees_LicenseExpiry ON Employees (LicenseExpiryDate)
+                    INCLUDE (employee_id, first_name, last_name, department_id, status, LicenseType)
+                    WHERE LicenseExpiryDate IS NOT NULL;
+                ''')
+                cursor.execute('''
+                    IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Employees_ContractEnd')
+                    CREATE INDEX IX_Employees_ContractEnd ON Employees (ContractEnd)
+                    INCLUDE (employee_id, first_name, last_name, department_id, status, ContractType)
+                    WHERE ContractEnd IS NOT NULL;
+                ''')
+
                 # --- الخطوة 3: إضافة البيانات الأولية ---
                 print("\n🔄 جاري إضافة البيانات الأولية...")
 
@@ -185,6 +412,15 @@ def init_database():
                 else:
                     print("   - 👍 قسم 'غير محدد' موجود بالفعل.")
 
+            # حساب أعداد موظفي الأقسام من البيانات الحالية
+            print("\n🔄 جاري مطابقة أعداد موظفي الأقسام...")
+            cursor.execute(RECONCILE_SQL)
+            print(f"   - ✅ تم تصحيح {cursor.fetchone()[0]} صف.")
+
+            # تعبئة ملخص الحضور الشهري واليومي من السجلات الحالية
+            print("\n🔄 جاري بناء ملخص الحضور الشهري واليومي...")
+            print(f"   - ✅ تم كتابة {attendance_rollup.rebuild(conn=conn)} صف.")
+
             conn.commit()
             print("\n🎉 اكتمل إعداد قاعدة البيانات بنجاح!")
 
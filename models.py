@@ -1,22 +1,63 @@
 from flask import Flask
-import pyodbc
+import base64
 from config import Config
-from datetime import datetime
+from datetime import datetime, date
+
+import db_pool
+import attendance_rollup
+import department_counts
+from db_pool import get_db_connection
+from attendance_archive import attendance_table
+from department_counts import HEADCOUNTS_SUBQUERY
+from work_calendar import work_calendar
+
+def month_range(year, month):
+    """بداية الشهر وبداية الشهر التالي (فترة نصف مفتوحة) ليستخدم الاستعلام فهرس attendance_date"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config())
+    db_pool.init_app(app)
     return app
 
-def get_db_connection():
-    config = Config()
-    conn = pyodbc.connect(config.DATABASE_CONNECTION_STRING)
-    return conn
-
 class Employee:
+    # الأعمدة المعروضة في قوائم الموظفين (بدون الحقول الثقيلة مثل documents)
+    LIST_COLUMNS = '''
+        e.id, e.employee_id, e.first_name, e.last_name, e.email, e.department_id,
+        e.position, e.salary, e.status, e.profile_picture_url, e.created_at,
+        d.name as department_name
+    '''
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
+    # الحقول الأساسية التي تُحمّل دائماً مع الموظف
+    CORE_COLUMNS = (
+        'id', 'employee_id', 'first_name', 'last_name', 'email', 'phone', 'address',
+        'department_id', 'position', 'salary', 'hire_date', 'birth_date', 'gender',
+        'status', 'profile_picture_url', 'created_at', 'updated_at'
+    )
+    # الحقول الثقيلة أو نادرة الاستخدام: تُحمّل عند أول وصول أو عبر include=
+    LAZY_GROUPS = {
+        'identity': ('national_number',),
+        'license': ('ReleaseDate', 'LicenseIssuanceDate', 'LicenseType', 'LicenseExpiryDate'),
+        'education': ('AcademicQualification', 'GraduationDate', 'Appreciation'),
+        'insurance': ('InsuranceNumber',),
+        'bank': ('BankAccountNumber', 'SalaryDisbursementMethod'),
+        'contract': ('ContractType', 'ContractStart', 'ContractEnd'),
+        # عمود الملفات الثنائية في قواعد البيانات القديمة فقط (الجديدة تحفظ الملفات في EmployeeFiles)
+        'documents': ('documents',),
+    }
+    # كل المجموعات الممتدة عدا الملفات الثنائية
+    EXTENDED_GROUPS = ('identity', 'license', 'education', 'insurance', 'bank', 'contract')
+    _LAZY_COLUMN_GROUP = {column: group for group, columns in LAZY_GROUPS.items() for column in columns}
+
     def __init__(self, id=None, employee_id=None, first_name=None, last_name=None, email=None, 
                  phone=None, address=None, department_id=None, position=None, salary=None, 
-                 hire_date=None, birth_date=None, gender=None, status=None, created_at=None):
+                 hire_date=None, birth_date=None, gender=None, status=None, created_at=None,
+                 profile_picture_url=None, updated_at=None, department_name=None):
         self.id = id
         self.employee_id = employee_id
         self.first_name = first_name
@@ -32,33 +73,154 @@ class Employee:
         self.gender = gender
         self.status = status
         self.created_at = created_at
+        self.profile_picture_url = profile_picture_url
+        self.updated_at = updated_at
+        self.department_name = department_name
+        self._loaded_groups = set()
+
+    def __getattr__(self, name):
+        # يُستدعى فقط عند غياب الخاصية: تحميل مجموعة الحقول الممتدة المطلوبة
+        group = Employee._LAZY_COLUMN_GROUP.get(name)
+        if group is None or '_loaded_groups' not in self.__dict__ or self.id is None:
+            raise AttributeError(name)
+        self.load(group)
+        return self.__dict__[name]
+
+    def load(self, *groups):
+        """تحميل مجموعات الحقول الممتدة التي لم تُحمّل بعد في استعلام واحد"""
+        pending = [group for group in groups if group not in self._loaded_groups]
+        if not pending:
+            return self
+        columns = [column for group in pending for column in self.LAZY_GROUPS[group]]
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(columns)} FROM Employees WHERE id = ?", (self.id,))
+        row = cursor.fetchone()
+        conn.close()
+
+        for column in columns:
+            setattr(self, column, getattr(row, column) if row else None)
+        self._loaded_groups.update(pending)
+        return self
+
+    @classmethod
+    def _resolve_include(cls, include):
+        if include == 'all':
+            return cls.EXTENDED_GROUPS
+        if isinstance(include, str):
+            include = (include,)
+        unknown = set(include) - set(cls.LAZY_GROUPS)
+        if unknown:
+            raise ValueError(f"مجموعات حقول غير معروفة: {', '.join(sorted(unknown))}")
+        return tuple(include)
     
     @classmethod
     def get_all(cls):
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT e.*, d.name as department_name 
+        cursor.execute(f'''
+            SELECT {cls.LIST_COLUMNS}
             FROM Employees e 
             LEFT JOIN Departments d ON e.department_id = d.id
-            ORDER BY e.created_at DESC
+            ORDER BY e.created_at DESC, e.id DESC
         ''')
         employees = cursor.fetchall()
         conn.close()
         return employees
+
+    @staticmethod
+    def encode_cursor(row):
+        """مؤشر الصفحة التالية من آخر صف: (created_at, id)"""
+        raw = f'{row.created_at.isoformat()}|{row.id}'
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor_token):
+        """فك المؤشر؛ يعيد None إذا كان غير صالح"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor_token.encode('ascii')).decode('utf-8')
+            created_at, row_id = raw.split('|')
+            return datetime.fromisoformat(created_at), int(row_id)
+        except (ValueError, UnicodeError):
+            return None
+
+    @classmethod
+    def get_page(cls, department_id=None, status=None, position=None, after=None, limit=None):
+        """
+        صفحة من الموظفين بترقيم keyset على (created_at, id) من الأحدث للأقدم.
+        يعيد (الصفوف، مؤشر الصفحة التالية أو None).
+        """
+        limit = max(1, min(limit or cls.PAGE_SIZE, cls.MAX_PAGE_SIZE))
+        conditions = []
+        params = [limit + 1]
+
+        if department_id:
+            conditions.append('e.department_id = ?')
+            params.append(department_id)
+        if status:
+            conditions.append('e.status = ?')
+            params.append(status)
+        if position:
+            # بحث ببداية النص حتى يبقى الاستعلام قادراً على استخدام الفهرس
+            escaped = position.replace('[', '[[]').replace('%', '[%]').replace('_', '[_]')
+            conditions.append('e.position LIKE ?')
+            params.append(escaped + '%')
+
+        position_key = cls.decode_cursor(after) if after else None
+        if position_key:
+            created_at, row_id = position_key
+            conditions.append('(e.created_at < ? OR (e.created_at = ? AND e.id < ?))')
+            params.extend([created_at, created_at, row_id])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT TOP (?) {cls.LIST_COLUMNS}
+            FROM Employees e 
+            LEFT JOIN Departments d ON e.department_id = d.id
+            {where}
+            ORDER BY e.created_at DESC, e.id DESC
+        ''', params)
+        rows = cursor.fetchall()
+        conn.close()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = cls.encode_cursor(rows[-1])
+        return rows, next_cursor
     
     @classmethod
-    def get_by_id(cls, employee_id):
+    def get_by_id(cls, employee_id, include=()):
+        """
+        include: أسماء مجموعات من LAZY_GROUPS، أو 'all' لكل المجموعات عدا documents.
+        include: أسماء مجموعات من LAZY_GROUPS (أو 'all') لتحميلها مع نفس الاستعلام.
+        """
+        groups = cls._resolve_include(include)
+        extra_columns = [column for group in groups for column in cls.LAZY_GROUPS[group]]
+        columns = ', '.join(f'e.{column}' for column in cls.CORE_COLUMNS + tuple(extra_columns))
+
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT e.*, d.name as department_name 
+        cursor.execute(f'''
+            SELECT {columns}, d.name as department_name 
             FROM Employees e 
             LEFT JOIN Departments d ON e.department_id = d.id 
             WHERE e.id = ?
         ''', (employee_id,))
-        employee = cursor.fetchone()
+        row = cursor.fetchone()
         conn.close()
+
+        if not row:
+            return None
+        employee = cls(**{column: getattr(row, column) for column in cls.CORE_COLUMNS},
+                       department_name=row.department_name)
+        for column in extra_columns:
+            setattr(employee, column, getattr(row, column))
+        employee._loaded_groups.update(groups)
         return employee
     
     def save(self):
@@ -70,10 +232,16 @@ class Employee:
                 SET first_name=?, last_name=?, email=?, phone=?, address=?, 
                     department_id=?, position=?, salary=?, hire_date=?, 
                     birth_date=?, gender=?, status=?, updated_at=GETDATE()
+                OUTPUT deleted.department_id, deleted.status
                 WHERE id=?
             ''', (self.first_name, self.last_name, self.email, self.phone, self.address,
                 self.department_id, self.position, self.salary, self.hire_date,
                 self.birth_date, self.gender, self.status, self.id))
+            previous = cursor.fetchone()
+            if previous:
+                department_counts.employee_changed(cursor, previous.department_id, previous.status,
+                                                   self.department_id, self.status)
+                attendance_rollup.employees_moved(cursor, [(self.id, previous.department_id, self.department_id)])
         else:
             cursor.execute('''
                 INSERT INTO Employees 
@@ -83,6 +251,7 @@ class Employee:
             ''', (self.employee_id, self.first_name, self.last_name, self.email, self.phone,
                 self.address, self.department_id, self.position, self.salary, self.hire_date,
                 self.birth_date, self.gender, self.status or 'active'))  # القيمة الافتراضية
+            department_counts.employee_added(cursor, self.department_id, self.status or 'active')
         conn.commit()
         conn.close()
     
@@ -90,7 +259,15 @@ class Employee:
     def delete(cls, employee_id):
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM Employees WHERE id=?', (employee_id,))
+        attendance_rollup.employees_removed(cursor, [employee_id])
+        cursor.execute('''
+            DELETE FROM Employees
+            OUTPUT deleted.department_id, deleted.status
+            WHERE id=?
+        ''', (employee_id,))
+        deleted = cursor.fetchone()
+        if deleted:
+            department_counts.employee_removed(cursor, deleted.department_id, deleted.status)
         conn.commit()
         conn.close()
 
@@ -99,11 +276,10 @@ class Department:
     def get_all(cls):
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT d.*, COUNT(e.id) as employee_count
+        cursor.execute(f'''
+            SELECT d.*, ISNULL(hc.employee_count, 0) as employee_count
             FROM Departments d 
-            LEFT JOIN Employees e ON d.id = e.department_id
-            GROUP BY d.id, d.name, d.description, d.manager_id, d.created_at
+            LEFT JOIN ({HEADCOUNTS_SUBQUERY}) hc ON d.id = hc.department_id
         ''')
         departments = cursor.fetchall()
         conn.close()
@@ -119,28 +295,17 @@ class Department:
         if not year:
             year = datetime.now().year
         
-        # عدد أيام العمل في الشهر (استبعاد الجمعة والسبت)
-        cursor.execute('''
-            SELECT COUNT(*) 
-            FROM (
-                SELECT DATEADD(day, number, DATEFROMPARTS(?, ?, 1)) as work_date
-                FROM master..spt_values 
-                WHERE type = 'P' 
-                AND number < DAY(EOMONTH(DATEFROMPARTS(?, ?, 1)))
-            ) dates
-            WHERE DATEPART(weekday, work_date) NOT IN (1, 7)  -- استبعاد الجمعة (7) والسبت (1)
-        ''', (year, month, year, month))
-        
-        working_days = cursor.fetchone()[0] or 22  # افتراضي 22 يوم عمل
+        # عدد أيام العمل في الشهر من تقويم العمل (العطلة الأسبوعية والإجازات الرسمية)
+        working_days = work_calendar.working_days(year, month) or 22  # افتراضي 22 يوم عمل
         
         # عدد سجلات الحضور الفعلية
-        cursor.execute('''
+        month_start, month_end = month_range(year, month)
+        cursor.execute(f'''
             SELECT COUNT(DISTINCT employee_id) 
-            FROM Attendance 
-            WHERE MONTH(attendance_date) = ? 
-            AND YEAR(attendance_date) = ? 
+            FROM {attendance_table(month_start)} 
+            WHERE attendance_date >= ? AND attendance_date < ?
             AND status IN ('present', 'late')
-        ''', (month, year))
+        ''', (month_start, month_end))
         
         actual_attendance = cursor.fetchone()[0] or 0
         
@@ -0,0 +1,264 @@
+import json
+import threading
+import time
+
+from db_pool import get_db_connection
+
+MAX_PAGE_SIZE = 500
+# invalidate يصل للعامل الذي عدّل الأقسام فقط، فالعمال الآخرون يعيدون البناء دورياً
+CACHE_TTL = 300
+
+
+class OrgHierarchy:
+    """
+    الهيكل التنظيمي المبني من Departments.manager_id.
+    القسم الأب لأي قسم هو قسم مديره، وكل قسم يُرقّم بترتيب pre-order
+    بحيث تكون أقسامه الفرعية كلها في الفترة [left, right] (nested intervals):
+    الشجرة الفرعية شريحة واحدة من القائمة، واختبار "هل يتبع" مقارنتان فقط.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._departments = {}   # id -> بيانات القسم ومديره
+        self._parent = {}        # id -> القسم الأب أو None
+        self._managed = {}       # id المدير -> [الأقسام التي يديرها]
+        self._intervals = {}     # id -> (left, right)
+        self._order = []         # الأقسام بترتيب pre-order (الموضع = left)
+        self._depth = {}
+        self._loaded_at = None
+        self._generation = 0     # يزداد مع كل invalidate حتى لا تُعتمد شجرة قُرئت قبله
+
+    # ---------- البناء ----------
+
+    @staticmethod
+    def _fetch():
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT d.id, d.name, d.manager_id,
+                   m.first_name + ' ' + m.last_name as manager_name,
+                   m.department_id as manager_department_id
+            FROM Departments d
+            LEFT JOIN Employees m ON d.manager_id = m.id
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def rebuild(self):
+        """إعادة بناء الشجرة والترقيم بالكامل (عدد الأقسام صغير مقارنة بالموظفين)"""
+        generation = self._generation
+        departments = {}
+        parent = {}
+        managed = {}
+        for row in self._fetch():
+            departments[row.id] = {
+                'id': row.id,
+                'name': row.name,
+                'manager_id': row.manager_id,
+                'manager_name': row.manager_name,
+            }
+            # المدير الذي يتبع نفس القسم (أو بدون قسم) يجعل القسم جذراً
+            parent[row.id] = row.manager_department_id if row.manager_department_id != row.id else None
+            if row.manager_id:
+                managed.setdefault(row.manager_id, []).append(row.id)
+
+        children = {department_id: [] for department_id in departments}
+        roots = []
+        for department_id in sorted(departments):
+            parent_id = parent[department_id]
+            if parent_id in children:
+                children[parent_id].append(department_id)
+            else:
+                parent[department_id] = None
+                roots.append(department_id)
+
+        intervals = {}
+        order = []
+        depth = {}
+
+        def number(root):
+            # DFS تكراري؛ الأقسام التي زُرت من قبل تُتجاهل فلا تسبب الدورات حلقة لا نهائية
+            stack = [(root, 0, False)]
+            while stack:
+                department_id, level, leaving = stack.pop()
+                if leaving:
+                    intervals[department_id] = (intervals[department_id][0], len(order) - 1)
+                    continue
+                if department_id in intervals:
+                    continue
+                intervals[department_id] = (len(order), None)
+                depth[department_id] = level
+                order.append(department_id)
+                stack.append((department_id, level, True))
+                for child in reversed(children[department_id]):
+                    if child not in intervals:
+                        stack.append((child, level + 1, False))
+
+        for root in roots:
+            number(root)
+        # أقسام في دورة (مدير قسم A في قسم B ومدير B في A): تُكسر الدورة عند أصغر id
+        for department_id in sorted(departments):
+            if department_id not in intervals:
+                parent[department_id] = None
+                number(department_id)
+        for department_id in departments:
+            left = intervals[department_id][0]
+            if parent[department_id] is not None and not self._contains(intervals, parent[department_id], left):
+                parent[department_id] = None
+
+        with self._lock:
+            self._departments = departments
+            self._parent = parent
+            self._managed = managed
+            self._intervals = intervals
+            self._order = order
+            self._depth = depth
+            # invalidate أثناء القراءة: الشجرة قد تسبق التعديل فتُبنى مجدداً عند الاستخدام التالي
+            self._loaded_at = time.monotonic() if self._generation == generation else None
+
+    def _stale(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > CACHE_TTL
+
+    def ensure_loaded(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self.rebuild()
+
+    def invalidate(self):
+        """إعادة البناء عند الاستخدام التالي (تغيير مدير قسم أو نقل مدير لقسم آخر)"""
+        with self._lock:
+            self._loaded_at = None
+            self._generation += 1
+
+    def is_manager(self, employee_id):
+        return employee_id in self._managed
+
+    # ---------- الاستعلام ----------
+
+    @staticmethod
+    def _contains(intervals, ancestor_id, left):
+        ancestor_left, ancestor_right = intervals[ancestor_id]
+        return ancestor_left <= left <= ancestor_right
+
+    def _node(self, department_id):
+        return dict(self._departments[department_id],
+                    parent_id=self._parent[department_id],
+                    depth=self._depth[department_id])
+
+    def has_department(self, department_id):
+        self.ensure_loaded()
+        return department_id in self._departments
+
+    def subtree(self, department_id):
+        """القسم وكل الأقسام التابعة له بترتيب الشجرة"""
+        self.ensure_loaded()
+        with self._lock:
+            if department_id not in self._intervals:
+                return []
+            left, right = self._intervals[department_id]
+            return [self._node(descendant_id) for descendant_id in self._order[left:right + 1]]
+
+    def ancestors(self, department_id):
+        """سلسلة الأقسام الأعلى من القسم المباشر حتى الجذر"""
+        self.ensure_loaded()
+        with self._lock:
+            chain = []
+            parent_id = self._parent.get(department_id)
+            while parent_id is not None:
+                chain.append(self._node(parent_id))
+                parent_id = self._parent[parent_id]
+            return chain
+
+    def is_descendant(self, department_id, ancestor_id):
+        """هل القسم department_id ضمن شجرة ancestor_id (أو هو نفسه)"""
+        self.ensure_loaded()
+        with self._lock:
+            if department_id not in self._intervals or ancestor_id not in self._intervals:
+                return False
+            return self._contains(self._intervals, ancestor_id, self._intervals[department_id][0])
+
+    def scope(self, manager_id):
+        """كل الأقسام التي تقع تحت مسؤولية المدير (مباشرة أو عبر الأقسام التابعة)"""
+        self.ensure_loaded()
+        with self._lock:
+            department_ids = []
+            seen = set()
+            for department_id in self._managed.get(manager_id, ()):
+                left, right = self._intervals[department_id]
+                for descendant_id in self._order[left:right + 1]:
+                    if descendant_id not in seen:
+                        seen.add(descendant_id)
+                        department_ids.append(descendant_id)
+            return department_ids
+
+    def in_scope(self, manager_id, department_id):
+        """صلاحيات المدير: هل القسم ضمن نطاقه"""
+        self.ensure_loaded()
+        with self._lock:
+            if department_id not in self._intervals:
+                return False
+            left = self._intervals[department_id][0]
+            return any(self._contains(self._intervals, managed_id, left)
+                       for managed_id in self._managed.get(manager_id, ()))
+
+    def reporting_chain(self, employee_id, department_id):
+        """سلسلة المديرين فوق الموظف: مدير قسمه ثم مدير القسم الأعلى وهكذا"""
+        self.ensure_loaded()
+        with self._lock:
+            chain = []
+            seen = {employee_id}
+            current = department_id if department_id in self._departments else None
+            while current is not None:
+                department = self._departments[current]
+                manager_id = department['manager_id']
+                if manager_id and manager_id not in seen:
+                    seen.add(manager_id)
+                    chain.append({
+                        'employee_id': manager_id,
+                        'name': department['manager_name'],
+                        'department_id': current,
+                        'department': department['name'],
+                    })
+                current = self._parent[current]
+            return chain
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._loaded_at is not None,
+                'departments': len(self._departments),
+                'managers': len(self._managed),
+                'roots': sum(1 for parent_id in self._parent.values() if parent_id is None),
+                'max_depth': max(self._depth.values(), default=0),
+            }
+
+
+def employees_under(conn, department_ids, exclude_id=None, after=None, limit=100):
+    """
+    موظفو مجموعة أقسام بترقيم keyset على id.
+    يعيد (الصفوف، المؤشر التالي).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if not department_ids:
+        return [], None
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT TOP (?) e.id, e.employee_id, e.first_name + ' ' + e.last_name as name,
+               e.position, e.status, e.department_id, d.name as department_name
+        FROM Employees e
+        LEFT JOIN Departments d ON e.department_id = d.id
+        WHERE e.department_id IN (SELECT value FROM OPENJSON(?))
+          AND e.id > ? AND e.id <> ?
+        ORDER BY e.id
+    ''', (limit + 1, json.dumps(department_ids), after or 0, exclude_id or 0))
+    rows = cursor.fetchall()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+org_hierarchy = OrgHierarchy()
@@ -0,0 +1,299 @@
+import threading
+import time
+from datetime import date, datetime
+
+from db_pool import get_db_connection
+
+PRESENT_STATUSES = ('present', 'late')
+MAX_TRACKED_DAYS = 7
+
+
+def _set_bits(bits):
+    """مواضع البتات المرفوعة (من الأصغر للأكبر)"""
+    text = bin(bits)[:1:-1]
+    positions = []
+    position = text.find('1')
+    while position != -1:
+        positions.append(position)
+        position = text.find('1', position + 1)
+    return positions
+
+
+class PresenceIndex:
+    """
+    حضور اليوم كـ bitmaps داخل الذاكرة.
+    كل موظف يأخذ رقماً متتالياً (ordinal) هو موضع البت الخاص به، ولكل يوم متابَع
+    bitmap لمن لديه سجل حضور وآخر لمن حضر فعلاً (present/late)، فالغائبون هم
+    active & ~recorded والأعداد تأتي من عد البتات بدلاً من NOT IN على جدول الحضور.
+    قاعدة البيانات هي مصدر إعادة البناء عند التشغيل ودورياً (العمال الآخرون يكتبون أيضاً).
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._ordinals = {}       # id الموظف -> رقمه المتتالي
+        self._employees = []      # الرقم المتتالي -> بيانات العرض (None إذا تحرر)
+        self._free = []           # أرقام محررة لإعادة الاستخدام
+        self._active = 0          # bitmap الموظفين النشطين
+        self._days = {}           # التاريخ -> [recorded, present]
+        self._loaded_at = None
+        self._rebuilding = False
+        self._recorders = []      # تعديلات تراكمت أثناء كل إعادة بناء جارية
+
+    # ---------- التحميل ----------
+
+    @staticmethod
+    def _fetch_employees(employee_id=None):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        try:
+            cursor = conn.cursor()
+            query = '''
+                SELECT e.id, e.employee_id, e.first_name, e.last_name, e.position, e.status,
+                       e.department_id, d.name as department_name
+                FROM Employees e
+                LEFT JOIN Departments d ON e.department_id = d.id
+            '''
+            if employee_id is None:
+                cursor.execute(query + ' ORDER BY e.first_name, e.last_name')
+            else:
+                cursor.execute(query + ' WHERE e.id = ?', (employee_id,))
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _fetch_day(day):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT employee_id, status FROM Attendance WHERE attendance_date = ?', (day,))
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _employee(row):
+        return {
+            'id': row.id,
+            'employee_id': row.employee_id,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'position': row.position,
+            'department_id': row.department_id,
+            'department_name': row.department_name,
+        }
+
+    def _day_bits(self, ordinals, rows):
+        recorded = present = 0
+        for row in rows:
+            ordinal = ordinals.get(row.employee_id)
+            if ordinal is None:
+                continue
+            recorded |= 1 << ordinal
+            if row.status in PRESENT_STATUSES:
+                present |= 1 << ordinal
+        return [recorded, present]
+
+    def rebuild(self):
+        """
+        إعادة بناء الأرقام المتتالية وحضور اليوم من قاعدة البيانات.
+        الحضور وتعديلات الموظفين التي تصل أثناء القراءة تُسجل وتُعاد على النسخة الجديدة
+        قبل اعتمادها، وإلا ظهر حاضرو اليوم غائبين حتى إعادة البناء التالية.
+        """
+        changes = []
+        with self._lock:
+            self._recorders.append(changes)
+        try:
+            ordinals = {}
+            employees = []
+            active = 0
+            for ordinal, row in enumerate(self._fetch_employees()):
+                ordinals[row.id] = ordinal
+                employees.append(self._employee(row))
+                if row.status == 'active':
+                    active |= 1 << ordinal
+            today = date.today()
+            days = {today: self._day_bits(ordinals, self._fetch_day(today))}
+
+            with self._lock:
+                self._ordinals = ordinals
+                self._employees = employees
+                self._free = []
+                self._active = active
+                self._days = days
+                for change in changes:
+                    self._apply_locked(*change)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._recorders.remove(changes)
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"❌ تعذر تحديث فهرس الحضور اليومي: {e}")
+        finally:
+            self._rebuilding = False
+
+    def ensure_fresh(self):
+        """تحميل الفهرس عند أول استخدام، وتحديثه في الخلفية إذا أصبح قديماً"""
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self.rebuild()
+            return
+        if time.monotonic() - self._loaded_at > self.max_age and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _day(self, day):
+        """bitmaps اليوم (تُحمل من قاعدة البيانات عند أول طلب)"""
+        bits = self._days.get(day)
+        if bits is not None:
+            return bits
+        rows = self._fetch_day(day)
+        with self._lock:
+            bits = self._days.get(day)
+            if bits is None:
+                bits = self._day_bits(self._ordinals, rows)
+                if len(self._days) >= MAX_TRACKED_DAYS:
+                    del self._days[min(self._days)]
+                self._days[day] = bits
+            return bits
+
+    # ---------- التحديث التدريجي ----------
+
+    def _clear_locked(self, ordinal):
+        mask = ~(1 << ordinal)
+        self._active &= mask
+        for bits in self._days.values():
+            bits[0] &= mask
+            bits[1] &= mask
+
+    def _upsert_locked(self, row):
+        ordinal = self._ordinals.get(row.id)
+        if ordinal is None:
+            ordinal = self._free.pop() if self._free else len(self._employees)
+            if ordinal == len(self._employees):
+                self._employees.append(None)
+            self._ordinals[row.id] = ordinal
+        self._employees[ordinal] = self._employee(row)
+        if row.status == 'active':
+            self._active |= 1 << ordinal
+        else:
+            self._active &= ~(1 << ordinal)
+
+    def _remove_locked(self, employee_id):
+        ordinal = self._ordinals.pop(employee_id, None)
+        if ordinal is None:
+            return
+        self._clear_locked(ordinal)
+        self._employees[ordinal] = None
+        self._free.append(ordinal)
+
+    def _record_locked(self, employee_id, attendance_date, status):
+        bits = self._days.get(attendance_date)
+        ordinal = self._ordinals.get(employee_id)
+        if bits is None or ordinal is None:
+            return
+        bit = 1 << ordinal
+        if status is None:
+            bits[0] &= ~bit
+        else:
+            bits[0] |= bit
+        bits[1] = bits[1] | bit if status in PRESENT_STATUSES else bits[1] & ~bit
+
+    def _apply_locked(self, kind, *args):
+        {'employee': self._upsert_locked, 'remove': self._remove_locked,
+         'record': self._record_locked}[kind](*args)
+
+    def _change(self, kind, *args):
+        """تطبيق تعديل تدريجي وتسجيله لأي إعادة بناء جارية"""
+        with self._lock:
+            self._apply_locked(kind, *args)
+            for changes in self._recorders:
+                changes.append((kind,) + args)
+
+    def refresh_employee(self, employee_id):
+        """إضافة/تحديث موظف بعد الحفظ"""
+        if self._loaded_at is None and not self._recorders:
+            return
+        rows = self._fetch_employees(employee_id)
+        if not rows:
+            self.remove(employee_id)
+            return
+        self._change('employee', rows[0])
+
+    def remove(self, employee_id):
+        self._change('remove', employee_id)
+
+    def record(self, changes):
+        """
+        changes = [(الموظف، تاريخ الحضور، الحالة)] بعد commit.
+        الأيام غير المتابَعة تُتجاهل لأنها ستُقرأ من قاعدة البيانات عند طلبها.
+        """
+        if self._loaded_at is None and not self._recorders:
+            return
+        for employee_id, attendance_date, status in changes:
+            if isinstance(attendance_date, str):
+                attendance_date = datetime.strptime(attendance_date[:10], '%Y-%m-%d').date()
+            if employee_id not in self._ordinals:
+                self.refresh_employee(employee_id)
+            self._change('record', employee_id, attendance_date, status)
+
+    def invalidate(self):
+        """إجبار إعادة البناء عند الطلب التالي (بعد عمليات جماعية)"""
+        with self._lock:
+            self._loaded_at = None
+
+    # ---------- الاستعلام ----------
+
+    def counts(self, day=None):
+        """عدد النشطين والحاضرين ومن لديه سجل والغائبين (بدون سجل) في اليوم"""
+        self.ensure_fresh()
+        recorded, present = self._day(day or date.today())
+        with self._lock:
+            active = self._active
+        return {
+            'active': bin(active).count('1'),
+            'present': bin(present).count('1'),
+            'recorded': bin(recorded).count('1'),
+            'absent': bin(active & ~recorded).count('1'),
+        }
+
+    def _employees_at(self, bits):
+        with self._lock:
+            employees = [self._employees[ordinal] for ordinal in _set_bits(bits)]
+        employees = [employee for employee in employees if employee is not None]
+        employees.sort(key=lambda employee: (employee['first_name'] or '', employee['last_name'] or ''))
+        return employees
+
+    def absent(self, day=None):
+        """الموظفون النشطون بدون أي سجل حضور في اليوم (مرتبين بالاسم)"""
+        self.ensure_fresh()
+        recorded = self._day(day or date.today())[0]
+        return self._employees_at(self._active & ~recorded)
+
+    def present(self, day=None):
+        """الموظفون الحاضرون (present/late) في اليوم"""
+        self.ensure_fresh()
+        return self._employees_at(self._day(day or date.today())[1])
+
+    def employee(self, employee_id):
+        """بيانات العرض لموظف واحد (None إذا لم يكن في الفهرس)"""
+        with self._lock:
+            ordinal = self._ordinals.get(employee_id)
+            return self._employees[ordinal] if ordinal is not None else None
+
+    def active(self):
+        """كل الموظفين النشطين (مرتبين بالاسم)"""
+        self.ensure_fresh()
+        return self._employees_at(self._active)
+
+
+presence_index = PresenceIndex()
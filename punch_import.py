@@ -0,0 +1,395 @@
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+import attendance_events
+import attendance_rollup
+from attendance_archive import hot_start
+from presence_index import presence_index
+from shift_rules import day_boundary, shift_rules
+from db_pool import get_db_connection
+
+# أسماء الأعمدة المقبولة في ملفات CSV من أجهزة البصمة
+DEVICE_ID_COLUMNS = ('device_id', 'user_id', 'badge', 'enroll_number', 'ac-no', 'ac_no', 'no')
+TIMESTAMP_COLUMNS = ('timestamp', 'datetime', 'punch_time', 'time')
+DATE_COLUMNS = ('date',)
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M',
+                     '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%Y-%m-%dT%H:%M:%S')
+
+# تخطيط الملفات ثابتة العرض: الحقل -> (البداية، النهاية)
+FIXED_WIDTH_LAYOUT = {'device_id': (0, 9), 'timestamp': (10, 29)}
+
+# البصمات المتقاربة (تكرار الضغط على الجهاز) لا تُحسب انصرافاً
+MIN_SHIFT = timedelta(minutes=2)
+# الأيام المفتوحة تُرسل لقاعدة البيانات بعد أن يتجاوزها الملف بهذا القدر
+FLUSH_LAG = timedelta(days=1)
+MAX_REPORTED_ERRORS = 1000
+MAX_REPORTED_UNKNOWN = 100
+
+def _since_boundary(value):
+    """ثوانٍ من حد يوم الدوام (s.boundary) حتى value، فتصح المقارنة في الدوام الليلي بعد منتصف الليل"""
+    return f"((DATEDIFF(second, CAST('00:00' AS TIME(0)), {value}) - s.boundary + 86400) % 86400)"
+
+
+_NEW_IN = _since_boundary('s.check_in')
+_OLD_IN = _since_boundary('t.check_in')
+_LAST = _since_boundary('s.last_punch')
+_FIRST = f'(CASE WHEN {_NEW_IN} < {_OLD_IN} THEN {_NEW_IN} ELSE {_OLD_IN} END)'
+_EARLIER_IN = f'{_NEW_IN} < {_OLD_IN}'
+
+# أول دخول وآخر خروج لكل موظف في يوم دوامه؛ عند وجود سجل مسبق (من الجهاز أو يدوياً)
+# يُحتفظ بالأبكر للحضور والأحدث للانصراف حتى تكون إعادة استيراد نفس الملف آمنة.
+# last_punch هي آخر بصمة حتى لو كانت وحدها (بصمة متأخرة ليوم كُتب في دفعة سابقة):
+# تُعتمد انصرافاً إذا بعدت عن الحضور المعتمد بمقدار MIN_SHIFT.
+# الأوقات تُقارن بعد حد يوم الدوام (boundary) لأن انصراف الدوام الليلي أصغر من حضوره.
+# الحالة مصنفة مسبقاً من قواعد الدوام وتتبع وقت الحضور المعتمد (الإجازات لا تتغير)
+UPSERT_SQL = f'''
+    SET NOCOUNT ON;
+    MERGE Attendance WITH (HOLDLOCK) AS t
+    USING (
+        SELECT employee_id, attendance_date, check_in, check_out, status, last_punch, boundary
+        FROM OPENJSON(?) WITH (
+            employee_id INT '$[0]',
+            attendance_date DATE '$[1]',
+            check_in TIME(0) '$[2]',
+            check_out TIME(0) '$[3]',
+            status NVARCHAR(20) '$[4]',
+            last_punch TIME(0) '$[5]',
+            boundary INT '$[6]'
+        )
+    ) AS s
+    ON t.employee_id = s.employee_id AND t.attendance_date = s.attendance_date
+    WHEN MATCHED AND (t.check_in IS NULL OR {_EARLIER_IN}
+                      OR ({_LAST} > {_since_boundary('ISNULL(t.check_out, t.check_in)')}
+                          AND {_LAST} - {_FIRST} >= {int(MIN_SHIFT.total_seconds())})) THEN
+        UPDATE SET
+            check_in = CASE WHEN t.check_in IS NULL OR {_EARLIER_IN} THEN s.check_in ELSE t.check_in END,
+            status = CASE WHEN (t.check_in IS NULL OR {_EARLIER_IN})
+                               AND t.status IN ('present', 'late', 'absent')
+                          THEN s.status ELSE t.status END,
+            check_out = CASE
+                WHEN t.check_in IS NULL THEN ISNULL(s.check_out, t.check_out)
+                WHEN (t.check_out IS NULL OR {_LAST} > {_since_boundary('t.check_out')})
+                     AND {_LAST} - {_FIRST} >= {int(MIN_SHIFT.total_seconds())}
+                THEN s.last_punch ELSE t.check_out END,
+            updated_at = GETDATE()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (employee_id, attendance_date, check_in, check_out, status, notes)
+        VALUES (s.employee_id, s.attendance_date, s.check_in, s.check_out, s.status, N'جهاز البصمة')
+    OUTPUT $action, inserted.employee_id, inserted.attendance_date,
+           deleted.status AS previous_status, inserted.status, inserted.check_in, inserted.check_out;
+'''
+
+
+class PunchLogError(ValueError):
+    """ملف سجل البصمات غير صالح"""
+
+
+# ==================== مراحل المعالجة (generators) ====================
+
+def iter_lines(stream, encoding='utf-8-sig'):
+    """قراءة الملف سطراً سطراً (نص أو bytes) دون تحميله في الذاكرة"""
+    if isinstance(stream, io.TextIOBase):
+        yield from stream
+    else:
+        yield from io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+
+
+def parse_timestamp(value):
+    value = value.strip()
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, timestamp_format)
+        except ValueError:
+            continue
+    raise ValueError(f'صيغة وقت غير معروفة: {value}')
+
+
+def _pick(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def parse_csv(lines):
+    """سطور CSV -> (رقم السطر، رقم الجهاز، الوقت) أو (رقم السطر، None، رسالة الخطأ)"""
+    lines = iter(lines)
+    first = next(lines, '')
+    delimiter = max(',;\t|', key=first.count)
+    header = [column.strip().lower() for column in next(csv.reader([first], delimiter=delimiter), [])]
+    device_column = _pick(header, DEVICE_ID_COLUMNS)
+    timestamp_column = _pick(header, TIMESTAMP_COLUMNS)
+    date_column = _pick(header, DATE_COLUMNS)
+    if device_column is None or timestamp_column is None:
+        raise PunchLogError('يجب أن يحتوي الملف على عمودي رقم الجهاز والوقت')
+
+    for line_number, fields in enumerate(csv.reader(lines, delimiter=delimiter), start=2):
+        if not fields or not any(field.strip() for field in fields):
+            continue
+        try:
+            value = fields[timestamp_column]
+            if date_column is not None and date_column != timestamp_column:
+                value = f'{fields[date_column]} {value}'
+            yield line_number, fields[device_column].strip(), parse_timestamp(value)
+        except (IndexError, ValueError) as e:
+            yield line_number, None, str(e) if isinstance(e, ValueError) else 'عدد الأعمدة غير صحيح'
+
+
+def parse_fixed_width(lines, layout=None):
+    """سطور ثابتة العرض -> نفس مخرجات parse_csv"""
+    layout = layout or FIXED_WIDTH_LAYOUT
+    device_start, device_end = layout['device_id']
+    timestamp_start, timestamp_end = layout['timestamp']
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            device_id = line[device_start:device_end].strip()
+            if not device_id:
+                raise ValueError('رقم الجهاز فارغ')
+            yield line_number, device_id, parse_timestamp(line[timestamp_start:timestamp_end])
+        except ValueError as e:
+            yield line_number, None, str(e)
+
+
+def map_employees(punches, lookup, report):
+    """(رقم الجهاز، الوقت) -> (id الموظف، الوقت) مع تسجيل الأسطر غير الصالحة والأرقام غير المعروفة"""
+    for line_number, device_id, value in punches:
+        report.lines += 1
+        if device_id is None:
+            report.add_error(line_number, value)
+            continue
+        employee_id = lookup.get(device_id) or lookup.get(device_id.lstrip('0'))
+        if employee_id is None:
+            report.add_unknown(device_id)
+            continue
+        report.punches += 1
+        yield employee_id, value
+
+
+def pair_punches(punches, shift_day=None):
+    """
+    تجميع البصمات إلى (الموظف، اليوم، أول دخول، آخر خروج).
+    shift_day(الموظف، الوقت) يحدد يوم الدوام (shift_rules.shift_day للدوام الليلي)،
+    وبدونه يُستخدم تاريخ البصمة.
+    الأيام تُخرج بمجرد أن يتجاوزها الملف بمقدار FLUSH_LAG، فالذاكرة تتناسب مع عدد
+    الموظفين في الأيام المفتوحة فقط وليس مع حجم الملف. البصمات المتأخرة عن يوم خرج
+    تُخرج مرة أخرى: merge_days يدمجها داخل الدفعة وMERGE مع السجل المكتوب سابقاً.
+    """
+    open_days = {}  # (الموظف، اليوم) -> [أول، آخر]
+    cutoff = None
+    for employee_id, moment in punches:
+        key = (employee_id, shift_day(employee_id, moment) if shift_day else moment.date())
+        times = open_days.get(key)
+        if times is None:
+            open_days[key] = [moment, moment]
+        elif moment < times[0]:
+            times[0] = moment
+        elif moment > times[1]:
+            times[1] = moment
+
+        # يُفحص فقط عند انتقال الملف ليوم جديد
+        moment_cutoff = (moment - FLUSH_LAG).date()
+        if cutoff is None or moment_cutoff > cutoff:
+            cutoff = moment_cutoff
+            for closed_key in [open_key for open_key in open_days if open_key[1] < cutoff]:
+                first, last = open_days.pop(closed_key)
+                yield closed_key[0], closed_key[1], first, last
+    for (employee_id, day), (first, last) in open_days.items():
+        yield employee_id, day, first, last
+
+
+def merge_days(chunk):
+    """
+    دمج تكرارات (الموظف، اليوم) داخل الدفعة: بصمة متأخرة ليوم خرج من pair_punches
+    تعيد فتحه فيُخرج مرة ثانية، وMERGE لا يقبل نفس الصف مرتين في المصدر.
+    """
+    days = {}
+    for employee_id, day, first, last in chunk:
+        times = days.get((employee_id, day))
+        if times is None:
+            days[(employee_id, day)] = [first, last]
+        else:
+            times[0] = min(times[0], first)
+            times[1] = max(times[1], last)
+    return [(employee_id, day, first, last) for (employee_id, day), (first, last) in days.items()]
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ==================== الاستيراد ====================
+
+class PunchImportReport:
+    def __init__(self):
+        self.lines = 0
+        self.punches = 0
+        self.days = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.archived = 0
+        self.errors = []
+        self.unknown_devices = {}
+        self.started = time.perf_counter()
+
+    def add_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line_number, 'errors': [message]})
+
+    def add_unknown(self, device_id):
+        if device_id in self.unknown_devices or len(self.unknown_devices) < MAX_REPORTED_UNKNOWN:
+            self.unknown_devices[device_id] = self.unknown_devices.get(device_id, 0) + 1
+
+    def as_dict(self, dry_run):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'lines': self.lines,
+            'punches': self.punches,
+            'days': self.days,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'archived': self.archived,
+            'dry_run': dry_run,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'unknown_devices': self.unknown_devices,
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(self.lines / elapsed, 1) if elapsed > 0 else self.lines,
+        }
+
+
+def load_device_lookup(conn, mapping=None):
+    """
+    رقم الجهاز -> Employees.id في الذاكرة.
+    يُقبل رقم الموظف (EMP007) أو جزؤه الرقمي (7) أو الرقم القومي،
+    وmapping الاختياري {رقم الجهاز: رقم الموظف} يتقدم على ذلك.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, employee_id, national_number FROM Employees')
+    lookup = {}
+    by_code = {}
+    for row in cursor.fetchall():
+        if row.national_number:
+            lookup[row.national_number.strip()] = row.id
+        if row.employee_id:
+            code = row.employee_id.strip()
+            by_code[code] = row.id
+            lookup[code] = row.id
+            digits = re.sub(r'\D', '', code).lstrip('0')
+            if digits:
+                lookup[digits] = row.id
+    for device_id, employee_code in (mapping or {}).items():
+        employee_id = by_code.get(str(employee_code).strip())
+        if employee_id is None and str(employee_code).isdigit():
+            employee_id = int(employee_code)
+        if employee_id is not None:
+            lookup[str(device_id).strip()] = employee_id
+    return lookup
+
+
+def detect_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return 'csv' if extension == 'csv' else 'fixed'
+
+
+def import_punches(stream, filename, chunk_size=2000, dry_run=False, mapping=None, layout=None,
+                   log_format=None):
+    """استيراد سجل بصمات (CSV أو ثابت العرض) بذاكرة ثابتة وإرجاع تقرير بالنتائج"""
+    log_format = log_format or detect_format(filename)
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    report = PunchImportReport()
+    try:
+        lookup = load_device_lookup(conn, mapping)
+        lines = iter_lines(stream)
+        punches = parse_csv(lines) if log_format == 'csv' else parse_fixed_width(lines, layout)
+        presence_index.ensure_fresh()  # قسم الموظف لتحديد يوم الدوام وتصنيف الحضور حسب دوامه
+        days = pair_punches(map_employees(punches, lookup, report), shift_rules.shift_day)
+
+        # أيام السنوات المؤرشفة لا تُكتب في الجدول الساخن (ستتكرر مع صفوف الأرشيف)
+        first_open_day = hot_start()
+
+        cursor = conn.cursor()
+        for chunk in chunked(days, chunk_size):
+            chunk = merge_days(chunk)
+            report.days += len(chunk)
+            open_days = [item for item in chunk if item[1] >= first_open_day]
+            report.archived += len(chunk) - len(open_days)
+            chunk = open_days
+            if dry_run or not chunk:
+                continue
+            payload = [[employee_id, day.isoformat(), first.strftime('%H:%M:%S'),
+                        last.strftime('%H:%M:%S') if last - first >= MIN_SHIFT else None,
+                        shift_rules.check_in_status(employee_id, first), last.strftime('%H:%M:%S'),
+                        day_boundary(*shift_rules.employee_shift(employee_id)[:2])]
+                       for employee_id, day, first, last in chunk]
+            try:
+                cursor.execute(UPSERT_SQL, (json.dumps(payload),))
+                rows = cursor.fetchall()
+                attendance_rollup.record_changes(cursor, [
+                    (row.employee_id, row.attendance_date, row.previous_status, row.status) for row in rows])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            try:
+                presence_index.record([(row.employee_id, row.attendance_date, row.status) for row in rows])
+            except Exception as e:
+                print(f"❌ تعذر تحديث فهرس الحضور اليومي: {e}")
+            attendance_events.notify_committed(rows)
+            actions = [row[0] for row in rows]
+            report.inserted += actions.count('INSERT')
+            report.updated += actions.count('UPDATE')
+    finally:
+        conn.close()
+    return report.as_dict(dry_run)
+
+
+def load_mapping(stream):
+    """ملف CSV بعمودين: رقم الجهاز، رقم الموظف"""
+    return {row[0].strip(): row[1].strip() for row in csv.reader(iter_lines(stream)) if len(row) >= 2}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='استيراد سجلات أجهزة البصمة إلى جدول الحضور')
+    parser.add_argument('path', help='مسار ملف السجل')
+    parser.add_argument('--format', choices=('csv', 'fixed'), help='صيغة الملف (افتراضياً حسب الامتداد)')
+    parser.add_argument('--map', help='ملف CSV لربط رقم الجهاز برقم الموظف')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='عدد الأيام في كل عملية MERGE')
+    parser.add_argument('--dry-run', action='store_true', help='التحقق فقط بدون إدخال')
+    args = parser.parse_args()
+
+    mapping = None
+    if args.map:
+        with open(args.map, 'rb') as mapping_stream:
+            mapping = load_mapping(mapping_stream)
+
+    with open(args.path, 'rb') as stream:
+        result = import_punches(stream, os.path.basename(args.path), chunk_size=args.chunk_size,
+                                dry_run=args.dry_run, log_format=args.format, mapping=mapping)
+
+    print(f"✅ تمت معالجة {result['lines']} سطر: {result['days']} يوم حضور "
+          f"({result['inserted']} جديد، {result['updated']} محدث)، {result['failed']} سطر غير صالح "
+          f"({result['rows_per_second']} سطر/ثانية)")
+    if result['unknown_devices']:
+        print(f"⚠️ أرقام أجهزة غير معروفة: {', '.join(result['unknown_devices'])}")
+    for error in result['errors']:
+        print(f"   - السطر {error['row']}: {'، '.join(error['errors'])}")
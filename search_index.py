@@ -0,0 +1,287 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from db_pool import get_db_connection
+
+# التشكيل وعلامة التطويل
+_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ة': 'ه',
+    'ؤ': 'و',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+_TOKEN_SPLIT = re.compile(r'[^\w]+')
+
+# وزن كل حقل في ترتيب النتائج
+FIELD_WEIGHTS = {
+    'employee_id': 10,
+    'national_number': 10,
+    'email': 8,
+    'phone': 8,
+    'name': 6,
+    'position': 3,
+}
+EXACT_MATCH_BONUS = 2
+
+
+def normalize_arabic(text):
+    """توحيد أشكال الألف والياء والتاء المربوطة وحذف التشكيل والأرقام الهندية"""
+    if not text:
+        return ''
+    text = _DIACRITICS.sub('', str(text))
+    return text.translate(_CHAR_MAP).lower()
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_SPLIT.split(normalize_arabic(text)) if token]
+
+
+def _field_tokens(field, value):
+    """الكلمات المفهرسة لحقل واحد"""
+    if not value:
+        return set()
+    tokens = set(tokenize(value))
+    if field in ('employee_id', 'national_number', 'phone', 'email'):
+        # القيمة كاملة بدون فواصل حتى يعمل البحث ببداية الرقم أو البريد
+        compact = normalize_arabic(value).replace(' ', '').replace('-', '')
+        tokens.add(compact)
+    return tokens
+
+
+class EmployeeSearchIndex:
+    """
+    فهرس بحث داخل الذاكرة للموظفين.
+    يحتفظ بقائمة مرتبة من الكلمات لدعم البحث ببداية الكلمة عبر bisect،
+    وكل كلمة تشير إلى الموظفين ووزن الحقل الذي وردت فيه.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._tokens = []           # كلمات مرتبة
+        self._postings = {}         # كلمة -> {id الموظف: الوزن}
+        self._doc_tokens = {}       # id الموظف -> الكلمات الخاصة به
+        self._documents = {}        # id الموظف -> بيانات العرض
+        self._loaded_at = None
+        self._rebuilding = False
+        self._recorders = []        # تعديلات تراكمت أثناء كل إعادة بناء جارية
+
+    # ---------- التحميل ----------
+
+    @staticmethod
+    def _fetch(employee_id=None):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        cursor = conn.cursor()
+        query = '''
+            SELECT e.id, e.employee_id, e.first_name, e.last_name, e.email, e.phone,
+                   e.national_number, e.position, e.status, e.department_id,
+                   d.name as department_name
+            FROM Employees e
+            LEFT JOIN Departments d ON e.department_id = d.id
+        '''
+        if employee_id is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query + ' WHERE e.id = ?', (employee_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    @staticmethod
+    def _document(row):
+        name = f'{row.first_name} {row.last_name}'
+        fields = {
+            'employee_id': row.employee_id,
+            'national_number': row.national_number,
+            'email': row.email,
+            'phone': row.phone,
+            'name': name,
+            'position': row.position,
+        }
+        payload = {
+            'id': row.id,
+            'employee_id': row.employee_id,
+            'name': name,
+            'email': row.email,
+            'position': row.position,
+            'department_id': row.department_id,
+            'department': row.department_name,
+            'status': row.status,
+        }
+        return fields, payload
+
+    @staticmethod
+    def _weighted_tokens(fields):
+        weights = {}
+        for field, value in fields.items():
+            for token in _field_tokens(field, value):
+                weights[token] = max(weights.get(token, 0), FIELD_WEIGHTS[field])
+        return weights
+
+    def rebuild(self):
+        """
+        إعادة بناء الفهرس بالكامل من قاعدة البيانات.
+        التعديلات التدريجية التي تصل أثناء القراءة تُسجل وتُعاد على النسخة الجديدة قبل اعتمادها
+        حتى لا تضيع حتى إعادة البناء التالية.
+        """
+        changes = []
+        with self._lock:
+            self._recorders.append(changes)
+        try:
+            postings = {}
+            doc_tokens = {}
+            documents = {}
+            for row in self._fetch():
+                fields, payload = self._document(row)
+                weights = self._weighted_tokens(fields)
+                for token, weight in weights.items():
+                    postings.setdefault(token, {})[row.id] = weight
+                doc_tokens[row.id] = weights
+                documents[row.id] = payload
+
+            with self._lock:
+                self._postings = postings
+                self._doc_tokens = doc_tokens
+                self._documents = documents
+                self._tokens = sorted(postings)
+                for employee_id, weights, payload in changes:
+                    if weights is None:
+                        self._remove_locked(employee_id)
+                    else:
+                        self._upsert_locked(employee_id, weights, payload)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._recorders.remove(changes)
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"❌ تعذر تحديث فهرس البحث: {e}")
+        finally:
+            self._rebuilding = False
+
+    def ensure_fresh(self):
+        """تحميل الفهرس عند أول استخدام، وتحديثه في الخلفية إذا أصبح قديماً"""
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self.rebuild()
+            return
+        if time.monotonic() - self._loaded_at > self.max_age and not self._rebuilding:
+            # العمال الآخرون قد يكتبون في قاعدة البيانات، لذلك نعيد البناء دورياً
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    # ---------- التحديث التدريجي ----------
+
+    def _remove_locked(self, employee_id):
+        for token in self._doc_tokens.pop(employee_id, {}):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(employee_id, None)
+            if not posting:
+                del self._postings[token]
+                position = bisect_left(self._tokens, token)
+                if position < len(self._tokens) and self._tokens[position] == token:
+                    del self._tokens[position]
+        self._documents.pop(employee_id, None)
+
+    def _upsert_locked(self, employee_id, weights, payload):
+        self._remove_locked(employee_id)
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                insort(self._tokens, token)
+            self._postings[token][employee_id] = weight
+        self._doc_tokens[employee_id] = weights
+        self._documents[employee_id] = payload
+
+    def upsert(self, row):
+        fields, payload = self._document(row)
+        weights = self._weighted_tokens(fields)
+        with self._lock:
+            self._upsert_locked(row.id, weights, payload)
+            for changes in self._recorders:
+                changes.append((row.id, weights, payload))
+
+    def remove(self, employee_id):
+        with self._lock:
+            self._remove_locked(employee_id)
+            for changes in self._recorders:
+                changes.append((employee_id, None, None))
+
+    def invalidate(self):
+        """إجبار إعادة البناء عند البحث التالي (بعد عمليات جماعية)"""
+        self._loaded_at = None
+
+    def refresh_employee(self, employee_id):
+        """تحديث موظف واحد بعد الإضافة أو التعديل"""
+        if self._loaded_at is None and not self._recorders:
+            return  # سيُحمّل الفهرس كاملاً عند أول بحث
+        rows = self._fetch(employee_id)
+        if rows:
+            self.upsert(rows[0])
+        else:
+            self.remove(employee_id)
+
+    # ---------- البحث ----------
+
+    def _prefix_matches(self, term):
+        """{id الموظف: أفضل درجة} لكل الكلمات التي تبدأ بـ term"""
+        scores = {}
+        position = bisect_left(self._tokens, term)
+        while position < len(self._tokens) and self._tokens[position].startswith(term):
+            token = self._tokens[position]
+            bonus = EXACT_MATCH_BONUS if token == term else 0
+            for employee_id, weight in self._postings[token].items():
+                score = weight + bonus
+                if score > scores.get(employee_id, 0):
+                    scores[employee_id] = score
+            position += 1
+        return scores
+
+    def search(self, query, limit=20):
+        """البحث بكل كلمات الاستعلام (AND) مع ترتيب النتائج حسب الدرجة"""
+        limit = max(1, limit)   # الحد السالب يقص من آخر النتائج بدل أن يحددها
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        self.ensure_fresh()
+
+        with self._lock:
+            # البدء بأطول كلمة لأنها عادة الأقل نتائج
+            terms.sort(key=len, reverse=True)
+            totals = self._prefix_matches(terms[0])
+            for term in terms[1:]:
+                if not totals:
+                    break
+                matches = self._prefix_matches(term)
+                totals = {employee_id: score + matches[employee_id]
+                          for employee_id, score in totals.items() if employee_id in matches}
+
+            ranked = sorted(totals.items(),
+                            key=lambda item: (-item[1], self._documents[item[0]]['name']))
+            results = [dict(self._documents[employee_id], score=score)
+                       for employee_id, score in ranked[:limit]]
+        return results, len(totals)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'employees': len(self._documents),
+                'tokens': len(self._tokens),
+                'loaded': self._loaded_at is not None,
+            }
+
+
+employee_index = EmployeeSearchIndex()
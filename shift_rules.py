@@ -0,0 +1,275 @@
+"""
+قواعد الدوام لكل قسم وتصنيف الحضور عند الكتابة.
+
+DepartmentShifts يحدد بداية ونهاية الدوام وفترة السماح للتأخير والانصراف المبكر لكل قسم
+(القسم 0 = الافتراضي للشركة). الجدول يُحمّل مرة واحدة إلى قاموس القسم -> حدود الدوام
+بالثواني، وقسم الموظف يأتي من فهرس الحضور اليومي، فتصنيف الحضور (present/late)
+عملية مقارنة واحدة دون استعلام.
+
+الغياب يُسجل ليلياً بعبارة INSERT ... SELECT واحدة لكل من لم يسجل حضوراً في يوم عمل قسمه:
+
+    python shift_rules.py --mark-absent
+    python shift_rules.py --mark-absent --date 2025-03-02
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import attendance_rollup
+from attendance_archive import hot_start
+from db_pool import get_db_connection
+from presence_index import presence_index
+from work_calendar import work_calendar, ALL_DEPARTMENTS
+
+# الدوام الافتراضي عند غياب صف للقسم وللشركة
+DEFAULT_SHIFT_START = '09:00'
+DEFAULT_SHIFT_END = '17:00'
+DEFAULT_GRACE_MINUTES = 0
+DEFAULT_EARLY_LEAVE_MINUTES = 0
+
+ABSENT_NOTE = 'غياب تلقائي'
+# بعد فشل التحميل يُستخدم الدوام الافتراضي ولا يُعاد المحاولة مع كل حضور
+RELOAD_AFTER_FAILURE = 60
+
+# الموظفون النشطون في أقسام يكون اليوم فيها يوم عمل ولا سجل لهم في اليوم.
+# UPDLOCK, HOLDLOCK على فحص السجل حتى ينتظر أي حضور متزامن بدلاً من تعارض المفتاح الفريد
+MARK_ABSENT_SQL = '''
+    SET NOCOUNT ON;
+    INSERT INTO Attendance (employee_id, attendance_date, status, notes)
+    OUTPUT inserted.employee_id, inserted.attendance_date, inserted.status
+    SELECT e.id, ?, 'absent', ?
+    FROM Employees e
+    WHERE e.status = 'active'
+      AND (e.hire_date IS NULL OR e.hire_date <= ?)
+      AND ISNULL(e.department_id, 0) IN (SELECT CAST(value AS INT) FROM OPENJSON(?))
+      AND NOT EXISTS (
+          SELECT 1 FROM Attendance a WITH (UPDLOCK, HOLDLOCK)
+          WHERE a.employee_id = e.id AND a.attendance_date = ?
+      );
+'''
+
+
+def _seconds(value):
+    """TIME أو 'HH:MM' -> ثوانٍ من منتصف الليل"""
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%H:%M').time()
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def compile_shift(shift_start, shift_end, grace_minutes=0, early_leave_minutes=0):
+    """حدود الدوام بالثواني: (البداية، المدة، حد التأخير، حد الانصراف المبكر)"""
+    start = _seconds(shift_start)
+    # دوام ليلي ينتهي بعد منتصف الليل
+    length = (_seconds(shift_end) - start) % 86400 or 86400
+    grace = int(grace_minutes or 0) * 60
+    early = int(early_leave_minutes or 0) * 60
+    if grace < 0 or early < 0:
+        raise ValueError('فترة السماح لا يمكن أن تكون سالبة')
+    return start, length, start + grace, start + length - early
+
+
+def shift_offset(seconds, start, length):
+    """
+    ثوانٍ من بداية الدوام مع الالتفاف عند منتصف الليل (تقبل مصفوفات numpy).
+    النصف الأخير من فترة الراحة قبل البداية يعطي قيمة سالبة (حضور مبكر)، فدوام 22:00-06:00
+    يرى 00:30 بعد البداية بساعتين ونصف، و21:50 قبلها بعشر دقائق.
+    """
+    before = (86400 - length) // 2
+    return (seconds - start + before) % 86400 - before
+
+
+def day_boundary(start, length):
+    """ثواني منتصف فترة الراحة قبل الدوام: الأوقات من هنا حتى الحد التالي تتبع نفس يوم الدوام"""
+    return (start - (86400 - length) // 2) % 86400
+
+
+DEFAULT_SHIFT = compile_shift(DEFAULT_SHIFT_START, DEFAULT_SHIFT_END,
+                              DEFAULT_GRACE_MINUTES, DEFAULT_EARLY_LEAVE_MINUTES)
+
+
+class ShiftRules:
+    """قواعد الدوام المحملة في الذاكرة (تُعاد قراءتها بعد أي تعديل عبر invalidate)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shifts = None  # القسم -> (البداية، المدة، حد التأخير، حد الانصراف المبكر)
+        self._failed_at = None
+
+    def _load(self):
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT department_id, shift_start, shift_end, grace_minutes, early_leave_minutes
+                FROM DepartmentShifts
+            ''')
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        return {row.department_id: compile_shift(row.shift_start, row.shift_end,
+                                                 row.grace_minutes, row.early_leave_minutes)
+                for row in rows}
+
+    def _table(self):
+        shifts = self._shifts
+        if shifts is None:
+            if self._failed_at is not None and time.monotonic() - self._failed_at < RELOAD_AFTER_FAILURE:
+                return {}
+            try:
+                shifts = self._load()
+            except Exception as e:
+                # بدون الجدول (قاعدة بيانات قديمة) يُستخدم الدوام الافتراضي
+                print(f"❌ تعذر تحميل قواعد الدوام: {e}")
+                self._failed_at = time.monotonic()
+                return {}
+            with self._lock:
+                self._shifts = shifts
+                self._failed_at = None
+        return shifts
+
+    def invalidate(self):
+        with self._lock:
+            self._shifts = None
+            self._failed_at = None
+
+    def shift(self, department_id=None):
+        shifts = self._table()
+        return shifts.get(department_id or ALL_DEPARTMENTS) or shifts.get(ALL_DEPARTMENTS) or DEFAULT_SHIFT
+
+    def employee_shift(self, employee_id):
+        employee = presence_index.employee(employee_id)
+        return self.shift(employee['department_id'] if employee else None)
+
+    def shift_day(self, employee_id, moment):
+        """تاريخ بداية الدوام الذي يتبعه الوقت moment (datetime)"""
+        start, length, _, _ = self.employee_shift(employee_id)
+        return (moment - timedelta(seconds=shift_offset(_seconds(moment), start, length))).date()
+
+    def check_in_status(self, employee_id, check_in):
+        """'late' إذا كان الحضور بعد بداية الدوام وفترة السماح، وإلا 'present'"""
+        start, length, late_after, _ = self.employee_shift(employee_id)
+        return 'late' if shift_offset(_seconds(check_in), start, length) > late_after - start else 'present'
+
+    def columns(self, department_ids):
+        """معاملات attendance_analytics.analyze بنفس ترتيب department_ids"""
+        shifts = [self.shift(department_id) for department_id in department_ids]
+        return {
+            'shift_start': [start for start, _, _, _ in shifts],
+            'shift_seconds': [length for _, length, _, _ in shifts],
+            'grace_seconds': [late_after - start for start, _, late_after, _ in shifts],
+            'early_leave_seconds': [start + length - leave_after for start, length, _, leave_after in shifts],
+        }
+
+    def all(self):
+        """قواعد الدوام المعرفة بالقيم المعروضة"""
+        def describe(shift):
+            start, length, late_after, leave_after = shift
+            return {
+                'shift_start': f'{start // 3600:02d}:{start % 3600 // 60:02d}',
+                'shift_end': f'{(start + length) % 86400 // 3600:02d}:{(start + length) % 3600 // 60:02d}',
+                'grace_minutes': (late_after - start) // 60,
+                'early_leave_minutes': (start + length - leave_after) // 60,
+            }
+        shifts = self._table()
+        result = {department_id: describe(shift) for department_id, shift in shifts.items()}
+        result.setdefault(ALL_DEPARTMENTS, describe(DEFAULT_SHIFT))
+        return result
+
+
+shift_rules = ShiftRules()
+
+
+# ==================== التعديل ====================
+
+def set_department_shift(conn, department_id, shift_start, shift_end, grace_minutes=0, early_leave_minutes=0):
+    """تحديد دوام قسم (أو الدوام الافتراضي للشركة بدون department_id)"""
+    compile_shift(shift_start, shift_end, grace_minutes, early_leave_minutes)  # التحقق من القيم
+    cursor = conn.cursor()
+    cursor.execute('''
+        MERGE DepartmentShifts WITH (HOLDLOCK) AS t
+        USING (SELECT ? AS department_id, ? AS shift_start, ? AS shift_end,
+                      ? AS grace_minutes, ? AS early_leave_minutes) AS s
+        ON t.department_id = s.department_id
+        WHEN MATCHED THEN
+            UPDATE SET shift_start = s.shift_start, shift_end = s.shift_end,
+                       grace_minutes = s.grace_minutes, early_leave_minutes = s.early_leave_minutes
+        WHEN NOT MATCHED THEN
+            INSERT (department_id, shift_start, shift_end, grace_minutes, early_leave_minutes)
+            VALUES (s.department_id, s.shift_start, s.shift_end, s.grace_minutes, s.early_leave_minutes);
+    ''', (department_id or ALL_DEPARTMENTS, shift_start, shift_end,
+          int(grace_minutes or 0), int(early_leave_minutes or 0)))
+    conn.commit()
+    shift_rules.invalidate()
+
+
+def remove_department_shift(conn, department_id):
+    """حذف دوام القسم ليعود إلى الدوام الافتراضي"""
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM DepartmentShifts WHERE department_id = ?', (department_id or ALL_DEPARTMENTS,))
+    conn.commit()
+    shift_rules.invalidate()
+    return cursor.rowcount > 0
+
+
+# ==================== الغياب الليلي ====================
+
+def mark_absent(day=None, conn=None):
+    """
+    تسجيل 'absent' لكل موظف نشط لم يسجل حضوراً في يوم عمل قسمه (افتراضياً أمس).
+    عبارة واحدة للشركة كلها؛ أيام العمل لكل قسم من تقويم العمل في الذاكرة.
+    يعيد عدد سجلات الغياب المضافة.
+    """
+    day = day or date.today() - timedelta(days=1)
+    if day >= date.today():
+        raise ValueError('لا يُسجل الغياب إلا لأيام انتهت')
+    if day < hot_start():
+        raise ValueError('لا يُسجل الغياب في سنة مؤرشفة')
+
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM Departments')
+        departments = [ALL_DEPARTMENTS] + [row.id for row in cursor.fetchall()]
+        working = [department_id for department_id in departments
+                   if work_calendar.is_working_day(day, department_id)]
+        if not working:
+            return 0
+        try:
+            cursor.execute(MARK_ABSENT_SQL, (day, ABSENT_NOTE, day, json.dumps(working), day))
+            rows = cursor.fetchall()
+            attendance_rollup.record_changes(cursor, [
+                (row.employee_id, row.attendance_date, None, row.status) for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        if own_connection:
+            conn.close()
+
+    try:
+        presence_index.record([(row.employee_id, row.attendance_date, row.status) for row in rows])
+    except Exception as e:
+        print(f"❌ تعذر تحديث فهرس الحضور اليومي: {e}")
+    return len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='قواعد الدوام وتسجيل الغياب الليلي')
+    parser.add_argument('--mark-absent', action='store_true', help='تسجيل الغياب لمن لم يحضر في يوم عمل')
+    parser.add_argument('--date', help='اليوم YYYY-MM-DD (افتراضياً أمس)')
+    args = parser.parse_args()
+    if not args.mark_absent:
+        parser.error('حدد --mark-absent')
+
+    target = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+    count = mark_absent(target)
+    print(f"✅ تم تسجيل {count} غياب")
@@ -112,3 +112,53 @@ function advancedSearch() {
   // يمكن إضافة وظائف بحث متقدم هنا
   console.log("الباحث المتقدم قيد التطوير...");
 }
+
+// البث المباشر لأحداث الحضور (Server-Sent Events)
+function subscribeAttendanceStream(url, pageDate, handlers) {
+  if (!window.EventSource) return null;
+  const source = new EventSource(url);
+  let connected = false;
+
+  source.addEventListener("snapshot", (event) => {
+    const data = JSON.parse(event.data);
+    // لقطة بعد إعادة الاتصال تعني أن أحداثاً فاتت: إعادة تحميل الصفحة
+    if (connected || data.date !== pageDate) {
+      location.reload();
+      return;
+    }
+    connected = true;
+    if (handlers.counters) handlers.counters(data.counters);
+  });
+
+  ["check_in", "check_out"].forEach((action) => {
+    source.addEventListener(action, (event) => {
+      const data = JSON.parse(event.data);
+      if (data.attendance_date !== pageDate) return;
+      if (handlers.counters) handlers.counters(data.counters);
+      if (handlers[action]) handlers[action](data);
+    });
+  });
+  return source;
+}
+
+// خلية نصية بدون HTML من بيانات البث
+function attendanceCell(text, className) {
+  const cell = document.createElement("td");
+  if (className) {
+    const badge = document.createElement("span");
+    badge.className = className;
+    badge.textContent = text;
+    cell.appendChild(badge);
+  } else {
+    cell.textContent = text;
+  }
+  return cell;
+}
+
+const ATTENDANCE_STATUS_LABELS = {
+  present: "حاضر",
+  late: "متأخر",
+  absent: "غائب",
+  vacation: "إجازة",
+  sick_leave: "إجازة مرضية",
+};
@@ -0,0 +1,165 @@
+import json
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+import attendance_events
+from attendance_events import APPLY_EVENTS_SQL, CLAIM_KEYS_SQL, RECORD_RESULTS_SQL, apply_events
+from shift_rules import DEFAULT_SHIFT, compile_shift
+
+Output = namedtuple('Output', 'action id employee_id attendance_date previous_check_in check_in '
+                              'previous_check_out check_out previous_status status')
+Claimed = namedtuple('Claimed', 'idempotency_key result_code attendance_id')
+Unknown = namedtuple('Unknown', 'employee_id')
+
+
+def _time(value):
+    return time.fromisoformat(value) if value else None
+
+
+class FakeDatabase:
+    """Attendance و AttendanceEvents في الذاكرة بنفس قواعد APPLY_EVENTS_SQL"""
+
+    def __init__(self, employees=(1, 2)):
+        self.employees = set(employees)
+        self.rows = {}   # (الموظف، التاريخ) -> [id، الحضور، الانصراف، الحالة]
+        self.keys = {}   # المفتاح -> [الكود، رقم السجل]
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def merge(self, payload):
+        unknown, outcomes = [], []
+        for employee_id, day, check_in, check_out, status in payload:
+            if employee_id not in self.employees:
+                unknown.append(Unknown(employee_id))
+                continue
+            day, check_in, check_out = date.fromisoformat(day), _time(check_in), _time(check_out)
+            row = self.rows.get((employee_id, day))
+            if row is None:
+                if check_in is None:
+                    continue
+                row = self.rows[(employee_id, day)] = [len(self.rows) + 1, check_in, check_out, status]
+                outcomes.append(Output('INSERT', row[0], employee_id, day, None, check_in, None, check_out,
+                                       None, status))
+                continue
+            previous = list(row)
+            reopened = row[3] == 'absent' and row[1] is None and check_in is not None
+            if row[2] is None and check_out is not None and (row[1] is not None or reopened):
+                row[2] = check_out
+            if reopened:
+                row[1], row[3] = check_in, status
+            outcomes.append(Output('UPDATE', row[0], employee_id, day, previous[1], row[1],
+                                   previous[2], row[2], previous[3], row[3]))
+        return [unknown, outcomes]
+
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.results = []
+
+    def execute(self, sql, params=()):
+        payload = json.loads(params[0]) if params else None
+        if sql == APPLY_EVENTS_SQL:
+            self.results = self.database.merge(payload)
+        elif sql == CLAIM_KEYS_SQL:
+            keys = self.database.keys
+            self.results = [[Claimed(key, *keys[key]) for key, *_ in payload if key in keys]]
+            for key, *_ in payload:
+                keys.setdefault(key, [None, None])
+        elif sql == RECORD_RESULTS_SQL:
+            for key, code, attendance_id in payload:
+                self.database.keys[key] = [code, attendance_id]
+        else:
+            # فروق الملخصات الشهرية واليومية
+            self.results = []
+
+    def fetchall(self):
+        return self.results[0] if self.results else []
+
+    def nextset(self):
+        self.results = self.results[1:]
+        return bool(self.results)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    published = []
+    monkeypatch.setattr(attendance_events.presence_index, 'ensure_fresh', lambda: None)
+    monkeypatch.setattr(attendance_events.presence_index, 'record', lambda changes: None)
+    monkeypatch.setattr(attendance_events.presence_index, 'counts', lambda day=None: {})
+    monkeypatch.setattr(attendance_events.presence_index, 'employee', lambda employee_id: None)
+    monkeypatch.setattr(attendance_events.shift_rules, 'employee_shift', lambda employee_id: DEFAULT_SHIFT)
+    monkeypatch.setattr(attendance_events.shift_rules, 'check_in_status', lambda employee_id, moment: 'present')
+    monkeypatch.setattr(attendance_events.attendance_bus, 'publish', lambda action, data: published.append(action))
+    monkeypatch.setattr(attendance_events, 'idempotency_cache', attendance_events.IdempotencyCache())
+    database = FakeDatabase()
+    database.published = published
+    return database
+
+
+def event(action, hour, employee_id=1, key=None, days_ago=1):
+    moment = datetime.combine(date.today() - timedelta(days=days_ago), time(hour))
+    return {'employee_id': employee_id, 'action': action, 'timestamp': moment.isoformat(), 'idempotency_key': key}
+
+
+def codes(results):
+    return [result['code'] for result in results]
+
+
+def test_check_in_then_check_out(database):
+    assert codes(apply_events(database, [event('check_in', 8)])) == ['check_in']
+    assert codes(apply_events(database, [event('check_out', 17)])) == ['check_out']
+    assert database.published == ['check_in', 'check_out']
+    ((_, check_in, check_out, _),) = database.rows.values()
+    assert (check_in, check_out) == (time(8), time(17))
+
+
+def test_rejected_check_out_does_not_drop_published_events(database):
+    apply_events(database, [event('check_in', 8), event('check_out', 17)])
+    results = apply_events(database, [event('check_in', 8, employee_id=2), event('check_out', 18)])
+    assert codes(results) == ['check_in', 'already_checked_out']
+    assert database.published == ['check_in', 'check_out', 'check_in']
+
+
+def test_check_out_without_check_in(database):
+    assert codes(apply_events(database, [event('check_out', 17)])) == ['not_checked_in']
+    assert database.rows == {}
+
+
+def test_unknown_employee(database):
+    assert codes(apply_events(database, [event('check_in', 8, employee_id=99)])) == ['unknown_employee']
+
+
+def test_idempotency_key_applies_once(database):
+    first = apply_events(database, [event('check_in', 8, key='k1'), event('check_in', 8, key='k1')])
+    assert codes(first) == ['check_in', 'check_in']
+    assert [result['duplicate'] for result in first] == [False, True]
+
+    # بعد انتهاء الذاكرة المؤقتة يعود المفتاح بنتيجته المحفوظة في AttendanceEvents
+    attendance_events.idempotency_cache = attendance_events.IdempotencyCache()
+    (again,) = apply_events(database, [event('check_in', 8, key='k1')])
+    assert again['duplicate'] and again['code'] == 'check_in'
+    assert len(database.rows) == 1
+
+
+def test_overnight_shift_checks_out_on_the_start_day(database, monkeypatch):
+    monkeypatch.setattr(attendance_events.shift_rules, 'employee_shift',
+                        lambda employee_id: compile_shift('22:00', '06:00'))
+    assert codes(apply_events(database, [event('check_in', 22, days_ago=2)])) == ['check_in']
+    assert codes(apply_events(database, [event('check_out', 6)])) == ['check_out']
+    assert database.published == ['check_in', 'check_out']
+    (((_, day), (_, check_in, check_out, _)),) = database.rows.items()
+    assert day == date.today() - timedelta(days=2)
+    assert (check_in, check_out) == (time(22), time(6))
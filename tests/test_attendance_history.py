@@ -0,0 +1,89 @@
+from collections import namedtuple
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('pyodbc')
+pytest.importorskip('flask')
+
+import attendance_history
+from attendance_history import range_totals
+from attendance_rollup import OTHER_COLUMN, ROLLUP_COLUMNS, STATUS_COLUMNS, month_start
+
+Totals = namedtuple('Totals', ROLLUP_COLUMNS)
+
+
+class FakeCursor:
+    """سجلات الحضور وملخصها الشهري (AttendanceMonthly) مبني من نفس السجلات"""
+
+    def __init__(self, records):
+        self.records = records   # التاريخ -> الحالة
+        self.monthly = []        # فترات [start, end) التي قُرئت من الملخص
+        self.direct = []         # فترات قُرئت من السجلات مباشرة
+        self.row = None
+
+    def _totals(self, start, end, months=False):
+        counts = dict.fromkeys(ROLLUP_COLUMNS, 0)
+        for day, status in self.records.items():
+            if start <= (month_start(day) if months else day) < end:
+                counts[STATUS_COLUMNS.get(status, OTHER_COLUMN)] += 1
+        return Totals(**counts)
+
+    def execute(self, sql, params):
+        _, start, end = params
+        if 'AttendanceMonthly' in sql:
+            assert start.day == 1 and end.day == 1
+            self.monthly.append((start, end))
+            self.row = self._totals(start, end, months=True)
+        else:
+            self.direct.append((start, end))
+            self.row = self._totals(start, end)
+
+    def fetchone(self):
+        return self.row
+
+
+@pytest.fixture
+def cursor(monkeypatch):
+    monkeypatch.setattr(attendance_history, 'attendance_table', lambda start=None: 'Attendance')
+    monkeypatch.setattr(attendance_history.work_calendar, 'working_days_between',
+                        lambda start, end, department_id=None: (end - start).days)
+    statuses = ['present', 'late', 'absent', 'present', 'vacation']
+    first = date(2024, 12, 20)
+    return FakeCursor({first + timedelta(days=offset): statuses[offset % len(statuses)]
+                       for offset in range(120)})
+
+
+def expected(cursor, start, end):
+    return cursor._totals(start, end)._asdict()
+
+
+def test_range_with_partial_edges(cursor):
+    start, end = date(2025, 1, 15), date(2025, 3, 10)
+    totals = range_totals(cursor, 1, start, end)
+    assert {column: totals[column] for column in ROLLUP_COLUMNS} == expected(cursor, start, end)
+    assert cursor.monthly == [(date(2025, 2, 1), date(2025, 3, 1))]
+    assert cursor.direct == [(start, date(2025, 2, 1)), (date(2025, 3, 1), end)]
+
+
+def test_range_of_full_months_skips_records(cursor):
+    start, end = date(2025, 1, 1), date(2025, 3, 1)
+    totals = range_totals(cursor, 1, start, end)
+    assert {column: totals[column] for column in ROLLUP_COLUMNS} == expected(cursor, start, end)
+    assert cursor.direct == []
+    assert totals['working_days'] == 59
+
+
+def test_range_inside_one_month(cursor):
+    start, end = date(2025, 2, 3), date(2025, 2, 20)
+    totals = range_totals(cursor, 1, start, end)
+    assert {column: totals[column] for column in ROLLUP_COLUMNS} == expected(cursor, start, end)
+    assert cursor.monthly == []
+    recorded = totals['present_days'] + totals['late_days'] + totals['absent_days']
+    assert totals['attendance_rate'] == round((totals['present_days'] + totals['late_days']) / recorded * 100, 1)
+
+
+def test_empty_range(cursor):
+    totals = range_totals(cursor, 1, date(2025, 2, 3), date(2025, 2, 3))
+    assert totals['attendance_rate'] == 0
+    assert cursor.monthly == cursor.direct == []
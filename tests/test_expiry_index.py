@@ -0,0 +1,65 @@
+from collections import namedtuple
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+from expiry_index import ExpiryIndex
+
+Row = namedtuple('Row', 'id employee_id first_name last_name status department_id department_name '
+                        'LicenseType LicenseExpiryDate ContractType ContractEnd')
+
+
+def row(employee_id, days):
+    return Row(employee_id, f'E{employee_id}', 'موظف', str(employee_id), 'active', 1, 'الإدارة',
+               'خاصة', date.today() + timedelta(days=days), None, None)
+
+
+def index_with(rows, during_fetch=None):
+    """فهرس يقرأ rows ويستدعي during_fetch(index) أثناء قراءة إعادة البناء الكاملة"""
+    index = ExpiryIndex()
+
+    def fetch(employee_id=None):
+        if employee_id is not None:
+            return [r for r in rows if r.id == employee_id]
+        snapshot = list(rows)
+        if during_fetch:
+            during_fetch(index)
+        return snapshot
+
+    index._fetch = fetch
+    return index
+
+
+def expiring_ids(index):
+    today = date.today()
+    return [item['id'] for item in index.expiring(today, today + timedelta(days=30))]
+
+
+def test_invalidate_during_rebuild_forces_another_load():
+    rows = [row(1, 5)]
+
+    def bulk_import(index):
+        rows.append(row(2, 10))
+        index.invalidate()
+
+    index = index_with(rows, bulk_import)
+    index.rebuild()
+    assert not index._loaded
+
+    index._fetch = index_with(rows)._fetch
+    assert expiring_ids(index) == [1, 2]
+
+
+def test_refresh_during_rebuild_is_replayed():
+    rows = [row(1, 5), row(2, 10)]
+
+    def edit(index):
+        rows[0] = row(1, 20)
+        index.refresh_employee(1)
+
+    index = index_with(rows, edit)
+    index.rebuild()
+    assert index._loaded
+    assert expiring_ids(index) == [2, 1]
@@ -0,0 +1,75 @@
+from collections import namedtuple
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+import org_hierarchy
+from org_hierarchy import OrgHierarchy
+
+Row = namedtuple('Row', 'id name manager_id manager_name manager_department_id')
+
+
+def hierarchy_with(rows):
+    hierarchy = OrgHierarchy()
+    hierarchy.fetches = 0
+
+    def fetch():
+        hierarchy.fetches += 1
+        return list(rows)
+
+    hierarchy._fetch = fetch
+    return hierarchy
+
+
+# الإدارة العامة (1) <- المالية (2) <- الرواتب (3)، والتقنية (4) تتبع الإدارة العامة
+ROWS = [
+    Row(1, 'الإدارة العامة', 10, 'المدير العام', 1),
+    Row(2, 'المالية', 20, 'مدير المالية', 1),
+    Row(3, 'الرواتب', 30, 'مدير الرواتب', 2),
+    Row(4, 'التقنية', 40, 'مدير التقنية', 1),
+]
+
+
+def test_subtree_and_scope():
+    hierarchy = hierarchy_with(ROWS)
+    assert [node['id'] for node in hierarchy.subtree(2)] == [2, 3]
+    assert [node['id'] for node in hierarchy.ancestors(3)] == [2, 1]
+    assert hierarchy.in_scope(20, 3) and not hierarchy.in_scope(20, 4)
+    assert sorted(hierarchy.scope(10)) == [1, 2, 3, 4]
+
+
+def test_cycle_is_broken():
+    hierarchy = hierarchy_with([Row(1, 'أ', 10, 'م1', 2), Row(2, 'ب', 20, 'م2', 1)])
+    assert [node['id'] for node in hierarchy.subtree(1)] == [1, 2]
+    assert hierarchy.ancestors(1) == []
+
+
+def test_tree_is_reloaded_after_ttl(monkeypatch):
+    rows = list(ROWS)
+    hierarchy = hierarchy_with(rows)
+    now = [1000.0]
+    monkeypatch.setattr(org_hierarchy.time, 'monotonic', lambda: now[0])
+    assert not hierarchy.is_descendant(4, 2)
+
+    # عامل آخر نقل مدير التقنية إلى المالية
+    rows[3] = Row(4, 'التقنية', 40, 'مدير التقنية', 2)
+    assert not hierarchy.is_descendant(4, 2)
+    now[0] += org_hierarchy.CACHE_TTL + 1
+    assert hierarchy.is_descendant(4, 2)
+    assert hierarchy.fetches == 2
+
+
+def test_invalidate_during_rebuild_is_not_lost():
+    rows = list(ROWS)
+    hierarchy = hierarchy_with(rows)
+    fetch = hierarchy._fetch
+
+    def racing_fetch():
+        snapshot = fetch()
+        hierarchy.invalidate()
+        return snapshot
+
+    hierarchy._fetch = racing_fetch
+    hierarchy.rebuild()
+    assert not hierarchy.stats()['loaded']
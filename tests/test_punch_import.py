@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+from punch_import import MIN_SHIFT, chunked, merge_days, pair_punches
+from shift_rules import ShiftRules, compile_shift
+
+
+def punch(day, hour, minute=0):
+    return 1, datetime(2025, 3, day, hour, minute)
+
+
+def test_late_punch_reopens_flushed_day():
+    punches = [punch(1, 8), punch(2, 8), punch(3, 8), punch(1, 17)]
+    days = list(pair_punches(punches))
+    keys = [(employee_id, day) for employee_id, day, _, _ in days]
+    assert keys.count((1, datetime(2025, 3, 1).date())) == 2
+
+
+def test_merge_days_combines_reopened_day_in_chunk():
+    punches = [punch(1, 8), punch(2, 8), punch(3, 8), punch(1, 17)]
+    (chunk,) = chunked(pair_punches(punches), 100)
+    merged = merge_days(chunk)
+
+    keys = [(employee_id, day) for employee_id, day, _, _ in merged]
+    assert len(keys) == len(set(keys))
+    first_day = {day: (first, last) for _, day, first, last in merged}[datetime(2025, 3, 1).date()]
+    assert first_day == (datetime(2025, 3, 1, 8), datetime(2025, 3, 1, 17))
+    # الانصراف يُحسب من الفترة المدمجة وليس من البصمة المتأخرة وحدها
+    assert first_day[1] - first_day[0] >= MIN_SHIFT
+
+
+def test_merge_days_keeps_earliest_and_latest():
+    day = datetime(2025, 3, 1).date()
+    chunk = [(1, day, datetime(2025, 3, 1, 9), datetime(2025, 3, 1, 9)),
+             (1, day, datetime(2025, 3, 1, 7, 30), datetime(2025, 3, 1, 16)),
+             (2, day, datetime(2025, 3, 1, 8), datetime(2025, 3, 1, 8) + timedelta(minutes=1))]
+    assert merge_days(chunk) == [
+        (1, day, datetime(2025, 3, 1, 7, 30), datetime(2025, 3, 1, 16)),
+        (2, day, datetime(2025, 3, 1, 8), datetime(2025, 3, 1, 8, 1)),
+    ]
+
+
+def test_overnight_punches_pair_on_the_start_day():
+    rules = ShiftRules()
+    shift = compile_shift('22:00', '06:00')
+    rules.employee_shift = lambda employee_id: shift
+    punches = [punch(1, 21, 55), punch(2, 0, 30), punch(2, 6, 5), punch(2, 21, 50)]
+    days = list(pair_punches(punches, rules.shift_day))
+    assert [(day, first, last) for _, day, first, last in days] == [
+        (punch(1, 0)[1].date(), punch(1, 21, 55)[1], punch(2, 6, 5)[1]),
+        (punch(2, 0)[1].date(), punch(2, 21, 50)[1], punch(2, 21, 50)[1]),
+    ]
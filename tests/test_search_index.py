@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+from search_index import EmployeeSearchIndex
+
+Row = namedtuple('Row', 'id employee_id first_name last_name email phone national_number position '
+                        'status department_id department_name')
+
+
+def row(employee_id, first_name, last_name, position='محاسب'):
+    return Row(employee_id, f'E{employee_id:03}', first_name, last_name, f'e{employee_id}@example.com',
+               None, None, position, 'active', 1, 'المالية')
+
+
+@pytest.fixture
+def index():
+    index = EmployeeSearchIndex()
+    rows = [row(1, 'أحمد', 'علي'), row(2, 'أحمد', 'سالم'), row(3, 'سارة', 'أحمد', 'مديرة')]
+    index._fetch = lambda employee_id=None: [r for r in rows if employee_id in (None, r.id)]
+    return index
+
+
+def test_all_terms_must_match(index):
+    results, total = index.search('احمد سالم')
+    assert total == 1 and results[0]['id'] == 2
+
+
+def test_negative_limit_returns_top_result(index):
+    results, total = index.search('أحمد', limit=-2)
+    assert total == 3
+    assert len(results) == 1
+
+
+def test_removed_employee_is_not_found(index):
+    index.search('أحمد')
+    index.remove(2)
+    assert [result['id'] for result in index.search('أحمد')[0]] == [1, 3]
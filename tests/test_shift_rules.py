@@ -0,0 +1,49 @@
+from datetime import time
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+from shift_rules import ShiftRules, compile_shift, shift_offset
+
+
+def rules_for(shift_start, shift_end, grace_minutes=0):
+    rules = ShiftRules()
+    shift = compile_shift(shift_start, shift_end, grace_minutes)
+    rules.employee_shift = lambda employee_id: shift
+    return rules
+
+
+@pytest.mark.parametrize('check_in, expected', [
+    (time(8, 50), 'present'),
+    (time(9, 15), 'present'),
+    (time(9, 16), 'late'),
+    (time(13, 0), 'late'),
+])
+def test_day_shift(check_in, expected):
+    assert rules_for('09:00', '17:00', 15).check_in_status(1, check_in) == expected
+
+
+@pytest.mark.parametrize('check_in, expected', [
+    (time(21, 45), 'present'),
+    (time(22, 10), 'present'),
+    (time(22, 20), 'late'),
+    (time(0, 30), 'late'),
+    (time(5, 0), 'late'),
+])
+def test_overnight_shift(check_in, expected):
+    assert rules_for('22:00', '06:00', 15).check_in_status(1, check_in) == expected
+
+
+def test_grace_period_past_midnight():
+    rules = rules_for('23:30', '07:30', 45)
+    assert rules.check_in_status(1, time(0, 10)) == 'present'
+    assert rules.check_in_status(1, time(0, 20)) == 'late'
+
+
+def test_shift_offset_wraps_midnight():
+    start, length, _, _ = compile_shift('22:00', '06:00')
+    assert shift_offset(30 * 60, start, length) == 2 * 3600 + 30 * 60
+    assert shift_offset(21 * 3600 + 50 * 60, start, length) == -10 * 60
+    # الانصراف المبكر: 05:00 قبل نهاية الدوام بساعة
+    assert length - shift_offset(5 * 3600, start, length) == 3600
@@ -0,0 +1,98 @@
+from collections import namedtuple
+from datetime import date
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+import work_calendar
+from work_calendar import ALL_DEPARTMENTS, WorkCalendar
+
+WeekendRow = namedtuple('WeekendRow', 'department_id weekend_days')
+CalendarRow = namedtuple('CalendarRow', 'calendar_date is_working_day')
+
+
+class FakeConnection:
+    """DepartmentWeekends و WorkCalendar في الذاكرة"""
+
+    def __init__(self, weekends, days):
+        self.weekends = weekends    # القسم -> '4,5'
+        self.days = days            # (القسم، التاريخ) -> يوم عمل؟
+        self.queries = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        self.connection.queries += 1
+        if 'DepartmentWeekends' in sql:
+            self.rows = [WeekendRow(*item) for item in self.connection.weekends.items()]
+            return
+        start, end, _, department_id, first = params
+        days = self.connection.days
+        # صفوف first أولاً؛ الصف الأخير لكل يوم هو المعتمد
+        owners = (first, department_id) if first != department_id else (first,)
+        self.rows = [CalendarRow(day, working)
+                     for owner in owners
+                     for (row_department, day), working in sorted(days.items())
+                     if row_department == owner and start <= day < end]
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection({ALL_DEPARTMENTS: '4,5', 7: '6'}, {
+        (ALL_DEPARTMENTS, date(2025, 3, 3)): False,   # إجازة رسمية يوم اثنين
+        (7, date(2025, 3, 3)): True,                 # القسم 7 يعمل فيها
+        (ALL_DEPARTMENTS, date(2025, 3, 7)): True,    # جمعة تعويضية
+    })
+    monkeypatch.setattr(work_calendar, 'get_db_connection', lambda: connection)
+    return connection
+
+
+def test_working_days_between_within_month(connection):
+    calendar = WorkCalendar()
+    # 1-8 مارس 2025: السبت 1 عطلة، الاثنين 3 إجازة، الجمعة 7 يوم عمل
+    assert calendar.working_days_between(date(2025, 3, 1), date(2025, 3, 9)) == 5
+    assert calendar.working_days_between(date(2025, 3, 3), date(2025, 3, 4)) == 0
+    assert calendar.working_days_between(date(2025, 3, 5), date(2025, 3, 5)) == 0
+
+
+def test_working_days_between_spans_months(connection):
+    calendar = WorkCalendar()
+    total = calendar.working_days_between(date(2025, 2, 27), date(2025, 4, 2))
+    expected = (calendar.working_days_between(date(2025, 2, 27), date(2025, 3, 1))
+                + calendar.working_days(2025, 3)
+                + calendar.working_days_between(date(2025, 4, 1), date(2025, 4, 2)))
+    assert total == expected == 1 + 22 + 1   # الجمعة 28 فبراير عطلة
+
+
+def test_department_weekend_and_exceptions(connection):
+    calendar = WorkCalendar()
+    assert calendar.is_working_day(date(2025, 3, 3), department_id=7)
+    assert calendar.is_working_day(date(2025, 3, 8), department_id=7)       # السبت يوم عمل للقسم
+    assert not calendar.is_working_day(date(2025, 3, 9), department_id=7)   # الأحد عطلته
+    assert not calendar.is_working_day(date(2025, 3, 3))
+
+
+def test_months_are_cached_until_invalidated(connection):
+    calendar = WorkCalendar()
+    calendar.working_days(2025, 3)
+    queries = connection.queries
+    calendar.working_days_between(date(2025, 3, 10), date(2025, 3, 20))
+    assert connection.queries == queries
+
+    connection.days[(ALL_DEPARTMENTS, date(2025, 3, 10))] = False
+    calendar.invalidate()
+    assert calendar.working_days_between(date(2025, 3, 10), date(2025, 3, 11)) == 0
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+import write_behind
+from write_behind import DEAD_LETTER_FILE, MAX_EVENT_ATTEMPTS, WriteBehindQueue
+
+
+def event(employee_id, action='check_in', key=None):
+    return {'employee_id': employee_id, 'action': action, 'timestamp': '2025-03-02T08:00:00',
+            'idempotency_key': key or f'{employee_id}-{action}'}
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, 'get_db_connection', lambda: FakeConnection())
+    queue = WriteBehindQueue(journal_dir=str(tmp_path), batch_size=10)
+    queue._run = lambda: None
+    queue.start()
+    return queue
+
+
+def apply_except(poison, written):
+    def apply_events(conn, events):
+        if any(item['employee_id'] == poison for item in events):
+            raise ValueError('bad event')
+        written.extend(item['employee_id'] for item in events)
+        return [{'success': True, 'duplicate': False, 'code': item['action']} for item in events]
+    return apply_events
+
+
+def drain(queue, rounds=50):
+    for _ in range(rounds):
+        if not queue._pending:
+            return
+        try:
+            queue.flush_once()
+        except ValueError:
+            pass
+
+
+def test_failing_event_is_dead_lettered(queue, tmp_path, monkeypatch):
+    written = []
+    monkeypatch.setattr(write_behind.attendance_events, 'apply_events', apply_except(2, written))
+    queue._append([event(1), event(2), event(3)])
+
+    drain(queue)
+
+    assert written == [1, 3]
+    assert queue.metrics['dead_lettered'] == 1
+    with open(tmp_path / DEAD_LETTER_FILE, encoding='utf-8') as dead_letter:
+        (parked,) = [json.loads(line) for line in dead_letter]
+    assert parked['employee_id'] == 2 and parked['error'] == 'bad event'
+    assert os.path.getsize(queue.journal_path) == 0
+
+
+def test_failing_event_is_retried_before_parking(queue, monkeypatch):
+    monkeypatch.setattr(write_behind.attendance_events, 'apply_events', apply_except(2, []))
+    queue._append([event(2)])
+    for _ in range(MAX_EVENT_ATTEMPTS - 1):
+        with pytest.raises(ValueError):
+            queue.flush_once()
+    assert len(queue._pending) == 1
+    queue.flush_once()
+    assert not queue._pending
+
+
+def test_orphaned_journals_are_adopted(tmp_path, monkeypatch):
+    with open(tmp_path / 'attendance_journal.other.1.log', 'w', encoding='utf-8') as journal:
+        journal.write(json.dumps(event(1)) + '\n{"truncated')
+    with open(tmp_path / 'attendance_journal.log', 'w', encoding='utf-8') as journal:
+        journal.write(json.dumps(event(2)) + '\n')
+
+    queue = WriteBehindQueue(journal_dir=str(tmp_path))
+    queue._run = lambda: None
+    queue.start()
+
+    assert sorted(item['employee_id'] for _, item in queue._pending) == [1, 2]
+    assert os.listdir(tmp_path) == [os.path.basename(queue.journal_path)]
+    with open(queue.journal_path, encoding='utf-8') as journal:
+        assert len(journal.readlines()) == 2
@@ -0,0 +1,194 @@
+import calendar
+import threading
+import time
+from datetime import date, timedelta
+
+from db_pool import get_db_connection
+
+# أيام العطلة الأسبوعية الافتراضية بترقيم date.weekday(): الجمعة والسبت
+DEFAULT_WEEKEND = (4, 5)
+# صفوف الشركة كلها (الإجازات الرسمية والعطلة الافتراضية) تُحفظ تحت القسم 0
+ALL_DEPARTMENTS = 0
+MAX_CACHED_MONTHS = 2000
+# العمال الآخرون قد يعدلون التقويم، فالذاكرة تُعاد قراءتها دورياً
+CACHE_TTL = 300
+
+
+def parse_weekend(value):
+    """'4,5' -> (4, 5)"""
+    if not value:
+        return DEFAULT_WEEKEND
+    days = tuple(sorted({int(day) for day in str(value).split(',') if day.strip() != ''}))
+    if any(day < 0 or day > 6 for day in days):
+        raise ValueError('أيام العطلة يجب أن تكون بين 0 (الاثنين) و 6 (الأحد)')
+    return days
+
+
+class WorkCalendar:
+    """
+    تقويم العمل: العطلة الأسبوعية لكل قسم (DepartmentWeekends) والاستثناءات بالتاريخ
+    (WorkCalendar: إجازة رسمية is_working_day=0 أو يوم عمل تعويضي is_working_day=1).
+    كل شهر يُحسب مرة واحدة لكل قسم كـ bitmap (البت n = اليوم n+1) مع عدد أيام العمل،
+    فالاستعلام عن يوم أو عن عدد أيام الشهر لا يلمس قاعدة البيانات بعد ذلك.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._months = {}     # (القسم، السنة، الشهر) -> (bitmap، عدد أيام العمل)
+        self._weekends = None  # القسم -> أيام العطلة
+        self._loaded_at = None
+        # يزيد مع كل invalidate حتى لا يُخزن شهر بُني من بيانات سابقة له
+        self._generation = 0
+
+    # ---------- التحميل ----------
+
+    def _load_weekends(self, cursor):
+        cursor.execute('SELECT department_id, weekend_days FROM DepartmentWeekends')
+        return {row.department_id: parse_weekend(row.weekend_days) for row in cursor.fetchall()}
+
+    @staticmethod
+    def _weekend(weekends, department_id):
+        return weekends.get(department_id) or weekends.get(ALL_DEPARTMENTS) or DEFAULT_WEEKEND
+
+    def _build_month(self, cursor, weekends, department_id, year, month):
+        days_in_month = calendar.monthrange(year, month)[1]
+        start = date(year, month, 1)
+        weekend = self._weekend(weekends, department_id)
+
+        bits = 0
+        for offset in range(days_in_month):
+            if (start + timedelta(days=offset)).weekday() not in weekend:
+                bits |= 1 << offset
+
+        # استثناءات الشركة أولاً ثم استثناءات القسم (تتقدم عليها)
+        cursor.execute('''
+            SELECT calendar_date, is_working_day
+            FROM WorkCalendar
+            WHERE calendar_date >= ? AND calendar_date < ?
+              AND department_id IN (?, ?)
+            ORDER BY CASE WHEN department_id = ? THEN 0 ELSE 1 END, calendar_date
+        ''', (start, start + timedelta(days=days_in_month), ALL_DEPARTMENTS, department_id, ALL_DEPARTMENTS))
+        for row in cursor.fetchall():
+            bit = 1 << (row.calendar_date.day - 1)
+            bits = bits | bit if row.is_working_day else bits & ~bit
+
+        return bits, bin(bits).count('1')
+
+    def _month(self, year, month, department_id=None):
+        department_id = department_id or ALL_DEPARTMENTS
+        key = (department_id, year, month)
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at > CACHE_TTL:
+            self.invalidate()
+        cached = self._months.get(key)
+        if cached is not None:
+            return cached
+
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        try:
+            cursor = conn.cursor()
+            with self._lock:
+                if self._weekends is None:
+                    self._weekends = self._load_weekends(cursor)
+                    self._loaded_at = time.monotonic()
+                # نسخة محلية: invalidate متزامن يعيد self._weekends إلى None
+                weekends = self._weekends
+                generation = self._generation
+            entry = self._build_month(cursor, weekends, department_id, year, month)
+        finally:
+            conn.close()
+
+        with self._lock:
+            if self._generation == generation:
+                if len(self._months) >= MAX_CACHED_MONTHS:
+                    self._months.clear()
+                self._months[key] = entry
+        return entry
+
+    def invalidate(self):
+        """بعد تعديل الإجازات أو العطلة الأسبوعية"""
+        with self._lock:
+            self._months = {}
+            self._weekends = None
+            self._loaded_at = None
+            self._generation += 1
+
+    # ---------- الاستعلام ----------
+
+    def working_days(self, year, month, department_id=None):
+        """عدد أيام العمل في الشهر"""
+        return self._month(year, month, department_id)[1]
+
+    def is_working_day(self, day, department_id=None):
+        bits = self._month(day.year, day.month, department_id)[0]
+        return bool(bits >> (day.day - 1) & 1)
+
+    def working_days_between(self, start, end, department_id=None):
+        """عدد أيام العمل في الفترة [start, end) (للرواتب والإجازات)"""
+        total = 0
+        current = start
+        while current < end:
+            days_in_month = calendar.monthrange(current.year, current.month)[1]
+            next_month = date(current.year, current.month, days_in_month) + timedelta(days=1)
+            bits = self._month(current.year, current.month, department_id)[0]
+            # بتات الأيام من current حتى نهاية الفترة داخل هذا الشهر
+            first = current.day - 1
+            last = (min(end, next_month) - timedelta(days=1)).day
+            mask = ((1 << last) - 1) & ~((1 << first) - 1)
+            total += bin(bits & mask).count('1')
+            current = next_month
+        return total
+
+    def month_days(self, year, month, department_id=None):
+        """أيام الشهر مع حالة كل يوم (للعرض)"""
+        bits = self._month(year, month, department_id)[0]
+        return [{'date': date(year, month, day).isoformat(), 'is_working_day': bool(bits >> (day - 1) & 1)}
+                for day in range(1, calendar.monthrange(year, month)[1] + 1)]
+
+
+# ==================== التعديل ====================
+
+def set_calendar_day(conn, calendar_date, is_working_day, name=None, department_id=None):
+    """إضافة/تعديل استثناء ليوم (إجازة أو يوم عمل تعويضي)"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        MERGE WorkCalendar WITH (HOLDLOCK) AS t
+        USING (SELECT ? AS department_id, ? AS calendar_date) AS s
+        ON t.department_id = s.department_id AND t.calendar_date = s.calendar_date
+        WHEN MATCHED THEN
+            UPDATE SET is_working_day = ?, name = ?
+        WHEN NOT MATCHED THEN
+            INSERT (department_id, calendar_date, is_working_day, name)
+            VALUES (s.department_id, s.calendar_date, ?, ?);
+    ''', (department_id or ALL_DEPARTMENTS, calendar_date, int(is_working_day), name,
+          int(is_working_day), name))
+    conn.commit()
+    work_calendar.invalidate()
+
+
+def remove_calendar_day(conn, calendar_date, department_id=None):
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM WorkCalendar WHERE department_id = ? AND calendar_date = ?',
+                   (department_id or ALL_DEPARTMENTS, calendar_date))
+    conn.commit()
+    work_calendar.invalidate()
+    return cursor.rowcount > 0
+
+
+def set_department_weekend(conn, department_id, weekend_days):
+    weekend = parse_weekend(weekend_days)
+    cursor = conn.cursor()
+    cursor.execute('''
+        MERGE DepartmentWeekends WITH (HOLDLOCK) AS t
+        USING (SELECT ? AS department_id) AS s
+        ON t.department_id = s.department_id
+        WHEN MATCHED THEN UPDATE SET weekend_days = ?
+        WHEN NOT MATCHED THEN INSERT (department_id, weekend_days) VALUES (s.department_id, ?);
+    ''', (department_id or ALL_DEPARTMENTS, ','.join(map(str, weekend)), ','.join(map(str, weekend))))
+    conn.commit()
+    work_calendar.invalidate()
+    return weekend
+
+
+work_calendar = WorkCalendar()
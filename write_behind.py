@@ -0,0 +1,439 @@
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import pyodbc
+
+import attendance_events
+from attendance_events import ACTIONS, MAX_BATCH_EVENTS, AttendanceEventError, idempotency_cache
+from db_pool import get_db_connection
+from presence_index import presence_index
+from shift_rules import shift_rules
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# سجل لكل عملية (الجهاز والـ pid): تفريغ أو ضغط سجل عامل لا يمس أحداث عامل آخر
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+JOURNAL_PATTERN = 'attendance_journal*.log'
+# أحداث تفشل كتابتها وحدها مرة بعد مرة تُنقل إلى هذا الملف حتى لا توقف الطابور
+DEAD_LETTER_FILE = 'attendance_dead_letter.log'
+MAX_EVENT_ATTEMPTS = 5
+FLUSH_BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+MAX_PENDING = 50000
+MAX_RETRY_DELAY = 30
+COMPACT_JOURNAL_BYTES = 16 * 1024 * 1024
+# كتابات العمال الآخرين والمهام الليلية لا تمر بهذه العملية، فاليوم يُعاد تحميله دورياً
+DAY_TTL = 60
+
+
+def _journal_name():
+    return f'attendance_journal.{socket.gethostname()}.{os.getpid()}.log'
+
+
+def _try_lock(journal):
+    """قفل حصري بدون انتظار على السجل؛ يبقى ما دامت العملية تحتفظ بالملف مفتوحاً"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            journal.seek(0)
+            msvcrt.locking(journal.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _read_events(journal):
+    events = []
+    journal.seek(0)
+    for line in journal:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            # آخر سطر قد يكون ناقصاً إذا توقفت العملية أثناء الكتابة
+            continue
+    return events
+
+
+class DayPresence:
+    """من سجل حضوره ومن سجل انصرافه في يوم واحد (يُحمل من قاعدة البيانات ويُحدّث بعد كل commit)"""
+
+    def __init__(self, rows):
+        self.checked_in = set()
+        self.checked_out = set()
+        self.loaded_at = time.monotonic()
+        self.add_rows(rows)
+
+    def add_rows(self, rows):
+        """صفوف حضور مكتوبة؛ المجموعات تكبر فقط لأن الحضور والانصراف لا يُلغيان"""
+        for row in rows:
+            if row.check_in is None:
+                continue
+            self.checked_in.add(row.employee_id)
+            if row.check_out is not None:
+                self.checked_out.add(row.employee_id)
+
+    def validate(self, employee_id, action):
+        """نفس قواعد MERGE في attendance_events: يعيد كود النتيجة"""
+        if action == 'check_in':
+            return 'already_checked_in' if employee_id in self.checked_in else 'check_in'
+        if employee_id not in self.checked_in:
+            return 'not_checked_in'
+        return 'already_checked_out' if employee_id in self.checked_out else 'check_out'
+
+    def apply(self, employee_id, action):
+        (self.checked_in if action == 'check_in' else self.checked_out).add(employee_id)
+
+
+class WriteBehindQueue:
+    """
+    وضع الكتابة المؤجلة لذروة تسجيل الحضور الصباحية.
+    الحدث يُتحقق منه مقابل مجموعات الحضور اليومية في الذاكرة، ويُكتب في سجل محلي
+    (journal مع fsync) ثم يُرد عليه فوراً، وعامل في الخلفية يكتبه إلى Attendance على
+    دفعات عبر attendance_events.apply_events (نفس MERGE ومفاتيح التكرار والملخصات والبث).
+    كل حدث يحمل مفتاح تكرار، فإعادة تشغيل السجل بعد انقطاع لا تكرر أي سجل.
+    لكل عملية سجلها المقفول، وعند التشغيل تتبنى سجلات العمليات المتوقفة (غير المقفولة).
+    """
+
+    def __init__(self, journal_dir=JOURNAL_DIR, batch_size=FLUSH_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.journal_dir = journal_dir
+        self.journal_path = None  # يُحدد عند start() بعد أي fork
+        self.batch_size = min(batch_size, MAX_BATCH_EVENTS)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = deque()      # (وقت القبول، الحدث)
+        self._pending_keys = {}      # المفتاح -> نتيجة القبول (لإعادة المحاولة قبل الكتابة)
+        self._days = {}              # التاريخ -> DayPresence
+        self._isolate = 0            # أحداث تُكتب واحداً واحداً بعد فشل دفعة
+        self._attempts = {}          # المفتاح -> محاولات فاشلة للحدث وحده
+        self._journal = None
+        self._worker = None
+        self.metrics = {
+            'accepted': 0,
+            'rejected': 0,
+            'throttled': 0,
+            'flushed': 0,
+            'flush_batches': 0,
+            'flush_failures': 0,
+            'corrected': 0,
+            'replayed': 0,
+            'dead_lettered': 0,
+            'last_flush_ms': None,
+            'last_flush_size': 0,
+            'last_error': None,
+        }
+
+    # ---------- التشغيل ----------
+
+    def start(self):
+        """فتح السجل وإعادة تشغيل ما لم يُكتب منه ثم تشغيل العامل"""
+        if self._worker is not None:
+            return
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(self.journal_dir, _journal_name())
+        self._journal = open(self.journal_path, 'a+', encoding='utf-8')
+        if not _try_lock(self._journal):
+            raise RuntimeError(f'السجل المؤجل مستخدم من عملية أخرى: {self.journal_path}')
+        replayed = _read_events(self._journal) + self._adopt_journals()
+        with self._lock:
+            for event in replayed:
+                self._pending.append((time.monotonic(), event))
+                self._pending_keys[event['idempotency_key']] = None
+            self.metrics['replayed'] = len(replayed)
+        if replayed:
+            print(f"🔁 إعادة تشغيل {len(replayed)} حدث حضور من السجل المؤجل")
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _adopt_journals(self):
+        """
+        نقل أحداث سجلات العمليات المتوقفة إلى سجل هذه العملية (fsync) ثم حذفها.
+        السجل المقفول يخص عاملاً يعمل فيُترك؛ وتبني نفس السجل مرتين لا يكرر شيئاً بفضل مفاتيح التكرار.
+        """
+        adopted = []
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, JOURNAL_PATTERN))):
+            if os.path.abspath(path) == os.path.abspath(self.journal_path):
+                continue
+            try:
+                with open(path, 'r+', encoding='utf-8') as journal:
+                    if not _try_lock(journal):
+                        continue
+                    events = _read_events(journal)
+                    if events:
+                        self._journal.write(''.join(json.dumps(event, ensure_ascii=False) + '\n'
+                                                    for event in events))
+                        self._journal.flush()
+                        os.fsync(self._journal.fileno())
+                        adopted += events
+                os.remove(path)
+            except OSError as e:
+                print(f"❌ تعذر تبني السجل المؤجل {path}: {e}")
+        return adopted
+
+    # ---------- القبول ----------
+
+    def _day(self, day):
+        presence = self._days.get(day)
+        if presence is not None and time.monotonic() - presence.loaded_at <= DAY_TTL:
+            return presence
+        conn = get_db_connection()
+        if not conn:
+            if presence is not None:
+                # MERGE عند الكتابة يصحح أي حدث قُبل من نسخة قديمة
+                return presence
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        try:
+            cursor = conn.cursor()
+            # صفوف الغياب التلقائي بلا حضور لا تمنع تسجيل الحضور
+            cursor.execute('''
+                SELECT employee_id, check_in, check_out FROM Attendance
+                WHERE attendance_date = ? AND check_in IS NOT NULL
+            ''', (day,))
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            presence = self._days.get(day)
+            if presence is not None:
+                # إعادة التحميل تضيف فقط: ما قُبل في الذاكرة إما في الطابور أو كُتب
+                presence.add_rows(rows)
+                presence.loaded_at = time.monotonic()
+            else:
+                presence = self._days[day] = DayPresence(rows)
+                # أحداث مقبولة لم تُكتب بعد (ومنها المعاد تشغيلها من السجل)
+                for _, event in self._pending:
+                    moment = datetime.fromisoformat(event['timestamp'])
+                    if shift_rules.shift_day(event['employee_id'], moment) == day:
+                        presence.apply(event['employee_id'], event['action'])
+                # الأيام القديمة لا تستقبل أحداثاً بعد MAX_EVENT_AGE
+                for old_day in [old for old in self._days if (day - old) > attendance_events.MAX_EVENT_AGE]:
+                    del self._days[old_day]
+        return presence
+
+    def observe(self, rows):
+        """مستمع attendance_events بعد commit (الكتابة المباشرة واستيراد البصمات وهذا الطابور)"""
+        with self._lock:
+            for row in rows:
+                day = row.attendance_date
+                if isinstance(day, str):
+                    day = datetime.strptime(day[:10], '%Y-%m-%d').date()
+                presence = self._days.get(day)
+                if presence is not None:
+                    presence.add_rows([row])
+
+    def submit(self, events):
+        """
+        قبول دفعة أحداث؛ يعيد النتائج بنفس ترتيب الإدخال، أو None عندما يكون الطابور
+        ممتلئاً (على المستدعي الرجوع إلى الكتابة المباشرة).
+        """
+        if not isinstance(events, list) or not events:
+            raise AttendanceEventError('لا توجد أحداث')
+        if len(events) > MAX_BATCH_EVENTS:
+            raise AttendanceEventError(f'الحد الأقصى {MAX_BATCH_EVENTS} حدث في الطلب الواحد')
+        if len(self._pending) + len(events) > self.max_pending:
+            self.metrics['throttled'] += len(events)
+            return None
+
+        presence_index.ensure_fresh()
+        now = datetime.now().replace(microsecond=0)
+        results = [None] * len(events)
+        accepted = []
+        seen = {}  # المفتاح -> الكود داخل هذه الدفعة
+        for index, event in enumerate(events):
+            try:
+                employee_id, day, action, moment = attendance_events._parse_event(event, now)
+                key = attendance_events._parse_key(event.get('idempotency_key'))
+            except ValueError as e:
+                results[index] = attendance_events._result(event, str(e))
+                continue
+            if key is not None:
+                cached = (seen[key], None) if key in seen else idempotency_cache.get(key)
+                if cached is None and key in self._pending_keys:
+                    cached = (self._pending_keys[key], None)
+                if cached is not None and cached[0]:
+                    results[index] = attendance_events._result(event, cached[0], cached[1], duplicate=True)
+                    continue
+            if presence_index.employee(employee_id) is None:
+                code = 'unknown_employee'
+            else:
+                presence = self._day(day)
+                with self._lock:
+                    code = presence.validate(employee_id, action)
+                    if code in ACTIONS:
+                        presence.apply(employee_id, action)
+            event = {
+                'employee_id': employee_id,
+                'action': action,
+                'timestamp': moment.isoformat(),
+                'idempotency_key': key or uuid.uuid4().hex,
+            }
+            if key is not None:
+                seen[key] = code
+            results[index] = attendance_events._result(event, code)
+            results[index]['queued'] = code in ACTIONS
+            if code in ACTIONS:
+                accepted.append(event)
+            else:
+                self.metrics['rejected'] += 1
+
+        if accepted:
+            self._append(accepted)
+        return results
+
+    def _append(self, events):
+        """كتابة الأحداث في السجل (fsync) قبل الرد ثم إضافتها للطابور"""
+        lines = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+        with self._lock:
+            self._journal.write(lines)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            accepted_at = time.monotonic()
+            for event in events:
+                self._pending.append((accepted_at, event))
+                self._pending_keys[event['idempotency_key']] = event['action']
+            self.metrics['accepted'] += len(events)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    # ---------- الكتابة إلى قاعدة البيانات ----------
+
+    def _run(self):
+        delay = self.flush_interval
+        while True:
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            try:
+                while self._pending:
+                    self.flush_once()
+                delay = self.flush_interval
+            except Exception as e:
+                self.metrics['flush_failures'] += 1
+                self.metrics['last_error'] = str(e)
+                print(f"❌ تعذر كتابة أحداث الحضور المؤجلة: {e}")
+                delay = min(max(delay * 2, 1), MAX_RETRY_DELAY)
+
+    def flush_once(self):
+        """
+        كتابة دفعة واحدة من أقدم الأحداث في معاملة واحدة.
+        بعد فشل دفعة تُكتب أحداثها واحداً واحداً، والحدث الذي يفشل وحده MAX_EVENT_ATTEMPTS مرة
+        (لغير انقطاع الاتصال) يُنقل إلى ملف الأحداث المرفوضة فلا يوقف ما بعده.
+        """
+        with self._lock:
+            size = 1 if self._isolate else self.batch_size
+            batch = [event for _, event in list(self._pending)[:size]]
+        if not batch:
+            return 0
+        started = time.perf_counter()
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('خطأ في الاتصال بقاعدة البيانات')
+        try:
+            results = attendance_events.apply_events(conn, batch)
+        except Exception as e:
+            if len(batch) > 1:
+                self._isolate = len(batch)
+                raise
+            if isinstance(e, pyodbc.OperationalError):
+                raise
+            key = batch[0]['idempotency_key']
+            self._attempts[key] = self._attempts.get(key, 0) + 1
+            if self._attempts[key] < MAX_EVENT_ATTEMPTS:
+                raise
+            self._dead_letter(batch[0], e)
+            results = None
+        finally:
+            conn.close()
+
+        with self._lock:
+            for _ in batch:
+                _, event = self._pending.popleft()
+                self._pending_keys.pop(event['idempotency_key'], None)
+                self._attempts.pop(event['idempotency_key'], None)
+            self._isolate = max(self._isolate - len(batch), 0)
+            for event, result in zip(batch, results or ()):
+                # قاعدة البيانات هي المرجع: حدث قُبل في الذاكرة ورفضه MERGE (عامل آخر سبقه مثلاً)
+                if not result['success'] and not result['duplicate']:
+                    self.metrics['corrected'] += 1
+                    print(f"⚠️ حدث حضور مؤجل رُفض عند الكتابة: {event['employee_id']} {result['code']}")
+            self.metrics['flushed'] += len(results or ())
+            self.metrics['flush_batches'] += 1
+            self.metrics['last_flush_size'] = len(batch)
+            self.metrics['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            self.metrics['last_error'] = None
+            if not self._pending:
+                self._journal.flush()
+                self._journal.truncate(0)
+            elif self._journal_bytes() > COMPACT_JOURNAL_BYTES:
+                self._compact_locked()
+        return len(batch)
+
+    def _dead_letter(self, event, error):
+        """حفظ الحدث مع سبب الفشل (fsync) قبل حذفه من الطابور والسجل"""
+        line = json.dumps(dict(event, error=str(error), failed_at=datetime.now().isoformat(timespec='seconds')),
+                          ensure_ascii=False)
+        with open(os.path.join(self.journal_dir, DEAD_LETTER_FILE), 'a', encoding='utf-8') as dead_letter:
+            dead_letter.write(line + '\n')
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+        self.metrics['dead_lettered'] += 1
+        print(f"❌ حدث حضور مؤجل نُقل إلى {DEAD_LETTER_FILE} بعد {MAX_EVENT_ATTEMPTS} محاولات: "
+              f"{event['employee_id']} {error}")
+
+    def _journal_bytes(self):
+        return os.fstat(self._journal.fileno()).st_size if self._journal else 0
+
+    def _compact_locked(self):
+        """إعادة كتابة السجل بالأحداث المتبقية فقط (الملف المؤقت يُقفل قبل أن يحل محله)"""
+        temporary = self.journal_path + '.tmp'
+        journal = open(temporary, 'w+', encoding='utf-8')
+        for _, event in self._pending:
+            journal.write(json.dumps(event, ensure_ascii=False) + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+        if fcntl is not None:
+            _try_lock(journal)
+            os.replace(temporary, self.journal_path)
+            self._journal.close()
+            self._journal = journal
+        else:
+            # Windows لا يستبدل ملفاً مفتوحاً
+            journal.close()
+            self._journal.close()
+            os.replace(temporary, self.journal_path)
+            self._journal = open(self.journal_path, 'a+', encoding='utf-8')
+            _try_lock(self._journal)
+
+    # ---------- المقاييس ----------
+
+    def stats(self):
+        with self._lock:
+            oldest = self._pending[0][0] if self._pending else None
+            journal_bytes = self._journal_bytes()
+            return dict(
+                self.metrics,
+                running=self._worker is not None,
+                pending=len(self._pending),
+                max_pending=self.max_pending,
+                utilization=round(len(self._pending) / self.max_pending * 100, 1),
+                oldest_pending_seconds=round(time.monotonic() - oldest, 1) if oldest else 0,
+                journal_bytes=journal_bytes,
+                tracked_days=len(self._days),
+            )
+
+
+write_behind_queue = WriteBehindQueue()
+attendance_events.add_commit_listener(write_behind_queue.observe)